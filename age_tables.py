@@ -0,0 +1,168 @@
+# age_tables.py
+# Reading and aligning the census age tables (auslan_age_<year>): column detection, one
+# UNION ALL query for several tables, and band alignment. Used by the violin app and by
+# census_summary, each with its own engine.
+import re
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, text
+from sqlalchemy.exc import SQLAlchemyError
+
+AGE_COL = "Age_years"
+TABLE_NAME_RE = re.compile(r"^[A-Za-z0-9_]+$")
+TABLE_YEAR_RE = re.compile(r"(\d{4})$")
+
+# table -> (raw age column, raw value column, cleaned value column)
+_age_columns_cache: dict[str, tuple[str, str, str]] = {}
+
+
+def quote_ident(name: str) -> str:
+    return "`" + name.replace("`", "``") + "`"
+
+
+def detect_value_col(columns: list[str], table: str) -> str | None:
+    """
+    Pick the count column, e.g. '2021 Auslan'.
+    Prefers the year in the table name (auslan_age_2016 -> '2016 ...'), then '2021'.
+    """
+    m = TABLE_YEAR_RE.search(table)
+    for year in ([m.group(1)] if m else []) + ["2021"]:
+        matches = [c for c in columns if year in c]
+        if matches:
+            return matches[0]
+    return None
+
+
+def age_tables_columns(engine, tables: list[str]) -> dict[str, tuple[str, str, str]]:
+    """
+    Resolve (raw age column, raw value column, cleaned value column) for several age tables.
+    Cached per table; uncached tables are resolved together with one information_schema query.
+    """
+    for table in tables:
+        if not TABLE_NAME_RE.match(table):
+            raise ValueError(f"Invalid table name: {table!r}")
+
+    missing = [t for t in tables if t not in _age_columns_cache]
+    if missing:
+        sql = text("""
+            SELECT TABLE_NAME, COLUMN_NAME
+            FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN :tables
+            ORDER BY TABLE_NAME, ORDINAL_POSITION
+        """).bindparams(bindparam("tables", expanding=True))
+        with engine.connect() as conn:
+            found: dict[str, list[str]] = {}
+            for table_name, column_name in conn.execute(sql, {"tables": missing}):
+                found.setdefault(table_name, []).append(column_name)
+
+        for table in missing:
+            if table not in found:
+                raise ValueError(f"Table '{table}' not found.")
+            cleaned = {c.strip(): c for c in found[table]}
+            # case-insensitive, so tables reloaded with normalized names (age_years) still resolve
+            raw_age = next((raw for c, raw in cleaned.items() if c.lower() == AGE_COL.lower()), None)
+            if raw_age is None:
+                raise ValueError(f"Column 'Age_years' not found in table '{table}'.")
+            value_col = detect_value_col(list(cleaned), table)
+            if value_col is None:
+                raise ValueError(f"No column containing '2021' found in table '{table}'.")
+            _age_columns_cache[table] = (raw_age, cleaned[value_col], value_col)
+
+    return {t: _age_columns_cache[t] for t in tables}
+
+
+def age_start_of(ages: pd.Series) -> np.ndarray:
+    """
+    Start age of each categorical label ('0-4 years' -> 0, '100 years and over' -> 100, else -1).
+    Parsed once per distinct label, then broadcast through the category codes.
+    """
+    labels = ages.cat.categories.astype(str).str.lower()
+    lead = pd.to_numeric(labels.str.extract(r"^(\d+)", expand=False), errors="coerce")
+    starts = np.where(labels.str.contains("100", regex=False), 100, np.nan_to_num(lead, nan=-1))
+    # code -1 (missing label) picks the trailing -1
+    return np.append(starts, -1).astype(np.int16)[ages.cat.codes.to_numpy()]
+
+
+def band_label_mask(ages: pd.Series) -> np.ndarray:
+    """
+    Per-row mask of real age bands: drops missing labels, a repeated header row and totals.
+    """
+    labels = ages.cat.categories.astype(str).str.lower()
+    keep_label = np.append((labels != "age_years") & ~labels.str.contains("total", regex=False), False)
+    return keep_label[ages.cat.codes.to_numpy()]
+
+
+def load_age_frames(engine, tables: list[str]) -> tuple[pd.DataFrame, dict[str, str]]:
+    """
+    Read several age tables in one UNION ALL query.
+    Returns a long DataFrame (table, Age_years, value, age_start) and {table: value_col}.
+    """
+    columns = age_tables_columns(engine, tables)
+    parts, params = [], {}
+    for i, table in enumerate(tables):
+        raw_age, raw_value, _ = columns[table]
+        params[f"t{i}"] = table
+        parts.append(
+            f"SELECT :t{i} AS src, {quote_ident(raw_age)} AS age, {quote_ident(raw_value)} AS value "
+            f"FROM {quote_ident(table)}"
+        )
+    try:
+        with engine.connect() as conn:
+            rows = conn.execute(text(" UNION ALL ".join(parts)), params).all()
+    except SQLAlchemyError:
+        # a reload may have changed the columns; resolve them again next time
+        for table in tables:
+            _age_columns_cache.pop(table, None)
+        raise
+
+    ages = pd.Series([r[1] for r in rows], dtype="category")
+    values = pd.to_numeric(pd.Series([r[2] for r in rows], dtype=object), errors="coerce")
+    df = pd.DataFrame({
+        "table": pd.Categorical([r[0] for r in rows], categories=tables),
+        AGE_COL: ages,
+        "value": values.fillna(0).to_numpy(dtype=np.int32),
+    })
+    df["age_start"] = age_start_of(ages)
+    return df, {t: columns[t][2] for t in tables}
+
+
+def align_age_bands(df: pd.DataFrame, tables: list[str], male_ratio: float = 0.51) -> dict:
+    """
+    Align the long frame from load_age_frames onto the union of age bands (oldest first).
+    Returns band labels/starts and a (tables x bands) grid per measure; bands a table lacks are None.
+    """
+    ages = df[AGE_COL]
+    keep = np.flatnonzero(band_label_mask(ages))
+    band_codes = ages.cat.codes.to_numpy()[keep]
+    table_codes = df["table"].cat.codes.to_numpy()[keep]
+    values = df["value"].to_numpy()[keep].astype(np.int64)
+    starts = df["age_start"].to_numpy()[keep]
+
+    # distinct bands ordered by start age (desc), ties by label order
+    present, first = np.unique(band_codes, return_index=True)
+    order = present[np.lexsort((present, -starts[first].astype(np.int32)))]
+    position = np.full(len(ages.cat.categories), -1)
+    position[order] = np.arange(len(order))
+
+    totals = np.zeros((len(tables), len(order)), dtype=np.int64)
+    seen = np.zeros_like(totals, dtype=bool)
+    np.add.at(totals, (table_codes, position[band_codes]), values)
+    seen[table_codes, position[band_codes]] = True
+
+    band_start = np.zeros(len(order), dtype=np.int16)
+    band_start[position[band_codes]] = starts
+
+    male = np.floor(totals * male_ratio).astype(np.int64)
+    female = totals - male
+
+    def grid(a: np.ndarray) -> list[list]:
+        return [[int(v) if s else None for v, s in zip(row, seen_row)] for row, seen_row in zip(a, seen)]
+
+    return {
+        "age_bands": [str(c) for c in ages.cat.categories[order]],
+        "age_start": band_start.tolist(),
+        "totals": grid(totals),
+        "Male": grid(male),
+        "Female": grid(female),
+    }
@@ -0,0 +1,338 @@
+# catalog_snapshot.py
+# Immutable, memory-mapped snapshot of the video catalog and census summary tables.
+#
+# Ingest / summary rebuilds publish a new version directory and flip the CURRENT pointer:
+#
+#   catalog_snapshot/
+#     CURRENT                       -> "v1760851200123-3f2a9c1e"
+#     v1760851200123-3f2a9c1e/
+#       manifest.json               tables, columns, row counts, catalog stats
+#       videos.id.npy               int64 (+ videos.id.null.npy when the column has NULLs)
+#       videos.duration_s.npy       float64, NaN = NULL
+#       videos.filename.offsets.npy int64 offsets into videos.filename.bin.npy (UTF-8 bytes)
+#       *.null.npy                  bool mask, only written for columns that contain NULLs
+#
+# Workers np.load(..., mmap_mode="r") the arrays, so every process shares the same page-cache
+# pages and reads need no MySQL connection. A stat of CURRENT (at most once per
+# SNAPSHOT_CHECK_S) picks up new versions; old mappings stay valid until unreferenced.
+#
+#   python catalog_snapshot.py          # publish from MySQL
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import text
+
+from s3_toSQL import COLLECTION_KEY_PREFIX, COLLECTIONS, get_db_engine
+
+# ---------- Settings ----------
+SNAPSHOT_DIR = os.getenv("CATALOG_SNAPSHOT_DIR", "./catalog_snapshot")
+SNAPSHOT_ENABLED = os.getenv("CATALOG_SNAPSHOT_ENABLED", "1") == "1"
+SNAPSHOT_CHECK_S = float(os.getenv("CATALOG_SNAPSHOT_CHECK_S", "1"))
+SNAPSHOT_KEEP = 3  # versions kept on disk (readers may still map older ones)
+
+CATALOG_COLUMNS = [
+    "id", "filename", "s3_key", "etag", "size_bytes", "hls_key", "poster_key", "sprite_key",
+    "duration_s", "width", "height", "video_codec", "audio_codec", "bitrate",
+]
+SUMMARY_TABLES = {
+    "summary_population_year": "ORDER BY year_order",
+    "summary_state_population": "ORDER BY state_rank, state_name",
+    "summary_age_band": "ORDER BY source_table, age_start DESC",
+}
+
+
+# ---------- Writing ----------
+def _column_kind(values: Sequence[Any]) -> str:
+    present = [v for v in values if v is not None]
+    if present and all(isinstance(v, (int, np.integer)) and not isinstance(v, bool) for v in present):
+        return "int"
+    if present and all(isinstance(v, (int, float, Decimal, np.number)) and not isinstance(v, bool) for v in present):
+        return "float"
+    return "str"
+
+
+def _write_column(base: str, values: Sequence[Any]) -> str:
+    kind = _column_kind(values)
+    if kind == "int":
+        np.save(base + ".npy", np.array([0 if v is None else int(v) for v in values], dtype=np.int64))
+        if any(v is None for v in values):
+            np.save(base + ".null.npy", np.array([v is None for v in values], dtype=np.bool_))
+    elif kind == "float":
+        np.save(base + ".npy", np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64))
+    else:
+        offsets = np.empty(len(values) + 1, dtype=np.int64)
+        offsets[0] = 0
+        chunks: List[bytes] = []
+        nulls = np.zeros(len(values), dtype=np.bool_)
+        pos = 0
+        for i, v in enumerate(values):
+            if v is None:
+                nulls[i] = True
+            else:
+                b = str(v).encode("utf-8")
+                chunks.append(b)
+                pos += len(b)
+            offsets[i + 1] = pos
+        np.save(base + ".offsets.npy", offsets)
+        np.save(base + ".bin.npy", np.frombuffer(b"".join(chunks), dtype=np.uint8))
+        if nulls.any():
+            np.save(base + ".null.npy", nulls)
+    return kind
+
+
+def _write_table(version_dir: str, name: str, columns: List[str], rows: List[Dict]) -> Dict:
+    kinds = {c: _write_column(os.path.join(version_dir, f"{name}.{c}"), [r.get(c) for r in rows]) for c in columns}
+    return {"rows": len(rows), "columns": kinds}
+
+
+def catalog_stats(rows: List[Dict]) -> Dict:
+    durations = [r["duration_s"] for r in rows if r.get("duration_s") is not None]
+    codecs: Dict[str, int] = {}
+    for r in rows:
+        if r.get("video_codec"):
+            codecs[r["video_codec"]] = codecs.get(r["video_codec"], 0) + 1
+    return {
+        "count": len(rows),
+        "with_hls": sum(1 for r in rows if r.get("hls_key")),
+        "with_poster": sum(1 for r in rows if r.get("poster_key")),
+        "total_duration_s": round(sum(durations), 3),
+        "avg_duration_s": round(sum(durations) / len(durations), 3) if durations else None,
+        "total_bytes": sum(r.get("size_bytes") or 0 for r in rows),
+        "video_codecs": codecs,
+    }
+
+
+def _read_sources(engine) -> Dict[str, Dict]:
+    """Rows of every collection and summary table that exists: {name: {"columns", "rows", ...}}."""
+    tables: Dict[str, Dict] = {}
+    with engine.connect() as conn:
+        existing = {r[0] for r in conn.execute(text(
+            "SELECT TABLE_NAME FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE()"
+        ))}
+        for collection, table in COLLECTIONS.items():
+            if table not in existing:
+                continue
+            present = {r[0] for r in conn.execute(text("""
+                SELECT COLUMN_NAME FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :t
+            """), {"t": table})}
+            cols = [c for c in CATALOG_COLUMNS if c in present]
+            sql = f"SELECT {', '.join(cols)} FROM {table} WHERE 1=1"
+            if collection in COLLECTION_KEY_PREFIX:
+                sql += f" AND s3_key LIKE '{COLLECTION_KEY_PREFIX[collection]}%'"
+            rows = [dict(r._mapping) for r in conn.execute(text(sql + " ORDER BY id, s3_key"))]
+            tables[collection] = {"columns": cols, "rows": rows, "stats": catalog_stats(rows)}
+        for table, order in SUMMARY_TABLES.items():
+            if table not in existing:
+                continue
+            result = conn.execute(text(f"SELECT * FROM {table} {order}"))
+            tables[table] = {"columns": list(result.keys()), "rows": [dict(r._mapping) for r in result]}
+    return tables
+
+
+def publish_snapshot(engine=None, root: str = SNAPSHOT_DIR) -> Dict:
+    """Read the catalog + summaries from MySQL, write a new version and point CURRENT at it."""
+    engine = engine or get_db_engine()
+    started = time.perf_counter()
+    sources = _read_sources(engine)
+
+    os.makedirs(root, exist_ok=True)
+    digest = hashlib.sha1(json.dumps(
+        {k: v["rows"] for k, v in sources.items()}, default=str, sort_keys=True).encode()).hexdigest()[:8]
+    version = f"v{time.time_ns() // 1_000_000}-{digest}"
+    tmp_dir = os.path.join(root, f".tmp-{version}-{os.getpid()}")
+    os.makedirs(tmp_dir)
+    try:
+        manifest = {"version": version, "created_at": time.time(), "tables": {}}
+        for name, src in sources.items():
+            entry = _write_table(tmp_dir, name, src["columns"], src["rows"])
+            if "stats" in src:
+                entry["stats"] = src["stats"]
+            manifest["tables"][name] = entry
+        with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+            json.dump(manifest, f, default=str)
+        if os.path.isdir(os.path.join(root, version)):
+            shutil.rmtree(tmp_dir)  # same content published within the same millisecond
+        else:
+            os.replace(tmp_dir, os.path.join(root, version))
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    # flip the pointer atomically, then prune old versions
+    pointer_tmp = os.path.join(root, f".CURRENT-{os.getpid()}")
+    with open(pointer_tmp, "w") as f:
+        f.write(version)
+    os.replace(pointer_tmp, os.path.join(root, "CURRENT"))
+    versions = sorted(d for d in os.listdir(root) if d.startswith("v") and d != version)
+    for old in versions[:-(SNAPSHOT_KEEP - 1) or None]:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+
+    return {
+        "version": version,
+        "tables": {k: v["rows"] for k, v in manifest["tables"].items()},
+        "elapsed_s": round(time.perf_counter() - started, 3),
+    }
+
+
+def publish_after_update(engine=None) -> Dict:
+    """publish_snapshot() for the admin endpoints: a failed publish keeps the old version live."""
+    try:
+        return publish_snapshot(engine)
+    except Exception as e:
+        print(f"Catalog snapshot publish failed: {e}")
+        return {"error": str(e)}
+
+
+# ---------- Reading ----------
+class SnapshotTable:
+    """Column arrays of one table, memory-mapped; rows are decoded lazily."""
+
+    def __init__(self, version_dir: str, name: str, meta: Dict):
+        self.name = name
+        self.n = meta["rows"]
+        self.kinds: Dict[str, str] = meta["columns"]
+        self.stats: Optional[Dict] = meta.get("stats")
+        self._cols: Dict[str, tuple] = {}
+        for col, kind in self.kinds.items():
+            base = os.path.join(version_dir, f"{name}.{col}")
+            nulls = np.load(base + ".null.npy", mmap_mode="r") if os.path.exists(base + ".null.npy") else None
+            if kind == "str":
+                self._cols[col] = (kind, np.load(base + ".offsets.npy", mmap_mode="r"),
+                                   np.load(base + ".bin.npy", mmap_mode="r"), nulls)
+            else:
+                self._cols[col] = (kind, np.load(base + ".npy", mmap_mode="r"), None, nulls)
+        self._id_order = None
+        if self.kinds.get("id") == "int":
+            _, ids, _, id_nulls = self._cols["id"]
+            order = np.argsort(ids, kind="stable")
+            if id_nulls is not None:
+                order = order[~id_nulls[order]]  # rows without an id are listed, never looked up
+            self._id_order = order
+            self._sorted_ids = ids[order]
+        elif "id" in self.kinds:
+            id_nulls = self._cols["id"][3]
+            if self.n == 0 or (id_nulls is not None and id_nulls.all()):
+                # no id values at all: an empty index still answers "not found"
+                self._id_order = np.empty(0, dtype=np.int64)
+                self._sorted_ids = np.empty(0, dtype=np.int64)
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.kinds)
+
+    def value(self, col: str, i: int) -> Any:
+        kind, data, blob, nulls = self._cols[col]
+        if nulls is not None and nulls[i]:
+            return None
+        if kind == "str":
+            return blob[data[i]:data[i + 1]].tobytes().decode("utf-8")
+        if kind == "float":
+            v = float(data[i])
+            return None if v != v else v
+        return int(data[i])
+
+    def row(self, i: int, columns: Optional[Iterable[str]] = None) -> Dict:
+        return {c: self.value(c, i) for c in (columns or self.kinds)}
+
+    def has(self, columns: Iterable[str]) -> bool:
+        return all(c in self.kinds for c in columns)
+
+    def rows(self, columns: Optional[Iterable[str]] = None, where: Optional[Dict[str, Any]] = None) -> List[Dict]:
+        cols = list(columns or self.kinds)
+        indices: Iterable[int] = range(self.n)
+        if where:
+            indices = [i for i in indices if all(self.value(c, i) == v for c, v in where.items())]
+        return [self.row(i, cols) for i in indices]
+
+    def find_ids(self, ids: Iterable[int], columns: Optional[Iterable[str]] = None) -> Optional[Dict[int, Dict]]:
+        """
+        First row (catalog order) per id, via binary search over the sorted id column.
+        None when the id column is not integer-typed, so there is no index to search.
+        """
+        if self._id_order is None:
+            return None
+        found: Dict[int, Dict] = {}
+        for vid in ids:
+            i = int(np.searchsorted(self._sorted_ids, vid, side="left"))
+            if i < len(self._sorted_ids) and self._sorted_ids[i] == vid:
+                found[vid] = self.row(int(self._id_order[i]), columns)
+        return found
+
+
+class Snapshot:
+    def __init__(self, root: str, version: str):
+        self.version = version
+        version_dir = os.path.join(root, version)
+        with open(os.path.join(version_dir, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self.tables = {name: SnapshotTable(version_dir, name, meta) for name, meta in self.manifest["tables"].items()}
+
+    def table(self, name: str) -> Optional[SnapshotTable]:
+        return self.tables.get(name)
+
+
+class SnapshotStore:
+    """Current snapshot for this process; re-reads CURRENT at most every SNAPSHOT_CHECK_S."""
+
+    def __init__(self, root: str = SNAPSHOT_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        self._snapshot: Optional[Snapshot] = None
+        self._checked_at = 0.0
+        self.stats = {"swaps": 0, "load_errors": 0}
+
+    def current(self) -> Optional[Snapshot]:
+        if not SNAPSHOT_ENABLED:
+            return None
+        now = time.monotonic()
+        if now - self._checked_at < SNAPSHOT_CHECK_S:
+            return self._snapshot
+        with self._lock:
+            if now - self._checked_at < SNAPSHOT_CHECK_S:
+                return self._snapshot
+            self._checked_at = now
+            try:
+                with open(os.path.join(self.root, "CURRENT")) as f:
+                    version = f.read().strip()
+            except FileNotFoundError:
+                self._snapshot = None
+                return None
+            if self._snapshot is None or self._snapshot.version != version:
+                try:
+                    self._snapshot = Snapshot(self.root, version)
+                    self.stats["swaps"] += 1
+                except (OSError, ValueError, KeyError) as e:
+                    # keep serving the previous version (or fall back to MySQL)
+                    self.stats["load_errors"] += 1
+                    print(f"Catalog snapshot {version} could not be loaded: {e}")
+            return self._snapshot
+
+    def table(self, name: str, columns: Iterable[str] = ()) -> Optional[SnapshotTable]:
+        """The current version of `name` if it has `columns`, else None (caller reads MySQL)."""
+        snap = self.current()
+        table = snap.table(name) if snap else None
+        return table if table is not None and table.has(columns) else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        snap = self.current()
+        return {
+            "enabled": SNAPSHOT_ENABLED,
+            "version": snap.version if snap else None,
+            "tables": {name: t.n for name, t in snap.tables.items()} if snap else {},
+            **self.stats,
+        }
+
+
+snapshot_store = SnapshotStore()
+
+
+if __name__ == "__main__":
+    print(publish_snapshot())
@@ -0,0 +1,328 @@
+# census_loader.py
+# Bulk loader for census CSV/XLSX releases into typed MySQL tables.
+#
+#   python census_loader.py data/auslan_age_2021.csv --table auslan_age_2021
+#   python census_loader.py s3://my-bucket/census/state_years.xlsx --table auslan_population_state_years
+#
+# Rows are streamed in chunks into `<table>__staging`, then swapped in with one
+# RENAME TABLE, so readers never see an empty or half-loaded table.
+# Header names are kept as-is by default (the API queries e.g. `population_[0]` and
+# `2021State` by their raw names); a reload whose columns differ from the live table is
+# refused unless --allow-column-changes is given.
+import argparse
+import csv
+import io
+import os
+import re
+import tempfile
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+from sqlalchemy import text
+
+from census_summary import build_summaries, swap_tables
+from s3_toSQL import get_db_engine, s3_client
+
+CHUNK_ROWS = int(os.getenv("CENSUS_LOAD_CHUNK_ROWS", "5000"))
+LOAD_METHODS = ("insert", "load-data")
+EXCEL_EXTS = (".xlsx", ".xlsm", ".xls")
+TABLE_NAME_RE = re.compile(r"^[A-Za-z0-9_]+$")
+VARCHAR_MAX = 255
+
+
+# ---------- Column names ----------
+def normalize_column_name(name: str, index: int) -> str:
+    """'2021 Auslan' -> '2021_auslan', 'population_[0]' -> 'population_0'."""
+    cleaned = re.sub(r"[^0-9a-zA-Z]+", "_", str(name).strip()).strip("_").lower()
+    return cleaned or f"col_{index}"
+
+
+def column_names(raw: List[str], normalize: bool) -> List[str]:
+    names: List[str] = []
+    for i, c in enumerate(raw):
+        name = normalize_column_name(c, i) if normalize else str(c).strip()
+        base, n = name, 2
+        while name in names:
+            name, n = f"{base}_{n}", n + 1
+        names.append(name)
+    return names
+
+
+def quote_ident(name: str) -> str:
+    return "`" + name.replace("`", "``") + "`"
+
+
+# ---------- Sources ----------
+def split_s3_uri(uri: str) -> Tuple[str, str]:
+    bucket, _, key = uri[len("s3://"):].partition("/")
+    if not bucket or not key:
+        raise ValueError(f"Invalid S3 URI: {uri}")
+    return bucket, key
+
+
+def iter_source_chunks(source: str, chunk_rows: int = CHUNK_ROWS, sheet: Optional[str] = None) -> Iterator[pd.DataFrame]:
+    """
+    Yield DataFrame chunks from a local path or s3://bucket/key.
+    CSV is streamed straight from the file / S3 body; XLSX has to be read whole (zip format).
+    """
+    is_s3 = source.startswith("s3://")
+    ext = os.path.splitext(source.split("?", 1)[0])[1].lower()
+
+    if is_s3:
+        bucket, key = split_s3_uri(source)
+        fobj = s3_client().get_object(Bucket=bucket, Key=key)["Body"]
+    else:
+        fobj = open(source, "rb")
+
+    try:
+        if ext in EXCEL_EXTS:
+            data = io.BytesIO(fobj.read()) if is_s3 else fobj
+            df = pd.read_excel(data, sheet_name=sheet or 0)
+            for start in range(0, len(df), chunk_rows):
+                yield df.iloc[start:start + chunk_rows]
+        else:
+            yield from pd.read_csv(
+                fobj,
+                chunksize=chunk_rows,
+                thousands=",",
+                skipinitialspace=True,
+                encoding="utf-8-sig",
+            )
+    finally:
+        fobj.close()
+
+
+# ---------- Types ----------
+# numeric types a later chunk may widen to (TINYINT(1) -> BIGINT -> DOUBLE)
+NUMERIC_TYPES = ("TINYINT(1)", "BIGINT", "DOUBLE")
+PLACEHOLDER_TYPE = f"VARCHAR({VARCHAR_MAX})"  # column with no values seen yet
+
+
+def infer_sql_types(df: pd.DataFrame) -> List[Optional[str]]:
+    """MySQL column types of one chunk (all columns nullable); None for an all-null column."""
+    types: List[Optional[str]] = []
+    for _, col in df.convert_dtypes().items():
+        if col.isna().all():
+            types.append(None)
+        elif pd.api.types.is_bool_dtype(col):
+            types.append("TINYINT(1)")
+        elif pd.api.types.is_integer_dtype(col):
+            types.append("BIGINT")
+        elif pd.api.types.is_float_dtype(col):
+            types.append("DOUBLE")
+        elif pd.api.types.is_datetime64_any_dtype(col):
+            types.append("DATETIME")
+        else:
+            longest = col.dropna().astype(str).str.len().max()
+            longest = 0 if pd.isna(longest) else int(longest)
+            types.append(f"VARCHAR({VARCHAR_MAX})" if longest <= VARCHAR_MAX // 2 else "TEXT")
+    return types
+
+
+def widen_sql_type(current: Optional[str], seen: Optional[str]) -> Optional[str]:
+    """The narrowest type holding both: wider numeric, else VARCHAR, else TEXT."""
+    if current is None or seen is None or current == seen:
+        return seen if current is None else current
+    if current in NUMERIC_TYPES and seen in NUMERIC_TYPES:
+        return max(current, seen, key=NUMERIC_TYPES.index)
+    if "TEXT" in (current, seen):
+        return "TEXT"
+    return f"VARCHAR({VARCHAR_MAX})"
+
+
+def widen_sql_types(current: List[Optional[str]], seen: List[Optional[str]]) -> List[Optional[str]]:
+    return [widen_sql_type(c, s) for c, s in zip(current, seen)]
+
+
+def coerce_chunk(df: pd.DataFrame, sql_types: List[Optional[str]]) -> pd.DataFrame:
+    """Cast a chunk to the table schema so far (bad values -> NULL)."""
+    out = {}
+    for (name, col), sql_type in zip(df.items(), sql_types):
+        if sql_type in ("BIGINT", "DOUBLE", "TINYINT(1)"):
+            out[name] = pd.to_numeric(col, errors="coerce")
+        elif sql_type == "DATETIME":
+            out[name] = pd.to_datetime(col, errors="coerce")
+        else:
+            out[name] = col.astype("string").str.strip()
+    return pd.DataFrame(out, index=df.index)
+
+
+def chunk_rows_as_tuples(df: pd.DataFrame) -> List[tuple]:
+    return list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+
+
+# ---------- Writers ----------
+def insert_chunk(conn, table: str, columns: List[str], df: pd.DataFrame) -> None:
+    # PyMySQL rewrites executemany of INSERT ... VALUES into multi-row statements
+    sql = (
+        f"INSERT INTO {quote_ident(table)} ({', '.join(quote_ident(c) for c in columns)}) "
+        f"VALUES ({', '.join(['%s'] * len(columns))})"
+    )
+    conn.exec_driver_sql(sql, chunk_rows_as_tuples(df))
+
+
+def load_data_chunk(conn, table: str, columns: List[str], df: pd.DataFrame) -> None:
+    """LOAD DATA LOCAL INFILE from a temp CSV; empty fields become NULL."""
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False, encoding="utf-8", newline="") as tmp:
+        df.to_csv(tmp, header=False, index=False, quoting=csv.QUOTE_MINIMAL, lineterminator="\n")
+        path = tmp.name
+    try:
+        variables = [f"@c{i}" for i in range(len(columns))]
+        assignments = ", ".join(f"{quote_ident(c)} = NULLIF({v}, '')" for c, v in zip(columns, variables))
+        conn.exec_driver_sql(
+            f"LOAD DATA LOCAL INFILE '{path.replace(chr(92), '/')}' INTO TABLE {quote_ident(table)} "
+            "CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' "
+            "LINES TERMINATED BY '\\n' "
+            f"({', '.join(variables)}) SET {assignments}"
+        )
+    finally:
+        os.remove(path)
+
+
+def table_columns(conn, table: str) -> List[str]:
+    """Column names of an existing table in order ([] when it does not exist)."""
+    return [
+        r[0] for r in conn.execute(text("""
+            SELECT COLUMN_NAME FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :t
+            ORDER BY ORDINAL_POSITION
+        """), {"t": table})
+    ]
+
+
+def check_same_columns(conn, table: str, columns: List[str]) -> None:
+    """Refuse to replace a live table whose queries would lose columns they select by name."""
+    existing = table_columns(conn, table)
+    missing = [c for c in existing if c not in columns]
+    if existing and missing:
+        raise ValueError(
+            f"{table}: new data lacks columns {missing} of the live table "
+            f"(got {columns}); pass allow_column_changes / --allow-column-changes to replace it anyway"
+        )
+
+
+# ---------- Main load ----------
+def load_table(
+    source: str,
+    table: str,
+    method: str = "insert",
+    chunk_rows: int = CHUNK_ROWS,
+    sheet: Optional[str] = None,
+    normalize_columns: bool = False,
+    rebuild_summaries: bool = True,
+    allow_column_changes: bool = False,
+) -> Dict:
+    """
+    Stream `source` into `table` via a staging table and an atomic swap.
+    Column types come from the first chunk and are widened (ALTER TABLE on the staging copy)
+    when a later chunk needs more, e.g. integers then decimals, or numbers then text.
+    Returns a report with row counts and throughput.
+    """
+    if not TABLE_NAME_RE.match(table):
+        raise ValueError(f"Invalid table name: {table!r}")
+    if method not in LOAD_METHODS:
+        raise ValueError(f"Unknown method {method!r}, expected one of {LOAD_METHODS}")
+
+    engine = get_db_engine(connect_args={"local_infile": True} if method == "load-data" else None)
+    staging = f"{table}__staging"
+    write_chunk = load_data_chunk if method == "load-data" else insert_chunk
+
+    started = time.perf_counter()
+    rows = chunks = 0
+    columns: List[str] = []
+    sql_types: List[Optional[str]] = []
+
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {quote_ident(staging)}"))
+
+    try:
+        for chunk in iter_source_chunks(source, chunk_rows, sheet):
+            if not columns:
+                columns = column_names(list(chunk.columns), normalize_columns)
+                sql_types = infer_sql_types(chunk)
+                ddl = ", ".join(f"{quote_ident(c)} {t or PLACEHOLDER_TYPE} NULL" for c, t in zip(columns, sql_types))
+                with engine.begin() as conn:
+                    conn.execute(text(
+                        f"CREATE TABLE {quote_ident(staging)} ({ddl}) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+                    ))
+            else:
+                widened = widen_sql_types(sql_types, infer_sql_types(chunk))
+                changes = [
+                    f"MODIFY {quote_ident(c)} {t} NULL"
+                    for c, t, old in zip(columns, widened, sql_types) if t != old
+                ]
+                if changes:
+                    # rows already written are converted by MySQL (a wider type never loses them)
+                    with engine.begin() as conn:
+                        conn.execute(text(f"ALTER TABLE {quote_ident(staging)} {', '.join(changes)}"))
+                    sql_types = widened
+
+            chunk = coerce_chunk(chunk, sql_types)
+            with engine.begin() as conn:
+                write_chunk(conn, staging, columns, chunk)
+            rows += len(chunk)
+            chunks += 1
+            elapsed = time.perf_counter() - started
+            print(f"  {table}: {rows} rows ({rows / elapsed:,.0f} rows/s)")
+
+        if not columns:
+            raise ValueError(f"No rows read from {source}")
+
+        with engine.begin() as conn:
+            if not allow_column_changes:
+                check_same_columns(conn, table, columns)
+            swap_tables(conn, table, staging)
+    except Exception:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {quote_ident(staging)}"))
+        raise
+
+    elapsed = time.perf_counter() - started
+    report = {
+        "source": source,
+        "table": table,
+        "method": method,
+        "columns": {c: t or PLACEHOLDER_TYPE for c, t in zip(columns, sql_types)},
+        "rows": rows,
+        "chunks": chunks,
+        "elapsed_s": round(elapsed, 3),
+        "rows_per_s": round(rows / elapsed, 1) if elapsed else None,
+    }
+    if rebuild_summaries:
+        report["summaries"] = build_summaries(engine)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bulk-load a census CSV/XLSX into MySQL.")
+    parser.add_argument("source", help="Local path or s3://bucket/key (.csv or .xlsx)")
+    parser.add_argument("--table", required=True, help="Target table name")
+    parser.add_argument("--method", choices=LOAD_METHODS, default="insert")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--sheet", default=None, help="Excel sheet name (default: first)")
+    parser.add_argument("--normalize-column-names", action="store_true",
+                        help="Rename headers to snake_case ('population_[0]' -> 'population_0'); "
+                             "only for tables the API does not query by raw name")
+    parser.add_argument("--allow-column-changes", action="store_true",
+                        help="Replace the live table even if its columns differ from the new data")
+    parser.add_argument("--no-summaries", action="store_true", help="Skip rebuilding census summary tables (and republishing the catalog snapshot)")
+    args = parser.parse_args()
+
+    report = load_table(
+        args.source,
+        args.table,
+        method=args.method,
+        chunk_rows=args.chunk_rows,
+        sheet=args.sheet,
+        normalize_columns=args.normalize_column_names,
+        rebuild_summaries=not args.no_summaries,
+        allow_column_changes=args.allow_column_changes,
+    )
+    print(f"✅ Loaded {report['rows']} rows into {report['table']} "
+          f"in {report['elapsed_s']}s ({report['rows_per_s']} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
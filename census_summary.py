@@ -0,0 +1,226 @@
+# census_summary.py
+# Precomputed census analytics, rebuilt after each data load:
+#   summary_population_year   year-over-year growth and cumulative totals
+#   summary_state_population  state shares and rankings
+#   summary_age_band          age-band percentages per age table
+# Run with `python census_summary.py` or POST /admin/build-summaries; both republish the
+# catalog snapshot the summary endpoints read from.
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from age_tables import align_age_bands, load_age_frames
+from catalog_snapshot import publish_after_update
+from s3_toSQL import get_db_engine
+from state_population import load_state_population_rows
+
+SUMMARY_POPULATION_YEAR = "summary_population_year"
+SUMMARY_STATE_POPULATION = "summary_state_population"
+SUMMARY_AGE_BAND = "summary_age_band"
+
+SUMMARY_DDL = {
+    SUMMARY_POPULATION_YEAR: """
+    CREATE TABLE {table} (
+      year VARCHAR(16) NOT NULL,
+      year_order INT NOT NULL,
+      population BIGINT NOT NULL,
+      change_abs BIGINT NULL,
+      yoy_growth_pct DOUBLE NULL,
+      cumulative_population BIGINT NOT NULL,
+      growth_since_first_pct DOUBLE NULL,
+      PRIMARY KEY (year),
+      INDEX idx_year_order (year_order)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    SUMMARY_STATE_POPULATION: """
+    CREATE TABLE {table} (
+      state_name VARCHAR(255) NOT NULL,
+      population BIGINT NOT NULL,
+      share_pct DOUBLE NOT NULL,
+      state_rank INT NOT NULL,
+      PRIMARY KEY (state_name),
+      INDEX idx_rank (state_rank)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+    SUMMARY_AGE_BAND: """
+    CREATE TABLE {table} (
+      source_table VARCHAR(64) NOT NULL,
+      age_band VARCHAR(64) NOT NULL,
+      age_start SMALLINT NOT NULL,
+      population BIGINT NOT NULL,
+      pct_of_total DOUBLE NOT NULL,
+      cumulative_pct DOUBLE NOT NULL,
+      PRIMARY KEY (source_table, age_band),
+      INDEX idx_source_start (source_table, age_start)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """,
+}
+
+
+# ---------- Table swap ----------
+def swap_tables(conn, table: str, staging: str) -> None:
+    """
+    Atomically replace `table` with `staging` (single RENAME TABLE), then drop the old copy.
+    Readers never see a missing or half-filled table.
+    """
+    old = f"{table}__old"
+    exists = conn.execute(text("SHOW TABLES LIKE :t"), {"t": table}).first() is not None
+    conn.execute(text(f"DROP TABLE IF EXISTS `{old}`"))
+    if exists:
+        conn.execute(text(f"RENAME TABLE `{table}` TO `{old}`, `{staging}` TO `{table}`"))
+        conn.execute(text(f"DROP TABLE `{old}`"))
+    else:
+        conn.execute(text(f"RENAME TABLE `{staging}` TO `{table}`"))
+
+
+def replace_table(engine, table: str, rows: List[Dict]) -> int:
+    """Write `rows` into a fresh staging copy of a summary table and swap it in."""
+    staging = f"{table}__staging"
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS `{staging}`"))
+        conn.execute(text(SUMMARY_DDL[table].format(table=f"`{staging}`")))
+        if rows:
+            cols = list(rows[0])
+            conn.execute(
+                text(f"INSERT INTO `{staging}` ({', '.join(cols)}) VALUES ({', '.join(':' + c for c in cols)})"),
+                rows,
+            )
+        swap_tables(conn, table, staging)
+    return len(rows)
+
+
+def _pct(part: np.ndarray, whole) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.round(np.where(whole != 0, part * 100.0 / whole, np.nan), 2)
+
+
+def _none_if_nan(values: np.ndarray) -> list:
+    return [None if np.isnan(v) else float(v) for v in values]
+
+
+# ---------- Builders ----------
+def build_population_year_rows(engine) -> List[Dict]:
+    with engine.connect() as conn:
+        df = pd.read_sql_query(text("""
+            SELECT Year, population
+            FROM population_diffyear
+            WHERE Year IS NOT NULL AND population IS NOT NULL
+        """), conn)
+
+    df["year"] = df["Year"].astype(str).str.strip()
+    df["population"] = pd.to_numeric(df["population"], errors="coerce")
+    df = df.dropna(subset=["population"])
+    year_num = pd.to_numeric(df["year"], errors="coerce")
+    df = df.assign(_order=year_num).sort_values(["_order", "year"], na_position="last", kind="stable")
+
+    pop = df["population"].to_numpy(dtype=np.float64).astype(np.int64)
+    change = np.diff(pop, prepend=np.nan) if len(pop) else np.array([])
+    prev = np.concatenate(([np.nan], pop[:-1])) if len(pop) else np.array([])
+    yoy = _pct(change, prev)
+    since_first = _pct(pop - pop[0], pop[0]) if len(pop) else np.array([])
+    cumulative = np.cumsum(pop)
+
+    return [
+        {
+            "year": year,
+            "year_order": i,
+            "population": int(p),
+            "change_abs": None if np.isnan(c) else int(c),
+            "yoy_growth_pct": y,
+            "cumulative_population": int(cum),
+            "growth_since_first_pct": g,
+        }
+        for i, (year, p, c, y, cum, g) in enumerate(zip(
+            df["year"], pop, change, _none_if_nan(yoy), cumulative, _none_if_nan(since_first),
+        ))
+    ]
+
+
+def build_state_population_rows(engine) -> List[Dict]:
+    with engine.connect() as conn:
+        rows = load_state_population_rows(conn)
+
+    names = [r.state_name for r in rows]
+    pop = np.array([int(r.population) for r in rows], dtype=np.int64)
+    share = _pct(pop, pop.sum())
+    # competition ranking: equal populations share a rank
+    rank = pd.Series(pop).rank(method="min", ascending=False).to_numpy(dtype=np.int64)
+
+    return [
+        {"state_name": n, "population": int(p), "share_pct": float(s), "state_rank": int(r)}
+        for n, p, s, r in zip(names, pop, np.nan_to_num(share), rank)
+    ]
+
+
+def list_age_tables(engine) -> List[str]:
+    with engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT TABLE_NAME FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME REGEXP '^auslan_age_[0-9]+$'
+            ORDER BY TABLE_NAME
+        """)).all()
+    return [r[0] for r in rows]
+
+
+def build_age_band_rows(engine, tables: Optional[List[str]] = None) -> List[Dict]:
+    tables = tables if tables is not None else list_age_tables(engine)
+    if not tables:
+        return []
+
+    df, _ = load_age_frames(engine, tables)  # straight from MySQL: never build summaries from stale frames
+    aligned = align_age_bands(df, tables)
+    bands, starts = aligned["age_bands"], aligned["age_start"]
+
+    out: List[Dict] = []
+    for table, totals in zip(tables, aligned["totals"]):
+        present = np.array([v is not None for v in totals])
+        values = np.array([v or 0 for v in totals], dtype=np.int64)
+        pct = np.nan_to_num(_pct(values, values.sum()))
+        # cumulative from the youngest band up (bands are ordered oldest first)
+        cum = np.nan_to_num(_pct(np.cumsum(values[::-1])[::-1], values.sum()))
+        for i in np.flatnonzero(present):
+            out.append({
+                "source_table": table,
+                "age_band": bands[i],
+                "age_start": int(starts[i]),
+                "population": int(values[i]),
+                "pct_of_total": float(pct[i]),
+                "cumulative_pct": float(cum[i]),
+            })
+    return out
+
+
+# ---------- Main ----------
+def build_summaries(engine=None, publish: bool = True) -> Dict:
+    """
+    Rebuild every summary table, then (with `publish`) republish the catalog snapshot.
+    Returns per-table row counts and elapsed time.
+    """
+    engine = engine or get_db_engine()
+    started = time.perf_counter()
+    report: Dict[str, object] = {}
+    errors: List[str] = []
+
+    builders = [
+        (SUMMARY_POPULATION_YEAR, build_population_year_rows),
+        (SUMMARY_STATE_POPULATION, build_state_population_rows),
+        (SUMMARY_AGE_BAND, build_age_band_rows),
+    ]
+    for table, builder in builders:
+        try:
+            report[table] = replace_table(engine, table, builder(engine))
+        except Exception as e:
+            errors.append(f"{table}: {e}")
+
+    report["elapsed_s"] = round(time.perf_counter() - started, 3)
+    report["errors"] = errors
+    if publish:
+        report["snapshot"] = publish_after_update(engine)
+    return report
+
+
+if __name__ == "__main__":
+    print(build_summaries())
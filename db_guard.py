@@ -0,0 +1,220 @@
+# db_guard.py
+# Bounded-latency MySQL reads for the dashboard endpoints:
+#   - per-query timeouts (server-side MAX_EXECUTION_TIME + client read timeout, short pool wait)
+#   - a circuit breaker per engine: after BREAKER_FAILURES consecutive errors, calls fail fast
+#     for BREAKER_RESET_S, then one trial call decides whether to close it again
+#   - stale-while-error: the last good result per key is served (marked stale) while the
+#     DB is failing, so a DB incident degrades to old data instead of 30 s timeouts
+#
+#   reader = GuardedReader(engine, "year")
+#   rows = reader.read("population-by-year", load_rows)
+#
+# Stale responses get `X-Data-Stale: 1`, `Age` and `Warning: 110` headers from StaleHeadersMiddleware.
+import contextvars
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+
+# ---------- Settings ----------
+DB_QUERY_TIMEOUT_MS = int(os.getenv("DB_QUERY_TIMEOUT_MS", "5000"))
+DB_CONNECT_TIMEOUT_S = int(os.getenv("DB_CONNECT_TIMEOUT_S", "3"))
+DB_POOL_TIMEOUT_S = int(os.getenv("DB_POOL_TIMEOUT_S", "3"))
+BREAKER_FAILURES = int(os.getenv("DB_BREAKER_FAILURES", "5"))
+BREAKER_RESET_S = float(os.getenv("DB_BREAKER_RESET_S", "15"))
+STALE_MAX_AGE_S = int(os.getenv("DB_STALE_MAX_AGE_S", str(24 * 3600)))
+
+
+# ---------- Timeouts ----------
+def timeout_connect_args() -> Dict[str, int]:
+    """PyMySQL socket timeouts: a hung server cannot hold a request longer than the query budget."""
+    read_timeout = DB_QUERY_TIMEOUT_MS // 1000 + 2
+    return {"connect_timeout": DB_CONNECT_TIMEOUT_S, "read_timeout": read_timeout, "write_timeout": read_timeout}
+
+
+def install_query_timeout(engine, timeout_ms: int = DB_QUERY_TIMEOUT_MS):
+    """Cap every SELECT on `engine` server-side (MySQL 5.7.8+); ignored by servers without it."""
+    if engine is None:
+        return engine
+
+    @event.listens_for(engine, "connect")
+    def _set_max_execution_time(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        try:
+            cur.execute(f"SET SESSION MAX_EXECUTION_TIME = {int(timeout_ms)}")
+        except Exception:
+            pass
+        finally:
+            cur.close()
+
+    return engine
+
+
+# ---------- Circuit breaker ----------
+class CircuitOpenError(SQLAlchemyError):
+    """Raised without touching the DB; existing `except SQLAlchemyError` handlers cover it."""
+
+
+class CircuitBreaker:
+    """closed -> open after `threshold` consecutive failures -> half-open after `reset_s` -> closed on success."""
+
+    def __init__(self, threshold: int = BREAKER_FAILURES, reset_s: float = BREAKER_RESET_S):
+        self.threshold = threshold
+        self.reset_s = reset_s
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        self._last_error: Optional[BaseException] = None
+        self.stats = {"failures": 0, "opens": 0, "rejected": 0}
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_s:
+                self.state = "half-open"
+            if self.state == "half-open" and not self._trial_running:
+                self._trial_running = True  # exactly one caller probes the DB
+                return True
+            self.stats["rejected"] += 1
+            return False
+
+    def release(self) -> None:
+        """The call ended without telling us anything about DB health."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self, error: BaseException) -> bool:
+        """Returns True when this failure opened the circuit."""
+        with self._lock:
+            self._trial_running = False
+            if error is self._last_error:
+                return False  # one error shared by coalesced callers counts once
+            self._last_error = error
+            self.failures += 1
+            self.stats["failures"] += 1
+            if self.state == "half-open" or self.failures >= self.threshold:
+                opened = self.state != "open"
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                if opened:
+                    self.stats["opens"] += 1
+                return opened
+            return False
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self.failures, **self.stats}
+
+
+# ---------- Stale marking ----------
+# Set per request by StaleHeadersMiddleware; holds a dict so marks made in the worker
+# thread that runs a sync endpoint are visible to the middleware afterwards.
+_request_freshness: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "request_freshness", default=None)
+
+
+def mark_stale(age_s: float) -> None:
+    """Mark the current request as served from data `age_s` seconds old (no-op outside a request)."""
+    freshness = _request_freshness.get()
+    if freshness is not None:
+        freshness["age_s"] = max(freshness.get("age_s", 0.0), age_s)
+
+
+class StaleHeadersMiddleware:
+    """Pure ASGI middleware adding stale-data headers when any guarded read fell back."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        freshness: Dict[str, float] = {}
+        token = _request_freshness.set(freshness)
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start" and "age_s" in freshness:
+                headers = list(message.get("headers", []))
+                headers += [
+                    (b"x-data-stale", b"1"),
+                    (b"age", str(int(freshness["age_s"])).encode()),
+                    (b"warning", b'110 - "Response is Stale"'),
+                ]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            _request_freshness.reset(token)
+
+
+# ---------- Guarded reads ----------
+_readers: List["GuardedReader"] = []
+
+
+class GuardedReader:
+    def __init__(self, engine, name: str):
+        self.engine = engine
+        self.name = name
+        self.breaker = CircuitBreaker()
+        self._last_good: Dict[Hashable, Tuple[float, Any]] = {}
+        self.stats = {"fresh": 0, "stale": 0, "errors": 0}
+        _readers.append(self)
+
+    def read(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Run `fn` (which does its own DB work) through the breaker. On DB errors, or while the
+        circuit is open, return the last good value for `key` if it is younger than
+        STALE_MAX_AGE_S; otherwise re-raise. Results are shared, so treat them as read-only.
+        """
+        return self.fetch(key, fn)[0]
+
+    def fetch(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, Optional[float]]:
+        """Like read(), plus the age in seconds of a stale result (None when fresh)."""
+        if not self.breaker.allow():
+            return self._fallback(key, CircuitOpenError(f"{self.name}: database circuit open"))
+        try:
+            value = fn()
+        except SQLAlchemyError as e:
+            if self.breaker.record_failure(e) and self.engine is not None:
+                self.engine.dispose()  # drop dead sockets; the trial call reconnects
+            return self._fallback(key, e)
+        except BaseException:
+            self.breaker.release()  # bad input / data, not an unhealthy DB
+            raise
+        self.breaker.record_success()
+        self._last_good[key] = (time.monotonic(), value)
+        self.stats["fresh"] += 1
+        return value, None
+
+    def _fallback(self, key: Hashable, error: BaseException) -> Tuple[Any, float]:
+        hit = self._last_good.get(key)
+        if hit is not None:
+            age = time.monotonic() - hit[0]
+            if age <= STALE_MAX_AGE_S:
+                self.stats["stale"] += 1
+                mark_stale(age)
+                return hit[1], age
+        self.stats["errors"] += 1
+        raise error
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"breaker": self.breaker.snapshot(), "cached_keys": len(self._last_good), **self.stats}
+
+
+def readers_snapshot() -> Dict[str, Any]:
+    return {r.name: r.snapshot() for r in _readers}
@@ -0,0 +1,56 @@
+# gunicorn.conf.py
+# Production entry point:
+#
+#   gunicorn -c gunicorn.conf.py
+#
+# The app is preloaded in the master, so pandas / plotly / numpy are imported once and shared
+# copy-on-write by the workers. DB pools are closed before forking and reset in each worker
+# (prefork.py), and boto3 clients are rebuilt per worker.
+#
+# Sizing (override with WEB_CONCURRENCY / THREADPOOL_TOKENS):
+#   workers  = min(2 * CPUs + 1, DB_MAX_CONNECTIONS // connections one worker can open)
+#   threads  = the smallest engine pool, so sync handlers never queue on pool_timeout
+import gc
+import multiprocessing
+import os
+
+import main  # noqa: F401  preload now, so the real engine pools can be measured
+from prefork import dispose_engines, pool_capacities, reset_after_fork
+
+wsgi_app = "main:app"
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "150"))  # share of MySQL max_connections for this host
+
+_capacities = list(pool_capacities().values()) or [15]
+_per_worker = sum(_capacities)
+workers = int(os.getenv("WEB_CONCURRENCY") or max(
+    1, min(2 * multiprocessing.cpu_count() + 1, DB_MAX_CONNECTIONS // _per_worker)
+))
+# read by main.py at startup to size the AnyIO thread pool used for sync endpoints
+os.environ.setdefault("THREADPOOL_TOKENS", str(min(_capacities)))
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = 30
+keepalive = 5
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))  # >0 recycles workers (caps slow leaks)
+max_requests_jitter = max_requests // 10
+accesslog = "-"
+
+
+def when_ready(server):
+    dispose_engines()
+    # move everything imported so far out of the GC's reach: collections would otherwise
+    # write to every object header and un-share the preloaded pages
+    gc.collect()
+    gc.freeze()
+    server.log.info(
+        "Preloaded app: %d workers, %d DB connections per worker, %s threadpool tokens",
+        workers, _per_worker, os.environ["THREADPOOL_TOKENS"],
+    )
+
+
+def post_fork(server, worker):
+    reset_after_fork()
@@ -1,6 +1,12 @@
 # ingest_router.py
-from fastapi import APIRouter, HTTPException, Query
-from s3_toSQL import ingest_from_s3
+from typing import Dict
+
+from fastapi import APIRouter, Body, HTTPException, Query
+from s3_toSQL import INGEST_WORKERS, ingest_from_s3, ingest_many
+from census_summary import build_summaries
+from catalog_snapshot import publish_after_update
+from warm_cache import warm_cache
+from video_search import refresh_after_ingest
 
 # Router for /admin endpoints
 router = APIRouter(prefix="/admin", tags=["admin"])
@@ -14,7 +20,63 @@ def run_ingest(prefix: str = Query(default="", description="Optional S3 prefix (
         POST /admin/ingest-s3?prefix=converted/
     """
     try:
+        # also republishes the catalog snapshot; workers swap to it within a second
         summary = ingest_from_s3(prefix=prefix)  # pass prefix to s3_toSQL
+        refresh_after_ingest(summary["table"])  # pick up new/changed signs in the search index
+        warm_cache.request_refresh()  # re-warm listings now (other workers follow the snapshot version)
         return {"status": "ok", **summary}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/ingest-s3/batch")
+def run_ingest_batch(
+    targets: Dict[str, str] = Body(..., description="S3 prefix -> collection (or table) name"),
+    workers: int = Query(INGEST_WORKERS, ge=1, le=16),
+):
+    """
+    Ingest several prefixes concurrently (shared S3 client and DB pool) and return one report
+    per collection. Takes as long as the slowest prefix instead of the sum of all of them.
+    Example:
+        POST /admin/ingest-s3/batch
+        {"book_1/": "book1", "book_2/": "book2", "book_3/": "book3", "converted/": "videos"}
+    """
+    if not targets:
+        raise HTTPException(status_code=400, detail="At least one prefix -> collection pair is required")
+    try:
+        report = ingest_many(targets, workers=workers)  # publishes the snapshot once for the batch
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    for table in report["collections"]:
+        refresh_after_ingest(table)
+    warm_cache.request_refresh()
+    return {"status": "ok" if not report["error_count"] else "partial", **report}
+
+@router.post("/build-summaries")
+def run_build_summaries():
+    """
+    Rebuild the precomputed census summary tables (growth, state shares, age-band percentages).
+    Example:
+        POST /admin/build-summaries
+    """
+    try:
+        report = build_summaries()  # republishes the snapshot
+        warm_cache.request_refresh()
+        return {"status": "ok" if not report["errors"] else "partial", **report}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/publish-snapshot")
+def run_publish_snapshot():
+    """
+    Re-publish the read-only catalog / summary snapshot served by the listing and stats endpoints.
+    Example:
+        POST /admin/publish-snapshot
+    """
+    report = publish_after_update()
+    if "error" in report:
+        raise HTTPException(status_code=500, detail=report["error"])
+    warm_cache.request_refresh()
+    return {"status": "ok", **report}
@@ -1,5 +1,11 @@
 # main.py
+# Production: gunicorn -c gunicorn.conf.py (preloaded, fork-safe; see prefork.py)
+import os
+from contextlib import asynccontextmanager
+
+import anyio
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from violin_visual import app as violin_app
 from state_visual import app as state_map_app   
 from year_visual import app as year_app
@@ -9,7 +15,39 @@ from video_backend import router as video_router
 from book1_api import router as book1_router
 from book2_api import router as book2_router
 from book3_api import router as book3_router
-app = FastAPI(title="Auslan Backend Combined")
+from video_search import router as search_router
+from profiler import router as profiler_router
+from single_flight import flight
+from db_guard import StaleHeadersMiddleware, readers_snapshot
+from catalog_snapshot import snapshot_store
+from warm_cache import warm_cache
+
+
+def configure_threadpool():
+    # sync endpoints run on AnyIO's thread pool; gunicorn.conf.py sizes it to the DB pool
+    tokens = os.getenv("THREADPOOL_TOKENS")
+    if tokens:
+        anyio.to_thread.current_default_thread_limiter().total_tokens = int(tokens)
+
+
+def snapshot_version():
+    snap = snapshot_store.current()
+    return snap.version if snap else None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    configure_threadpool()
+    # warm the expensive responses in the background; /health answers 503 until they are
+    warm_cache.start(version=snapshot_version)
+    yield
+    await warm_cache.stop()
+
+
+app = FastAPI(title="Auslan Backend Combined", lifespan=lifespan)
+
+# marks responses served from the last good DB result (X-Data-Stale / Age / Warning)
+app.add_middleware(StaleHeadersMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,16 +65,39 @@ app.include_router(video_router)
 app.include_router(book1_router)
 app.include_router(book2_router)
 app.include_router(book3_router)
+app.include_router(search_router)
+app.include_router(profiler_router)  # admin only, needs PROFILER_TOKEN
 
 @app.get("/")
 def root():
     return {
         "message": "Auslan Backend API",
-        "available_endpoints": ["/violin", "/map", "/year", "/health"] }
+        "available_endpoints": ["/violin", "/map", "/year", "/search", "/health", "/health/live", "/metrics/single-flight"] }
 
 @app.get("/health")
 def health():
-    return {
-        "status": "ok",
-        "apps": ["violin", "map", "year"]  
-    }
\ No newline at end of file
+    """
+    Readiness: 503 until the startup cache warm-up has finished (see warm_cache.py).
+    "degraded" while warm entries serve stale data (MySQL failing); the worker stays in
+    rotation since it still answers every cached endpoint.
+    """
+    ready = warm_cache.ready()
+    status = "warming" if not ready else ("degraded" if warm_cache.stale_entries() else "ok")
+    body = {
+        "status": status,
+        "apps": ["violin", "map", "year"],
+        "db": readers_snapshot(),
+        "catalog_snapshot": snapshot_store.snapshot(),
+        "warm_cache": warm_cache.snapshot(),
+    }
+    return body if ready else JSONResponse(status_code=503, content=body)
+
+@app.get("/health/live")
+def liveness():
+    """Liveness only: the process is serving requests (warm or not)."""
+    return {"status": "ok"}
+
+@app.get("/metrics/single-flight")
+def single_flight_metrics():
+    """How many identical concurrent requests were collapsed onto one computation."""
+    return flight.snapshot()
@@ -0,0 +1,48 @@
+# media_probe.py
+# Thin ffprobe wrapper shared by the transcode job and catalog ingest.
+import json
+import subprocess
+from typing import Dict, Optional
+
+
+def ffprobe(source: str, timeout: int = 30) -> Dict:
+    """Raw ffprobe JSON (format + streams) for a local path or an http(s) URL."""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-print_format", "json",
+        "-show_format", "-show_streams",
+        source,
+    ]
+    out = subprocess.run(cmd, check=True, capture_output=True, timeout=timeout)
+    return json.loads(out.stdout or b"{}")
+
+
+def _to_float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def summarize(info: Dict) -> Dict:
+    """The handful of fields the catalog and transcode care about."""
+    streams = info.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), {})
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    fmt = info.get("format", {})
+    duration = _to_float(fmt.get("duration")) or _to_float(video.get("duration"))
+    bitrate = _to_float(fmt.get("bit_rate")) or _to_float(video.get("bit_rate"))
+    return {
+        "duration_s": round(duration, 3) if duration is not None else None,
+        "width": video.get("width"),
+        "height": video.get("height"),
+        "video_codec": video.get("codec_name"),
+        "pix_fmt": video.get("pix_fmt"),
+        "audio_codec": audio.get("codec_name") if audio else None,
+        "bitrate": int(bitrate) if bitrate is not None else None,
+        "has_audio": audio is not None,
+    }
+
+
+def probe(source: str, timeout: int = 30) -> Dict:
+    return summarize(ffprobe(source, timeout=timeout))
@@ -0,0 +1,48 @@
+# prefork.py
+# Fork safety for `gunicorn --preload`: the master imports every module once (pandas, plotly,
+# engines, boto3 clients) and workers share those pages copy-on-write. Sockets must not be
+# shared, so modules register their engines / per-process clients here and gunicorn.conf.py
+# drops them in the master before forking and rebuilds them in each worker.
+import weakref
+from typing import Callable, Dict, List
+
+_engines: "weakref.WeakSet" = weakref.WeakSet()
+_after_fork: List[Callable[[], None]] = []
+
+
+def register_engine(engine):
+    """Track a SQLAlchemy engine so its pool can be reset around fork. Returns the engine."""
+    if engine is not None:
+        _engines.add(engine)
+    return engine
+
+
+def after_fork(fn: Callable[[], None]) -> Callable[[], None]:
+    """Decorator: run `fn` in every worker right after fork (rebuild clients, reset threads)."""
+    _after_fork.append(fn)
+    return fn
+
+
+def dispose_engines() -> None:
+    """Master side: close pooled connections so no worker inherits an open MySQL socket."""
+    for engine in list(_engines):
+        engine.dispose()
+
+
+def reset_after_fork() -> None:
+    """Worker side: forget inherited pool state without touching the parent's sockets."""
+    for engine in list(_engines):
+        engine.dispose(close=False)
+    for fn in _after_fork:
+        fn()
+
+
+def pool_capacities() -> Dict[str, int]:
+    """pool_size + max_overflow of each registered engine, keyed by URL (password hidden)."""
+    out: Dict[str, int] = {}
+    for engine in list(_engines):
+        pool = engine.pool
+        size = pool.size() if hasattr(pool, "size") else 1
+        overflow = max(0, getattr(pool, "_max_overflow", 0))
+        out[engine.url.render_as_string(hide_password=True) + f"#{id(engine)}"] = size + overflow
+    return out
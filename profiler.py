@@ -0,0 +1,287 @@
+# profiler.py
+# On-demand sampling profiler for a live worker (admin only, PROFILER_TOKEN must be set).
+#
+#   curl -X POST -H "X-Admin-Token: $PROFILER_TOKEN" \
+#        "https://api/admin/profile?seconds=10" > worker.collapsed
+#   curl -X POST -H "X-Admin-Token: $PROFILER_TOKEN" \
+#        "https://api/admin/profile?seconds=30&route=^/violin/age-pyramid&format=svg" > pyramid.svg
+#
+# A background thread snapshots sys._current_frames() every `interval_ms` and counts identical
+# stacks. Output is collapsed stacks ("frame;frame;frame count", as read by flamegraph.pl and
+# speedscope) or a self-contained SVG flamegraph.
+#
+# With `route`, only threads currently inside a matching endpoint are sampled: the endpoint
+# callables of matching routes are wrapped for the session and restored afterwards. Nothing
+# is installed while no session runs, so the profiler costs nothing when off.
+# Each call profiles the worker process that received it (see X-Profile-Pid).
+import asyncio
+import functools
+import hmac
+import html
+import os
+import re
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, Response
+from fastapi.routing import APIRoute
+from starlette.routing import Mount
+
+# ---------- Settings ----------
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN", "")
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "120"))
+
+# leaf frames of threads that are parked, not working (dropped unless idle=true)
+IDLE_FRAMES = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"), ("selectors.py", "select"),
+}
+
+
+# ---------- Sampling ----------
+def _frame_label(code) -> str:
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Counts stacks of the sampled threads. `threads` (a live set of thread idents) limits
+    sampling to those threads; None samples every thread except the sampler itself.
+    """
+
+    def __init__(self, interval_s: float = 0.005, threads: Optional[Dict[int, int]] = None, idle: bool = False):
+        self.interval_s = interval_s
+        self.threads = threads
+        self.idle = idle
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self) -> "SamplingProfiler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            wanted = self.threads
+            for ident, frame in sys._current_frames().items():
+                if ident == me or (wanted is not None and ident not in wanted):
+                    continue
+                leaf = frame.f_code
+                if not self.idle and (os.path.basename(leaf.co_filename), leaf.co_name) in IDLE_FRAMES:
+                    continue
+                stack: List[str] = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+
+# ---------- Route mode ----------
+def iter_routes(routes: Iterable, prefix: str = "") -> Iterable[Tuple[str, APIRoute]]:
+    """(full path, route) for every APIRoute, including those of mounted sub-apps."""
+    for route in routes:
+        if isinstance(route, APIRoute):
+            yield prefix + route.path, route
+        elif isinstance(route, Mount):
+            yield from iter_routes(route.routes, prefix + route.path)
+
+
+def _tracking(call: Callable, active: Dict[int, int], lock: threading.Lock, counter: Counter) -> Callable:
+    """Wrap an endpoint so the thread running it is in `active` for the duration of the call."""
+    def enter():
+        ident = threading.get_ident()
+        with lock:
+            active[ident] = active.get(ident, 0) + 1
+            counter["requests"] += 1
+        return ident
+
+    def leave(ident):
+        with lock:
+            if active[ident] == 1:
+                del active[ident]
+            else:
+                active[ident] -= 1
+
+    if asyncio.iscoroutinefunction(call):
+        # async endpoints share the event loop thread: samples taken while one is awaiting
+        # may include other coroutines running on the loop
+        @functools.wraps(call)
+        async def wrapper(*args, **kwargs):
+            ident = enter()
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                leave(ident)
+    else:
+        @functools.wraps(call)
+        def wrapper(*args, **kwargs):
+            ident = enter()
+            try:
+                return call(*args, **kwargs)
+            finally:
+                leave(ident)
+    return wrapper
+
+
+class RouteTracker:
+    """Installs tracking wrappers on the matching routes' endpoint callables; uninstall() restores them."""
+
+    def __init__(self, app: FastAPI, pattern: str):
+        self.active: Dict[int, int] = {}
+        self.counter: Counter = Counter()
+        self._lock = threading.Lock()
+        self._originals: List[Tuple[APIRoute, Callable]] = []
+        self.paths: List[str] = []
+        regex = re.compile(pattern)
+        for path, route in iter_routes(app.routes):
+            if regex.search(path) and route.dependant.call is not None:
+                self.paths.append(path)
+                self._originals.append((route, route.dependant.call))
+
+    def install(self) -> None:
+        for route, call in self._originals:
+            route.dependant.call = _tracking(call, self.active, self._lock, self.counter)
+
+    def uninstall(self) -> None:
+        for route, call in self._originals:
+            route.dependant.call = call
+
+
+# ---------- Output ----------
+def collapsed(stacks: Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def _color(name: str) -> str:
+    h = zlib.crc32(name.encode())
+    return f"rgb({205 + h % 50},{(h >> 8) % 180 + 40},{(h >> 16) % 55})"
+
+
+def flamegraph_svg(stacks: Counter, title: str = "Flame Graph", width: int = 1200, row: int = 16) -> str:
+    """Minimal flamegraph (root at the bottom); hover a frame for its sample count."""
+    tree: Dict = {"n": 0, "c": {}}
+    for stack, count in stacks.items():
+        node = tree
+        node["n"] += count
+        for frame in stack.split(";"):
+            node = node["c"].setdefault(frame, {"n": 0, "c": {}})
+            node["n"] += count
+    total = tree["n"] or 1
+
+    def depth(node) -> int:
+        return 1 + max((depth(c) for c in node["c"].values()), default=0)
+
+    height = (depth(tree) + 2) * row
+    min_samples = total * 0.5 / width  # skip frames narrower than half a pixel
+    parts: List[str] = []
+
+    def draw(node, name: str, x: float, level: int) -> None:
+        w = node["n"] / total * width
+        y = height - (level + 1) * row
+        pct = 100.0 * node["n"] / total
+        label = html.escape(name)
+        parts.append(
+            f'<g><title>{label} ({node["n"]} samples, {pct:.2f}%)</title>'
+            f'<rect x="{x:.2f}" y="{y}" width="{max(w - 0.5, 0.1):.2f}" height="{row - 1}" fill="{_color(name)}"/>'
+        )
+        if w > 30:
+            chars = int(w / 7)
+            text = label if len(name) <= chars else html.escape(name[:max(chars - 2, 0)]) + ".."
+            parts.append(f'<text x="{x + 3:.2f}" y="{y + row - 4}">{text}</text>')
+        parts.append("</g>")
+        for child_name, child in sorted(node["c"].items()):
+            if child["n"] >= min_samples:
+                draw(child, child_name, x, level + 1)
+            x += child["n"] / total * width
+
+    draw(tree, "all", 0.0, 0)
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height + row}" '
+        f'font-family="Verdana" font-size="11">'
+        f'<text x="{width / 2}" y="{row}" text-anchor="middle" font-size="14">{html.escape(title)}</text>'
+        + "".join(parts) + "</svg>"
+    )
+
+
+# ---------- API ----------
+def require_admin_token(x_admin_token: str = Header("")) -> None:
+    if not PROFILER_TOKEN:
+        raise HTTPException(status_code=404, detail="Profiler is disabled")
+    if not hmac.compare_digest(x_admin_token.encode(), PROFILER_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_admin_token)])
+_session_lock = asyncio.Lock()
+
+
+@router.post("/profile")
+async def profile_worker(
+    request: Request,
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    interval_ms: float = Query(5, ge=1, le=1000),
+    route: Optional[str] = Query(None, description="Regex on the full path, e.g. ^/videos/$"),
+    max_requests: Optional[int] = Query(None, ge=1, description="Stop early after this many matching requests"),
+    idle: bool = Query(False, description="Keep samples of parked threads"),
+    fmt: str = Query("collapsed", alias="format", pattern="^(collapsed|svg)$"),
+):
+    """
+    Sample this worker for `seconds` and return collapsed stacks or an SVG flamegraph.
+    With `route`, only time spent inside matching endpoints is sampled.
+    """
+    if _session_lock.locked():
+        raise HTTPException(status_code=409, detail="A profiling session is already running in this worker")
+    async with _session_lock:
+        tracker = None
+        if route is not None:
+            try:
+                tracker = RouteTracker(request.app, route)
+            except re.error as e:
+                raise HTTPException(status_code=400, detail=f"Invalid route pattern: {e}")
+            if not tracker.paths:
+                raise HTTPException(status_code=400, detail="No route matches the pattern")
+
+        profiler = SamplingProfiler(interval_ms / 1000, tracker.active if tracker else None, idle)
+        started = time.monotonic()
+        if tracker:
+            tracker.install()
+        profiler.start()
+        try:
+            deadline = started + seconds
+            while time.monotonic() < deadline:
+                await asyncio.sleep(min(0.1, deadline - time.monotonic()))
+                if tracker and max_requests and tracker.counter["requests"] >= max_requests and not tracker.active:
+                    break
+        finally:
+            stacks = profiler.stop()
+            if tracker:
+                tracker.uninstall()
+        elapsed = time.monotonic() - started
+
+    headers = {
+        "X-Profile-Pid": str(os.getpid()),
+        "X-Profile-Samples": str(profiler.samples),
+        "X-Profile-Seconds": f"{elapsed:.3f}",
+        "Cache-Control": "no-store",
+    }
+    if tracker:
+        headers["X-Profile-Requests"] = str(tracker.counter["requests"])
+        headers["X-Profile-Routes"] = ",".join(tracker.paths)[:1024]
+    if fmt == "svg":
+        title = f"pid {os.getpid()}, {profiler.samples} samples, {elapsed:.1f}s" + (f", route {route}" if route else "")
+        return Response(flamegraph_svg(stacks, title), media_type="image/svg+xml", headers=headers)
+    return PlainTextResponse(collapsed(stacks), headers=headers)
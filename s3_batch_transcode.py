@@ -1,27 +1,111 @@
+import argparse
+import json
+import math
 import os
+import shutil
 import subprocess
+import time
+from datetime import datetime, timezone
+
 import boto3
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
+
+from sqlalchemy import text
+
+from media_probe import probe
+from transcode_queue import TranscodeQueue, worker_id
+from s3_toSQL import (
+    COLLECTIONS, DERIVED_PREFIX, MEDIA_COLUMNS, POSTER_FORMAT, SPRITE_COLUMNS, SPRITE_INTERVAL_S,
+    clip_stem, get_db_engine, hls_prefix, list_hls_masters, list_thumbnails, poster_key, sprite_key,
+)
 
 # ---------- Settings ----------
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
 S3_BUCKET = os.getenv("S3_BUCKET", "demo2109bhargav")
 S3_PREFIX = os.getenv("S3_PREFIX", "")  # 可以指定 "converted/" 或留空覆蓋
+OUTPUT_MODE = os.getenv("OUTPUT_MODE", "mp4")  # mp4 | hls | both
+FORCE = os.getenv("TRANSCODE_FORCE", "0") == "1"  # redo clips that already have output
+THUMBNAILS = os.getenv("THUMBNAILS", "1") == "1"    # poster frame per clip
+SPRITES = os.getenv("SPRITES", "0") == "1"          # plus a scrubbing sprite sheet
+NEW_CLIP_WINDOW_S = int(os.getenv("TRANSCODE_NEW_CLIP_WINDOW_S", "86400"))  # uploaded recently -> jump the queue
+NEW_CLIP_PRIORITY = 10
 
 LOCAL_TMP = "./tmp_videos"
 os.makedirs(LOCAL_TMP, exist_ok=True)
 
 s3 = boto3.client("s3", region_name=AWS_REGION)
 
+# HLS ladder: (height, video bitrate, audio bitrate)
+HLS_LADDER = [
+    (240, "400k", "64k"),
+    (480, "1000k", "96k"),
+    (720, "2500k", "128k"),
+]
+HLS_SEGMENT_SECONDS = 2
+
+CONTENT_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".ts": "video/mp2t",
+    ".jpg": "image/jpeg",
+    ".webp": "image/webp",
+}
+
+# Thumbnails: small enough that a book page of signs loads in a few KB each
+POSTER_HEIGHT = 240
+SPRITE_TILE_HEIGHT = 90
+SPRITE_MAX_FRAMES = 60
+
 # ---------- Helper: List all mp4 ----------
 def list_mp4_objects(bucket, prefix=""):
     paginator = s3.get_paginator("list_objects_v2")
     for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
         for obj in page.get("Contents", []):
             if obj["Key"].lower().endswith(".mp4"):
-                yield obj["Key"]
+                yield obj
+
+# ---------- Helper: Catalog metadata (filled by ingest) ----------
+def load_catalog_media():
+    """{s3_key: media fields} from every catalog table that has been probed; {} without a DB."""
+    media = {}
+    try:
+        engine = get_db_engine()
+        with engine.connect() as conn:
+            for table in set(COLLECTIONS.values()):
+                try:
+                    rows = conn.execute(text(
+                        f"SELECT s3_key, {', '.join(MEDIA_COLUMNS)} FROM {table} WHERE probed_etag IS NOT NULL"
+                    ))
+                except Exception:
+                    continue  # table missing or not migrated yet
+                for row in rows:
+                    media[row.s3_key] = dict(row._mapping)
+    except Exception as e:
+        print(f"⚠️ Catalog metadata unavailable, probing locally: {e}")
+    return media
+
+def is_web_ready(info):
+    """H.264 / yuv420p / AAC (or silent) plays everywhere: a remux is enough."""
+    return (
+        info.get("video_codec") == "h264"
+        and info.get("pix_fmt") in ("yuv420p", None)
+        and info.get("audio_codec") in ("aac", None)
+    )
+
+def plan_mp4(key, info, converted):
+    """'skip', 'remux' or 'encode' for the converted/ MP4 of `key`."""
+    new_key = DERIVED_PREFIX + os.path.basename(key)
+    if not FORCE and new_key != key and new_key in converted:
+        return "skip"
+    if info and is_web_ready(info):
+        return "skip" if key == new_key else "remux"
+    return "encode"
 
 # ---------- Helper: Transcode with ffmpeg ----------
+def remux_faststart(in_path, out_path):
+    """Copy streams as-is, only moving the moov atom up front for progressive playback."""
+    cmd = ["ffmpeg", "-y", "-i", in_path, "-c", "copy", "-movflags", "+faststart", out_path]
+    subprocess.run(cmd, check=True)
+
 def transcode_to_h264(in_path, out_path):
     cmd = [
         "ffmpeg", "-y", "-i", in_path,
@@ -31,42 +115,249 @@ def transcode_to_h264(in_path, out_path):
     ]
     subprocess.run(cmd, check=True)
 
+# ---------- Helper: HLS ladder with ffmpeg ----------
+def ladder_for(source_height):
+    """Rungs up to the source height (never upscale); always keep the smallest rung."""
+    rungs = [r for r in HLS_LADDER if not source_height or r[0] <= source_height]
+    return rungs or HLS_LADDER[:1]
+
+def bits(rate):
+    return int(rate.rstrip("k")) * 1000
+
+def write_master_playlist(out_dir, ladder, has_audio=True, source_size=None):
+    """master.m3u8 pointing at v<i>/index.m3u8, lowest rung first."""
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+    for i, (height, v_rate, a_rate) in enumerate(ladder):
+        attrs = [f"BANDWIDTH={bits(v_rate) + (bits(a_rate) if has_audio else 0)}"]
+        if source_size and source_size[0] and source_size[1]:
+            width = int(round(source_size[0] * height / source_size[1] / 2)) * 2
+            attrs.append(f"RESOLUTION={width}x{height}")
+        lines += [f"#EXT-X-STREAM-INF:{','.join(attrs)}", f"v{i}/index.m3u8"]
+    with open(os.path.join(out_dir, "master.m3u8"), "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+def transcode_to_hls(in_path, out_dir, ladder=HLS_LADDER, has_audio=True, source_size=None):
+    """
+    One ffmpeg pass producing every rung, then a master playlist:
+        out_dir/master.m3u8, out_dir/v0/index.m3u8, out_dir/v0/seg_000.ts, ...
+    Keyframes are pinned to segment boundaries so players can switch rungs cleanly.
+    """
+    n = len(ladder)
+    split = f"[0:v]split={n}" + "".join(f"[v{i}]" for i in range(n))
+    scales = [f"[v{i}]scale=-2:{h}[v{i}out]" for i, (h, _, _) in enumerate(ladder)]
+    cmd = ["ffmpeg", "-y", "-i", in_path, "-filter_complex", ";".join([split] + scales)]
+    for i, (_, v_rate, a_rate) in enumerate(ladder):
+        cmd += [
+            "-map", f"[v{i}out]",
+            f"-c:v:{i}", "libx264", f"-b:v:{i}", v_rate,
+            f"-maxrate:v:{i}", v_rate, f"-bufsize:v:{i}", v_rate,
+        ]
+        if has_audio:
+            cmd += ["-map", "a:0", f"-c:a:{i}", "aac", f"-b:a:{i}", a_rate]
+    stream_map = " ".join(f"v:{i},a:{i}" if has_audio else f"v:{i}" for i in range(n))
+    cmd += [
+        "-preset", "fast",
+        "-force_key_frames", f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})",
+        "-sc_threshold", "0",
+        "-f", "hls",
+        "-hls_time", str(HLS_SEGMENT_SECONDS),
+        "-hls_playlist_type", "vod",
+        "-hls_segment_filename", os.path.join(out_dir, "v%v", "seg_%03d.ts"),
+        "-var_stream_map", stream_map,
+        os.path.join(out_dir, "v%v", "index.m3u8"),
+    ]
+    for i in range(n):
+        os.makedirs(os.path.join(out_dir, f"v{i}"), exist_ok=True)
+    subprocess.run(cmd, check=True)
+    write_master_playlist(out_dir, ladder, has_audio, source_size)
+
+# ---------- Helper: Thumbnails with ffmpeg ----------
+def extract_poster(in_path, out_path, duration=None):
+    """One frame from early in the clip (signs usually start from a neutral pose)."""
+    at = min(1.0, duration / 2) if duration else 0
+    cmd = ["ffmpeg", "-y", "-ss", f"{at:.3f}", "-i", in_path, "-frames:v", "1",
+           "-vf", f"scale=-2:{POSTER_HEIGHT}"]
+    if out_path.endswith(".webp"):
+        cmd += ["-c:v", "libwebp", "-quality", "70"]
+    else:
+        cmd += ["-q:v", "5"]
+    subprocess.run(cmd + [out_path], check=True)
+
+def extract_sprite(in_path, out_path, duration=None):
+    """Frames every SPRITE_INTERVAL_S tiled SPRITE_COLUMNS wide into one JPEG."""
+    frames = min(SPRITE_MAX_FRAMES, max(1, math.ceil((duration or SPRITE_INTERVAL_S) / SPRITE_INTERVAL_S)))
+    rows = math.ceil(frames / SPRITE_COLUMNS)
+    vf = f"fps=1/{SPRITE_INTERVAL_S},scale=-2:{SPRITE_TILE_HEIGHT},tile={SPRITE_COLUMNS}x{rows}"
+    cmd = ["ffmpeg", "-y", "-i", in_path, "-frames:v", "1", "-vf", vf, "-q:v", "6", out_path]
+    subprocess.run(cmd, check=True)
+
+def upload_file(path, key):
+    content_type = CONTENT_TYPES.get(os.path.splitext(path)[1], "application/octet-stream")
+    s3.upload_file(path, S3_BUCKET, key, ExtraArgs={"ContentType": content_type})
+
+def upload_dir(local_dir, prefix):
+    for root, _, files in os.walk(local_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            key = prefix + os.path.relpath(path, local_dir).replace(os.sep, "/")
+            upload_file(path, key)
+
 # ---------- Main ----------
-def main():
-    for key in list_mp4_objects(S3_BUCKET, S3_PREFIX):
-        print(f"Processing {key} ...")
-        filename = os.path.basename(key)
-        local_in = os.path.join(LOCAL_TMP, filename)
-        local_out = os.path.join(LOCAL_TMP, "fixed_" + filename)
+# ---------- Queue: scan ----------
+def enqueue_clips(queue):
+    """Plan every source clip and queue the ones with work to do. Recently uploaded clips go first."""
+    media = load_catalog_media()
+    converted = {o["Key"] for o in list_mp4_objects(S3_BUCKET, DERIVED_PREFIX)}
+    hls_masters = list_hls_masters(S3_BUCKET) if OUTPUT_MODE in ("hls", "both") else {}
+    thumbnails = list_thumbnails(S3_BUCKET) if THUMBNAILS else {}
+    now = datetime.now(timezone.utc)
+    counts = {"queued": 0, "skip": 0}
 
-        # 1. Download
-        try:
-            s3.download_file(S3_BUCKET, key, local_in)
-        except ClientError as e:
-            print(f"❌ Failed to download {key}: {e}")
+    for obj in list_mp4_objects(S3_BUCKET, S3_PREFIX):
+        key = obj["Key"]
+        stem = clip_stem(key)
+        info = media.get(key)
+        mp4_plan = plan_mp4(key, info, converted) if OUTPUT_MODE in ("mp4", "both") else "skip"
+        need_hls = OUTPUT_MODE in ("hls", "both") and (FORCE or stem not in hls_masters)
+        have = thumbnails.get(stem, {})
+        need_thumbs = THUMBNAILS and (FORCE or have.get("poster") != poster_key(stem)
+                                      or (SPRITES and "sprite" not in have))
+        if mp4_plan == "skip" and not need_hls and not need_thumbs:
+            counts["skip"] += 1
             continue
+        # one job per stem is enough for the HLS ladder and thumbnails
+        if need_hls:
+            hls_masters[stem] = hls_prefix(stem)
+        if need_thumbs:
+            thumbnails[stem] = {"poster": poster_key(stem), "sprite": sprite_key(stem)}
 
-        # 2. Transcode
-        try:
+        lm = obj.get("LastModified")
+        recent = lm is not None and (now - lm).total_seconds() < NEW_CLIP_WINDOW_S
+        plan = {"mp4": mp4_plan, "hls": need_hls, "thumbs": need_thumbs, "info": info}
+        if queue.enqueue(key, obj.get("ETag", "").strip('"'), plan,
+                         priority=NEW_CLIP_PRIORITY if recent else 0, force=FORCE):
+            counts["queued"] += 1
+    return counts
+
+# ---------- Queue: work ----------
+def process_clip(key, plan, set_state):
+    """
+    Download -> encode -> upload for one clip. Raises on any failure so the queue
+    retries the whole job (every step overwrites its outputs, so a retry is safe).
+    """
+    info = plan.get("info")
+    mp4_plan = plan["mp4"]
+    stem = clip_stem(key)
+    filename = os.path.basename(key)
+    local_in = os.path.join(LOCAL_TMP, filename)
+    local_out = os.path.join(LOCAL_TMP, "fixed_" + filename)
+    hls_dir = os.path.join(LOCAL_TMP, "hls_" + stem)
+    poster = os.path.join(LOCAL_TMP, f"poster_{stem}.{POSTER_FORMAT}")
+    sprite = os.path.join(LOCAL_TMP, f"sprite_{stem}.jpg")
+
+    try:
+        # 1. Download
+        s3.download_file(S3_BUCKET, key, local_in)
+
+        set_state("encoding")
+        if info is None:
+            # not probed at ingest yet: probe the local copy instead
+            try:
+                info = probe(local_in)
+            except (OSError, subprocess.SubprocessError, json.JSONDecodeError) as e:
+                # ffprobe missing (FileNotFoundError), crashed, or printed no JSON: use defaults
+                print(f"⚠️ ffprobe failed for {key}: {e}")
+                info = {}
+            if mp4_plan != "skip":
+                mp4_plan = plan_mp4(key, info, set())
+
+        # 2. Transcode (or remux) to H.264 MP4, HLS ladder, thumbnails
+        if mp4_plan == "remux":
+            remux_faststart(local_in, local_out)
+        elif mp4_plan == "encode":
             transcode_to_h264(local_in, local_out)
-        except subprocess.CalledProcessError as e:
-            print(f"❌ ffmpeg failed for {key}: {e}")
-            continue
+        if plan["hls"]:
+            if not info.get("height"):
+                info = probe(local_in)  # a probe error fails this job only (see run_worker)
+            if not info.get("height"):
+                raise ValueError(f"No video height from ffprobe for {key}, cannot build the HLS ladder")
+            transcode_to_hls(
+                local_in, hls_dir, ladder_for(info["height"]),
+                info.get("has_audio", info.get("audio_codec") is not None),
+                source_size=(info["width"], info["height"]),
+            )
+        if plan["thumbs"]:
+            extract_poster(local_in, poster, info.get("duration_s"))
+            if SPRITES:
+                extract_sprite(local_in, sprite, info.get("duration_s"))
 
         # 3. Upload back to S3 (to "converted/" prefix to避免覆蓋)
-        new_key = f"converted/{filename}"
+        set_state("uploading")
+        if mp4_plan in ("remux", "encode"):
+            s3.upload_file(local_out, S3_BUCKET, DERIVED_PREFIX + filename, ExtraArgs={"ContentType": "video/mp4"})
+        if plan["hls"]:
+            upload_dir(hls_dir, hls_prefix(stem))
+        if plan["thumbs"]:
+            upload_file(poster, poster_key(stem))
+            if SPRITES:
+                upload_file(sprite, sprite_key(stem))
+    finally:
+        # 4. Cleanup
+        for path in (local_in, local_out, poster, sprite):
+            if os.path.exists(path):
+                os.remove(path)
+        shutil.rmtree(hls_dir, ignore_errors=True)
+
+def run_worker(queue, wait=False):
+    """
+    Drain the queue. With `wait`, sleep through backoff periods until nothing is pending.
+    A job that raises is recorded as a failed attempt (retried with backoff up to MAX_ATTEMPTS).
+    """
+    worker = worker_id()
+    resumed = queue.resume()
+    if resumed:
+        print(f"↻ Resumed {resumed} job(s) interrupted by an earlier run (each counted as a failed attempt)")
+    done = failed = 0
+    while True:
+        job = queue.claim(worker)
+        if job is None:
+            delay = queue.next_wakeup()
+            if wait and delay is not None:
+                time.sleep(min(delay, 60))
+                continue
+            break
+        key = job["key"]
+        print(f"Processing {key} (try {job['attempts'] + 1}, {job['plan']['mp4']}"
+              f"{', hls' if job['plan']['hls'] else ''}{', thumbs' if job['plan']['thumbs'] else ''}) ...")
         try:
-            s3.upload_file(
-                local_out, S3_BUCKET, new_key,
-                ExtraArgs={"ContentType": "video/mp4"}
-            )
-            print(f"✅ Uploaded {new_key}")
-        except ClientError as e:
-            print(f"❌ Failed to upload {new_key}: {e}")
+            process_clip(key, job["plan"], lambda state: queue.set_state(key, state))
+        except Exception as e:  # any error fails this attempt only; the queue keeps draining
+            state = queue.fail(key, f"{type(e).__name__}: {e}")
+            failed += 1
+            print(f"❌ {key}: {e} -> {state}")
+            continue
+        queue.complete(key)
+        done += 1
+        print(f"✅ {key}")
+    return {"done": done, "failed_attempts": failed}
 
-        # 4. Cleanup
-        os.remove(local_in)
-        os.remove(local_out)
+# ---------- Main ----------
+def main():
+    parser = argparse.ArgumentParser(description="Transcode S3 clips through a durable local job queue.")
+    parser.add_argument("--scan-only", action="store_true", help="Queue work without processing it")
+    parser.add_argument("--no-scan", action="store_true", help="Only resume/drain the existing queue")
+    parser.add_argument("--wait", action="store_true", help="Keep running until backed-off retries finish")
+    args = parser.parse_args()
+
+    queue = TranscodeQueue()
+    try:
+        if not args.no_scan:
+            print(f"Scan: {enqueue_clips(queue)}")
+        if not args.scan_only:
+            print(f"Done: {run_worker(queue, wait=args.wait)}")
+        print(f"Queue: {queue.stats()['counts']}")
+    finally:
+        queue.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,14 +1,21 @@
 # s3_toSQL.py
 import os
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import Dict, Iterable, Tuple
+from typing import Dict, Iterable, List, Tuple
 
 import boto3
+from botocore.client import Config
 from botocore.exceptions import BotoCoreError, ClientError
 from sqlalchemy import create_engine, text
 from sqlalchemy.engine import URL
 
+from media_probe import probe
+from prefork import register_engine
+
 # ---------- Settings from environment ----------
 DB_HOST = os.getenv("DB_HOST", "")
 DB_PORT = int(os.getenv("DB_PORT", "3306"))
@@ -20,7 +27,7 @@ AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
 S3_BUCKET = os.getenv("S3_BUCKET", "demo2109bhargav")
 
 # ---------- DB engine ----------
-def get_db_engine():
+def get_db_engine(connect_args: Dict | None = None):
     db_url = URL.create(
         "mysql+pymysql",
         username=DB_USER,
@@ -29,14 +36,58 @@ def get_db_engine():
         port=DB_PORT,
         database=DB_NAME,
     )
-    return create_engine(
+    return register_engine(create_engine(
         db_url,
         pool_pre_ping=True,
         pool_recycle=3600,
         pool_timeout=30,
         pool_size=5,
         max_overflow=10,
-    )
+        connect_args=connect_args or {},
+    ))
+
+# ---------- Catalog collections (API name -> table) ----------
+COLLECTIONS = {
+    "videos": "videos",
+    "book1": "book_1_video",
+    "book2": "book_2_video",
+    "book3": "book_3_video",
+}
+# collections that only expose part of their table (see video_backend.get_videos)
+COLLECTION_KEY_PREFIX = {
+    "videos": "converted/",
+}
+
+def collection_for_table(table: str) -> str | None:
+    return next((name for name, t in COLLECTIONS.items() if t == table), None)
+
+# ---------- Derived outputs (written by s3_batch_transcode) ----------
+DERIVED_PREFIX = "converted/"
+HLS_PREFIX = DERIVED_PREFIX + "hls/"
+HLS_MASTER = "master.m3u8"
+
+def clip_stem(key: str) -> str:
+    return os.path.splitext(os.path.basename(key))[0]
+
+def hls_prefix(stem: str) -> str:
+    """Per-clip prefix holding the HLS ladder, e.g. converted/hls/12 hello/"""
+    return f"{HLS_PREFIX}{stem}/"
+
+def hls_master_key(stem: str) -> str:
+    return hls_prefix(stem) + HLS_MASTER
+
+# Poster frame + optional sprite sheet per clip, e.g. converted/thumbs/12 hello.webp
+THUMB_PREFIX = DERIVED_PREFIX + "thumbs/"
+POSTER_FORMAT = os.getenv("POSTER_FORMAT", "webp")  # webp | jpg
+SPRITE_SUFFIX = "_sprite.jpg"
+SPRITE_COLUMNS = int(os.getenv("SPRITE_COLUMNS", "5"))
+SPRITE_INTERVAL_S = float(os.getenv("SPRITE_INTERVAL_S", "1"))
+
+def poster_key(stem: str) -> str:
+    return f"{THUMB_PREFIX}{stem}.{POSTER_FORMAT}"
+
+def sprite_key(stem: str) -> str:
+    return f"{THUMB_PREFIX}{stem}{SPRITE_SUFFIX}"
 
 # ---------- Create table SQL (with shorter index on s3_key) ----------
 def create_table_sql(table: str) -> str:
@@ -49,6 +100,17 @@ def create_table_sql(table: str) -> str:
       size_bytes BIGINT NULL,
       etag VARCHAR(128) NULL,
       last_modified DATETIME NULL,
+      hls_key VARCHAR(1024) NULL,
+      duration_s DOUBLE NULL,
+      width INT NULL,
+      height INT NULL,
+      video_codec VARCHAR(32) NULL,
+      audio_codec VARCHAR(32) NULL,
+      pix_fmt VARCHAR(32) NULL,
+      bitrate BIGINT NULL,
+      probed_etag VARCHAR(128) NULL,
+      poster_key VARCHAR(1024) NULL,
+      sprite_key VARCHAR(1024) NULL,
       created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
       updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
       UNIQUE KEY uk_s3_key (s3_key(255)),  
@@ -57,23 +119,67 @@ def create_table_sql(table: str) -> str:
     ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
     """
 
+# Columns added after the first release; ensure_catalog_columns() adds them to older tables
+CATALOG_EXTRA_COLUMNS = {
+    "hls_key": "VARCHAR(1024) NULL",
+    "duration_s": "DOUBLE NULL",
+    "width": "INT NULL",
+    "height": "INT NULL",
+    "video_codec": "VARCHAR(32) NULL",
+    "audio_codec": "VARCHAR(32) NULL",
+    "pix_fmt": "VARCHAR(32) NULL",
+    "bitrate": "BIGINT NULL",
+    "probed_etag": "VARCHAR(128) NULL",
+    "poster_key": "VARCHAR(1024) NULL",
+    "sprite_key": "VARCHAR(1024) NULL",
+}
+
+# ffprobe fields stored per clip (see media_probe.summarize)
+MEDIA_COLUMNS = ["duration_s", "width", "height", "video_codec", "audio_codec", "pix_fmt", "bitrate"]
+
+def ensure_catalog_columns(conn, table: str) -> None:
+    existing = {
+        r[0] for r in conn.execute(text("""
+            SELECT COLUMN_NAME FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :t
+        """), {"t": table})
+    }
+    for column, ddl in CATALOG_EXTRA_COLUMNS.items():
+        if column not in existing:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
 UPSERT_SQL_TEMPLATE = """
-INSERT INTO {table} (id, filename, s3_key, url, size_bytes, etag, last_modified)
-VALUES (:id, :filename, :key, :url, :size, :etag, :last_modified)
+INSERT INTO {table} (id, filename, s3_key, url, size_bytes, etag, last_modified, hls_key,
+                     poster_key, sprite_key,
+                     duration_s, width, height, video_codec, audio_codec, pix_fmt, bitrate, probed_etag)
+VALUES (:id, :filename, :key, :url, :size, :etag, :last_modified, :hls_key,
+        :poster_key, :sprite_key,
+        :duration_s, :width, :height, :video_codec, :audio_codec, :pix_fmt, :bitrate, :probed_etag)
 ON DUPLICATE KEY UPDATE
   filename     = VALUES(filename),
   url          = VALUES(url),
   size_bytes   = VALUES(size_bytes),
   etag         = VALUES(etag),
-  last_modified= VALUES(last_modified);
+  last_modified= VALUES(last_modified),
+  hls_key      = VALUES(hls_key),
+  poster_key   = VALUES(poster_key),
+  sprite_key   = VALUES(sprite_key),
+  duration_s   = IF(VALUES(probed_etag) IS NULL, duration_s, VALUES(duration_s)),
+  width        = IF(VALUES(probed_etag) IS NULL, width, VALUES(width)),
+  height       = IF(VALUES(probed_etag) IS NULL, height, VALUES(height)),
+  video_codec  = IF(VALUES(probed_etag) IS NULL, video_codec, VALUES(video_codec)),
+  audio_codec  = IF(VALUES(probed_etag) IS NULL, audio_codec, VALUES(audio_codec)),
+  pix_fmt      = IF(VALUES(probed_etag) IS NULL, pix_fmt, VALUES(pix_fmt)),
+  bitrate      = IF(VALUES(probed_etag) IS NULL, bitrate, VALUES(bitrate)),
+  probed_etag  = COALESCE(VALUES(probed_etag), probed_etag);
 """
 
 # ---------- S3 helpers ----------
 def s3_client():
     return boto3.client("s3", region_name=AWS_REGION)
 
-def list_mp4_objects(bucket: str, prefix: str = "") -> Iterable[Dict]:
-    client = s3_client()
+def list_mp4_objects(bucket: str, prefix: str = "", client=None) -> Iterable[Dict]:
+    client = client or s3_client()
     paginator = client.get_paginator("list_objects_v2")
     kwargs = {"Bucket": bucket}
     if prefix:
@@ -82,7 +188,7 @@ def list_mp4_objects(bucket: str, prefix: str = "") -> Iterable[Dict]:
     for page in paginator.paginate(**kwargs):
         for obj in page.get("Contents", []):
             key = obj["Key"]
-            if key.lower().endswith(".mp4"):
+            if key.lower().endswith(".mp4") and not key.startswith(HLS_PREFIX):
                 yield {
                     "Key": key,
                     "Size": obj.get("Size"),
@@ -90,6 +196,83 @@ def list_mp4_objects(bucket: str, prefix: str = "") -> Iterable[Dict]:
                     "LastModified": obj.get("LastModified"),
                 }
 
+def list_hls_masters(bucket: str, client=None) -> Dict[str, str]:
+    """stem -> master playlist key for every clip that has an HLS ladder."""
+    client = client or s3_client()
+    paginator = client.get_paginator("list_objects_v2")
+    masters: Dict[str, str] = {}
+    for page in paginator.paginate(Bucket=bucket, Prefix=HLS_PREFIX):
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            if key.endswith("/" + HLS_MASTER):
+                stem = key[len(HLS_PREFIX):-len(HLS_MASTER) - 1]
+                masters[stem] = key
+    return masters
+
+def list_thumbnails(bucket: str, client=None) -> Dict[str, Dict[str, str]]:
+    """stem -> {"poster": key, "sprite": key} for every clip with thumbnails (either may be missing)."""
+    client = client or s3_client()
+    paginator = client.get_paginator("list_objects_v2")
+    thumbs: Dict[str, Dict[str, str]] = {}
+    for page in paginator.paginate(Bucket=bucket, Prefix=THUMB_PREFIX):
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            name = key[len(THUMB_PREFIX):]
+            if "/" in name:
+                continue
+            if name.endswith(SPRITE_SUFFIX):
+                thumbs.setdefault(name[:-len(SPRITE_SUFFIX)], {})["sprite"] = key
+            elif name.endswith((".webp", ".jpg")):
+                stem, ext = os.path.splitext(name)
+                entry = thumbs.setdefault(stem, {})
+                if ext == "." + POSTER_FORMAT or "poster" not in entry:
+                    entry["poster"] = key
+    return thumbs
+
+# ---------- Media probing ----------
+PROBE_WORKERS = int(os.getenv("INGEST_PROBE_WORKERS", "8"))
+PROBE_ENABLED = os.getenv("INGEST_PROBE", "1") == "1"
+
+def presign_client():
+    return boto3.client("s3", region_name=AWS_REGION, config=Config(signature_version="s3v4"))
+
+def probe_objects(bucket: str, keys: List[str], client=None, pool: ThreadPoolExecutor | None = None) -> Tuple[Dict[str, Dict], List[str]]:
+    """
+    ffprobe each key in parallel through a short-lived pre-signed URL. ffprobe only issues
+    ranged reads for the container headers (moov), not the whole clip.
+    `pool` lets concurrent ingests share one bounded set of ffprobe workers.
+    Returns ({key: media fields}, errors).
+    """
+    if not keys:
+        return {}, []
+    client = client or presign_client()
+
+    def probe_one(key: str) -> Dict:
+        url = client.generate_presigned_url("get_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=900)
+        return probe(url)
+
+    results: Dict[str, Dict] = {}
+    errors: List[str] = []
+    own_pool = pool is None
+    pool = pool or ThreadPoolExecutor(max_workers=PROBE_WORKERS)
+    try:
+        futures = {pool.submit(probe_one, key): key for key in keys}
+        for fut in as_completed(futures):
+            key = futures[fut]
+            try:
+                results[key] = fut.result()
+            except FileNotFoundError:
+                errors.append("ffprobe not installed; media metadata skipped")
+                for f in futures:
+                    f.cancel()
+                break
+            except Exception as e:
+                errors.append(f"probe {key}: {e}")
+    finally:
+        if own_pool:
+            pool.shutdown(wait=True)
+    return results, errors
+
 def public_url(bucket: str, key: str) -> str:
     return f"https://{bucket}.s3.{AWS_REGION}.amazonaws.com/{key}"
 
@@ -105,26 +288,87 @@ def parse_id_and_name_from_key(key: str) -> Tuple[int | None, str]:
     return vid, safe_name
 
 # ---------- Main ingest ----------
-def ingest_from_s3(prefix: str = "", collection: str = None) -> Dict:
-    engine = get_db_engine()
+class IngestContext:
+    """
+    Resources shared by the ingests of one batch: a DB engine, S3 clients, a bounded ffprobe
+    pool and the bucket-wide HLS / thumbnail listings (identical for every prefix).
+    A standalone ingest_from_s3() call builds its own.
+    """
+
+    def __init__(self, engine=None):
+        self.owns_engine = engine is None
+        self.engine = engine or get_db_engine()
+        self.s3 = s3_client()                 # boto3 clients are thread-safe
+        self.presign = presign_client()
+        self.probe_pool = ThreadPoolExecutor(max_workers=PROBE_WORKERS, thread_name_prefix="ingest-probe")
+        self._lock = threading.Lock()
+        self._listings: Tuple[Dict[str, str], Dict[str, Dict[str, str]]] | None = None
+
+    def derived_listings(self) -> Tuple[Dict[str, str], Dict[str, Dict[str, str]]]:
+        """(hls_masters, thumbnails), listed once per context."""
+        with self._lock:
+            if self._listings is None:
+                self._listings = (list_hls_masters(S3_BUCKET, self.s3), list_thumbnails(S3_BUCKET, self.s3))
+            return self._listings
+
+    def close(self) -> None:
+        self.probe_pool.shutdown(wait=True)
+        if self.owns_engine:
+            self.engine.dispose()
 
 
+def ingest_from_s3(prefix: str = "", collection: str = None, ctx: IngestContext | None = None,
+                   publish: bool = True) -> Dict:
+    """
+    Upsert the clips under `prefix` into the collection's table. With `publish`, the catalog
+    snapshot is republished afterwards so the listing endpoints serve the new rows.
+    """
+    own_ctx = ctx is None
+    ctx = ctx or IngestContext()
+    try:
+        summary = _ingest(prefix, collection, ctx)
+        if publish:
+            summary["snapshot"] = publish_catalog_snapshot(ctx.engine)
+        return summary
+    finally:
+        if own_ctx:
+            ctx.close()
+
+
+def _ingest(prefix: str, collection: str | None, ctx: IngestContext) -> Dict:
+    engine = ctx.engine
+    started = time.perf_counter()
+
     table_name = collection or (prefix.rstrip("/").replace("/", "_") + "_video")
 
-   
     with engine.begin() as conn:
         conn.execute(text(create_table_sql(table_name)))
+        ensure_catalog_columns(conn, table_name)
 
     inserted = 0
     scanned = 0
+    probed = 0
     errors: list[str] = []
 
     try:
+        hls_masters, thumbnails = ctx.derived_listings()
+        objects = list(list_mp4_objects(S3_BUCKET, prefix, ctx.s3))
+        scanned = len(objects)
+
+        # only probe clips that are new or changed since their last probe
+        with engine.connect() as conn:
+            probed_etags = dict(conn.execute(text(f"SELECT s3_key, probed_etag FROM {table_name}")).all())
+        to_probe = [o["Key"] for o in objects if probed_etags.get(o["Key"]) != o.get("ETag")]
+        media: Dict[str, Dict] = {}
+        if PROBE_ENABLED:
+            media, probe_errors = probe_objects(S3_BUCKET, to_probe, ctx.presign, ctx.probe_pool)
+            probed = len(media)
+            errors.extend(probe_errors)
+
         with engine.begin() as conn:
             upsert_sql = UPSERT_SQL_TEMPLATE.format(table=table_name)
 
-            for obj in list_mp4_objects(S3_BUCKET, prefix):
-                scanned += 1
+            for obj in objects:
                 key = obj["Key"]
                 size = obj.get("Size")
                 etag = obj.get("ETag")
@@ -133,6 +377,8 @@ def ingest_from_s3(prefix: str = "", collection: str = None) -> Dict:
 
                 vid, filename = parse_id_and_name_from_key(key)
                 url = public_url(S3_BUCKET, key)
+                meta = media.get(key)
+                thumbs = thumbnails.get(clip_stem(key), {})
 
                 try:
                     conn.execute(
@@ -145,6 +391,12 @@ def ingest_from_s3(prefix: str = "", collection: str = None) -> Dict:
                             "size": size,
                             "etag": etag,
                             "last_modified": lm_dt,
+                            "hls_key": hls_masters.get(clip_stem(key)),
+                            "poster_key": thumbs.get("poster"),
+                            "sprite_key": thumbs.get("sprite"),
+                            **{c: (meta or {}).get(c) for c in MEDIA_COLUMNS},
+                            # NULL keeps the previously probed values
+                            "probed_etag": etag if meta else None,
                         },
                     )
                     inserted += 1
@@ -160,5 +412,71 @@ def ingest_from_s3(prefix: str = "", collection: str = None) -> Dict:
         "table": table_name,
         "scanned": scanned,
         "upserted": inserted,
+        "probed": probed,
         "errors": errors,
-    }
\ No newline at end of file
+        "elapsed_s": round(time.perf_counter() - started, 3),
+    }
+
+def publish_catalog_snapshot(engine) -> Dict:
+    # imported here: catalog_snapshot imports this module
+    from catalog_snapshot import publish_after_update
+    return publish_after_update(engine)
+
+# ---------- Concurrent multi-collection ingest ----------
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+TABLE_NAME = re.compile(r"^[A-Za-z0-9_]+$")
+
+def resolve_targets(targets: Dict[str, str]) -> Dict[str, str]:
+    """
+    prefix -> table. Targets may name an API collection ("book1") or a table ("book_1_video").
+    Raises ValueError for invalid names, or for two prefixes feeding one table (their upserts
+    would contend for the same rows).
+    """
+    resolved: Dict[str, str] = {}
+    for prefix, target in targets.items():
+        table = COLLECTIONS.get(target, target)
+        if not TABLE_NAME.match(table or ""):
+            raise ValueError(f"Invalid collection or table name: {target!r}")
+        if table in resolved.values():
+            raise ValueError(f"More than one prefix targets table {table}")
+        resolved[prefix] = table
+    return resolved
+
+def ingest_many(targets: Dict[str, str], workers: int = INGEST_WORKERS, publish: bool = True) -> Dict:
+    """
+    Ingest several prefix -> collection pairs concurrently on `workers` threads sharing
+    one DB pool, one S3 client and one ffprobe pool; wall time ~ the slowest prefix.
+    With `publish`, the catalog snapshot is republished once for the whole batch.
+    """
+    resolved = resolve_targets(targets)
+    started = time.perf_counter()
+    ctx = IngestContext()
+    reports: Dict[str, Dict] = {}
+    try:
+        # keep each ingest's connection need (1) well inside the shared pool (5 + 10 overflow)
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(resolved))),
+                                thread_name_prefix="ingest") as pool:
+            futures = {pool.submit(ingest_from_s3, prefix, table, ctx, False): prefix
+                       for prefix, table in resolved.items()}
+            for fut in as_completed(futures):
+                prefix = futures[fut]
+                try:
+                    report = fut.result()
+                except Exception as e:  # e.g. DB down while creating the table
+                    report = {"bucket": S3_BUCKET, "prefix": prefix, "table": resolved[prefix],
+                              "scanned": 0, "upserted": 0, "probed": 0, "errors": [str(e)]}
+                reports[report["table"]] = report
+        snapshot = publish_catalog_snapshot(ctx.engine) if publish else None
+    finally:
+        ctx.close()
+
+    return {
+        "snapshot": snapshot,
+        "bucket": S3_BUCKET,
+        "collections": reports,
+        "scanned": sum(r["scanned"] for r in reports.values()),
+        "upserted": sum(r["upserted"] for r in reports.values()),
+        "probed": sum(r["probed"] for r in reports.values()),
+        "error_count": sum(len(r["errors"]) for r in reports.values()),
+        "elapsed_s": round(time.perf_counter() - started, 3),
+    }
@@ -0,0 +1,79 @@
+# single_flight.py
+# Request coalescing: concurrent identical requests share one in-flight computation.
+# The first caller for a key runs it; callers arriving before it finishes wait and get
+# the same result (or the same exception). Nothing is cached once the call returns.
+#
+#   return coalesce(request, build_response, derived=derived)
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import Request
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self.stats = {"requests": 0, "executions": 0, "collapsed": 0, "errors": 0, "max_waiters": 0}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            self.stats["requests"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats["executions"] += 1
+            else:
+                call.waiters += 1
+                self.stats["collapsed"] += 1
+                self.stats["max_waiters"] = max(self.stats["max_waiters"], call.waiters)
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                with self._lock:
+                    self.stats["errors"] += 1
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            in_flight = len(self._calls)
+            stats = dict(self.stats)
+        stats["in_flight"] = in_flight
+        stats["collapse_ratio"] = round(stats["collapsed"] / stats["requests"], 4) if stats["requests"] else None
+        return stats
+
+
+# one group for the whole process; keys carry the route, so apps never collide
+flight = SingleFlight()
+
+
+def request_key(request: Request, **params) -> str:
+    """Full request path (incl. mount) + the endpoint's parsed, so normalized, parameters, sorted."""
+    return request.url.path + "?" + "&".join(f"{k}={params[k]!r}" for k in sorted(params))
+
+
+def coalesce(request: Request, fn: Callable[[], Any], **params) -> Any:
+    return flight.do(request_key(request, **params), fn)
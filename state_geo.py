@@ -0,0 +1,330 @@
+# state_geo.py
+# State boundaries for the /map frontend, pre-joined with population and pre-compressed.
+#
+# The source GeoJSON (STATE_GEOJSON_PATH) is turned into a topology once per process:
+#   1. coordinates are quantized to a GEO_QUANTIZATION x GEO_QUANTIZATION grid, so borders
+#      shared by two states have identical vertices
+#   2. rings are cut at junctions (points where the neighbouring rings change) into arcs, and
+#      each shared border is stored once
+#   3. arcs are simplified (Douglas-Peucker) per detail level with their end points fixed, so
+#      neighbouring states still meet exactly after simplification
+# Outputs are TopoJSON (delta-encoded arcs) or GeoJSON, with population properties joined
+# in and gzip bytes cached per (detail, format, population data).
+#
+# The boundaries file is not part of the repo. Use the ABS "States and Territories" (STE 2021)
+# digital boundaries converted to GeoJSON (EPSG:4326), e.g.
+#   ogr2ogr -f GeoJSON -t_srs EPSG:4326 data/australian_states.geojson STE_2021_AUST_GDA2020.shp
+# and point STATE_GEOJSON_PATH at it. state_visual checks the path at startup: without the file
+# /map/states.* answer 404 and the boundaries are not warmed.
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# ---------- Settings ----------
+STATE_GEOJSON_PATH = os.getenv("STATE_GEOJSON_PATH", "./data/australian_states.geojson")
+STATE_NAME_PROPERTIES = ("STATE_NAME", "STE_NAME21", "STE_NAME16", "name", "NAME")
+GEO_QUANTIZATION = int(os.getenv("GEO_QUANTIZATION", "100000"))
+# Douglas-Peucker tolerance in degrees (~5 km, ~1 km, ~100 m)
+GEO_DETAIL_TOLERANCE = {"low": 0.05, "medium": 0.01, "high": 0.001}
+GEO_DETAIL_PATTERN = "^(" + "|".join(GEO_DETAIL_TOLERANCE) + ")$"
+GEO_FORMAT_PATTERN = "^(topojson|geojson)$"
+
+# DB names and boundary file names do not always agree (abbreviations, "The", case)
+STATE_ALIASES = {
+    "nsw": "new south wales", "vic": "victoria", "qld": "queensland", "sa": "south australia",
+    "wa": "western australia", "tas": "tasmania", "nt": "northern territory",
+    "act": "australian capital territory",
+}
+
+
+def normalize_state(name: Any) -> str:
+    key = re.sub(r"\s+", " ", str(name or "")).strip().lower()
+    key = re.sub(r"^the ", "", key)
+    return STATE_ALIASES.get(key, key)
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """Whether an Accept-Encoding header allows gzip ("gzip;q=0" and "*;q=0" refuse it)."""
+    wildcard = None
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding in ("gzip", "x-gzip"):
+            return q > 0
+        if coding == "*":
+            wildcard = q > 0
+    return bool(wildcard)
+
+
+Point = Tuple[int, int]
+
+
+# ---------- Simplification ----------
+def douglas_peucker(coords: np.ndarray, tolerance: float) -> np.ndarray:
+    """Keep-mask for `coords` (n x 2); the first and last points are always kept."""
+    n = len(coords)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        seg = coords[start + 1:end]
+        a, b = coords[start], coords[end]
+        ab = b - a
+        length = np.hypot(ab[0], ab[1])
+        if length == 0:  # closed arc: distance to the shared end point
+            dist = np.hypot(seg[:, 0] - a[0], seg[:, 1] - a[1])
+        else:
+            dist = np.abs(ab[0] * (seg[:, 1] - a[1]) - ab[1] * (seg[:, 0] - a[0])) / length
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            mid = start + 1 + i
+            keep[mid] = True
+            stack.append((start, mid))
+            stack.append((mid, end))
+    return keep
+
+
+# ---------- Topology ----------
+class StateTopology:
+    """Shared-arc topology of the state polygons, built from the source GeoJSON once."""
+
+    def __init__(self, geojson: Dict):
+        features = [f for f in geojson.get("features", []) if f.get("geometry")]
+        if not features:
+            raise ValueError("No features in the state boundaries file")
+
+        all_xy = np.array([xy for f in features for ring in _rings(f["geometry"]) for xy in ring], dtype=np.float64)
+        x0, y0 = all_xy.min(axis=0)
+        x1, y1 = all_xy.max(axis=0)
+        q = GEO_QUANTIZATION - 1
+        self.bbox = [float(x0), float(y0), float(x1), float(y1)]
+        self.scale = ((x1 - x0) / q or 1.0, (y1 - y0) / q or 1.0)
+        self.translate = (float(x0), float(y0))
+
+        # features -> polygons -> rings of quantized points (closing point dropped, duplicates removed)
+        self.names: List[str] = []
+        polygons_per_feature: List[List[List[List[Point]]]] = []
+        for f in features:
+            props = f.get("properties") or {}
+            self.names.append(next((str(props[k]) for k in STATE_NAME_PROPERTIES if props.get(k)), ""))
+            polygons = []
+            for polygon in _polygons(f["geometry"]):
+                rings = [r for r in (self._quantize_ring(ring) for ring in polygon) if len(r) >= 3]
+                if rings:
+                    polygons.append(rings)
+            polygons_per_feature.append(polygons)
+
+        junctions = _junctions([ring for polys in polygons_per_feature for poly in polys for ring in poly])
+        self.arcs: List[np.ndarray] = []  # quantized int arcs, shared borders stored once
+        self._arc_index: Dict[bytes, int] = {}
+        # feature -> polygon -> ring -> arc refs (negative = ~index, traversed reversed)
+        self.geometries: List[List[List[List[int]]]] = [
+            [[self._ring_arcs(ring, junctions) for ring in poly] for poly in polys]
+            for polys in polygons_per_feature
+        ]
+        self._simplified: Dict[str, List[np.ndarray]] = {}
+
+    def _quantize_ring(self, ring: Sequence[Sequence[float]]) -> List[Point]:
+        pts: List[Point] = []
+        for x, y, *_ in ring:
+            p = (int(round((x - self.translate[0]) / self.scale[0])), int(round((y - self.translate[1]) / self.scale[1])))
+            if not pts or pts[-1] != p:
+                pts.append(p)
+        if len(pts) > 1 and pts[0] == pts[-1]:
+            pts.pop()
+        return pts
+
+    def _ring_arcs(self, ring: List[Point], junctions: set) -> List[int]:
+        cuts = [i for i, p in enumerate(ring) if p in junctions]
+        if not cuts:
+            # no junction: one closed arc, started at its smallest point so the same ring
+            # read by two features (e.g. an enclave and the hole around it) dedupes
+            start = ring.index(min(ring))
+            return [self._add_arc(ring[start:] + ring[:start + 1])]
+        rotated = ring[cuts[0]:] + ring[:cuts[0]]
+        cuts = [c - cuts[0] for c in cuts] + [len(ring)]
+        rotated.append(rotated[0])
+        return [self._add_arc(rotated[a:b + 1]) for a, b in zip(cuts, cuts[1:])]
+
+    def _add_arc(self, points: List[Point]) -> int:
+        arr = np.array(points, dtype=np.int64)
+        key = arr.tobytes()
+        if key in self._arc_index:
+            return self._arc_index[key]
+        rkey = arr[::-1].tobytes()
+        if rkey in self._arc_index:
+            return ~self._arc_index[rkey]
+        self._arc_index[key] = len(self.arcs)
+        self.arcs.append(arr)
+        return len(self.arcs) - 1
+
+    def simplified_arcs(self, detail: str) -> List[np.ndarray]:
+        if detail not in self._simplified:
+            tolerance = GEO_DETAIL_TOLERANCE[detail]
+            scale = np.array(self.scale)
+            self._simplified[detail] = [arc[douglas_peucker(arc * scale, tolerance)] for arc in self.arcs]
+        return self._simplified[detail]
+
+    def layout(self, detail: str) -> Tuple[List[np.ndarray], List[List[List[List[int]]]]]:
+        """
+        Simplified arcs actually used + geometries re-indexed onto them. Rings that collapse
+        below a triangle are dropped (small islands at low detail), except each feature's
+        largest polygon, so no state disappears.
+        """
+        arcs = self.simplified_arcs(detail)
+
+        def ring_points(ring: List[int]) -> int:
+            return sum(len(arcs[~a if a < 0 else a]) - 1 for a in ring)
+
+        geometries = []
+        for polys in self.geometries:
+            largest = max(range(len(polys)), key=lambda i: sum(len(self.arcs[~a if a < 0 else a]) for a in polys[i][0]),
+                          default=None)
+            kept = []
+            for i, poly in enumerate(polys):
+                if ring_points(poly[0]) < 3 and i != largest:
+                    continue
+                kept.append([poly[0]] + [hole for hole in poly[1:] if ring_points(hole) >= 3])
+            geometries.append(kept)
+
+        used = sorted({~a if a < 0 else a for polys in geometries for poly in polys for ring in poly for a in ring})
+        remap = {old: new for new, old in enumerate(used)}
+        geometries = [
+            [[[remap[a] if a >= 0 else ~remap[~a] for a in ring] for ring in poly] for poly in polys]
+            for polys in geometries
+        ]
+        return [arcs[i] for i in used], geometries
+
+    # ---------- Encoders ----------
+    def topojson(self, detail: str, properties: List[Dict]) -> Dict:
+        arcs, geometries = self.layout(detail)
+        encoded = []
+        for arc in arcs:
+            delta = arc.copy()
+            delta[1:] -= arc[:-1]
+            encoded.append(delta.tolist())
+        return {
+            "type": "Topology",
+            "bbox": self.bbox,
+            "transform": {"scale": list(self.scale), "translate": list(self.translate)},
+            "objects": {"states": {"type": "GeometryCollection", "geometries": [
+                {"type": "MultiPolygon", "arcs": polys, "properties": props}
+                for polys, props in zip(geometries, properties) if polys
+            ]}},
+            "arcs": encoded,
+        }
+
+    def geojson(self, detail: str, properties: List[Dict]) -> Dict:
+        arcs, geometries = self.layout(detail)
+        digits = max(0, int(np.ceil(-np.log10(GEO_DETAIL_TOLERANCE[detail] / 10))))
+        scale, translate = np.array(self.scale), np.array(self.translate)
+        coords = [np.round(arc * scale + translate, digits) for arc in arcs]
+
+        def ring_coords(ring: List[int]) -> List[List[float]]:
+            out: List[List[float]] = []
+            for a in ring:
+                pts = coords[~a][::-1] if a < 0 else coords[a]
+                out.extend(pts[1:].tolist() if out else pts.tolist())
+            return out
+
+        return {"type": "FeatureCollection", "features": [
+            {"type": "Feature", "properties": props,
+             "geometry": {"type": "MultiPolygon", "coordinates": [[ring_coords(r) for r in poly] for poly in polys]}}
+            for polys, props in zip(geometries, properties) if polys
+        ]}
+
+
+def _polygons(geometry: Dict) -> List[List[Sequence]]:
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    if geometry["type"] == "MultiPolygon":
+        return list(geometry["coordinates"])
+    return []
+
+
+def _rings(geometry: Dict) -> List[Sequence]:
+    return [ring for poly in _polygons(geometry) for ring in poly]
+
+
+def _junctions(rings: List[List[Point]]) -> set:
+    """Points whose pair of neighbours differs between the rings passing through them."""
+    neighbours: Dict[Point, frozenset] = {}
+    junctions = set()
+    for ring in rings:
+        n = len(ring)
+        for i, p in enumerate(ring):
+            pair = frozenset((ring[i - 1], ring[(i + 1) % n]))
+            seen = neighbours.setdefault(p, pair)
+            if seen != pair:
+                junctions.add(p)
+    return junctions
+
+
+# ---------- Cached, pre-joined output ----------
+class StateGeoCache:
+    """Topology built once; joined + serialized + gzipped output cached per population version."""
+
+    def __init__(self, path: str = STATE_GEOJSON_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._topology: Optional[StateTopology] = None
+        self._outputs: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+
+    def available(self) -> bool:
+        return os.path.isfile(self.path)
+
+    def topology(self) -> StateTopology:
+        with self._lock:
+            if self._topology is None:
+                with open(self.path, encoding="utf-8") as f:
+                    self._topology = StateTopology(json.load(f))
+            return self._topology
+
+    def render(self, detail: str, fmt: str, states: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """{"body", "gzip", "etag"} for the boundaries joined with `states` (name/value/share_pct/rank rows)."""
+        version = hashlib.sha1(json.dumps(states, sort_keys=True, default=str).encode()).hexdigest()[:12]
+        key = (detail, fmt, version)
+        hit = self._outputs.get(key)
+        if hit is not None:
+            return hit
+
+        topo = self.topology()
+        by_name = {normalize_state(s["name"]): s for s in states}
+        properties = []
+        for name in topo.names:
+            row = by_name.get(normalize_state(name), {})
+            properties.append({
+                "name": name,
+                "value": row.get("value"),
+                "share_pct": row.get("share_pct"),
+                "rank": row.get("rank"),
+            })
+        doc = topo.topojson(detail, properties) if fmt == "topojson" else topo.geojson(detail, properties)
+        body = json.dumps(doc, separators=(",", ":")).encode()
+        out = {"body": body, "gzip": gzip.compress(body, compresslevel=9), "etag": f'W/"{fmt}-{detail}-{version}"'}
+        with self._lock:
+            # keep only the current population version per (detail, format)
+            for old in [k for k in self._outputs if k[:2] == key[:2]]:
+                del self._outputs[old]
+            self._outputs[key] = out
+        return out
+
+
+state_geo = StateGeoCache()
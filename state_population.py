@@ -0,0 +1,31 @@
+# state_population.py
+# State population query for auslan_population_state_years: cleaning (trim, strip commas and
+# spaces, cast to a number), the non-state blacklist and ordering all happen in SQL. Used by
+# the state map app and by census_summary, each with its own engine.
+from sqlalchemy import bindparam, text
+
+STATE_BLACKLIST = [
+    "Total", "Other Territories", "OT", "Other Territory",
+    "Australia", "Total Australia",
+]
+
+STATE_POP_SQL = text("""
+    SELECT state_name, FLOOR(population) AS population
+    FROM (
+        SELECT
+          TRIM(`2021State`) AS state_name,
+          CAST(REPLACE(REPLACE(CAST(`population_[0]` AS CHAR), ',', ''), ' ', '') AS DECIMAL(20, 4)) AS population
+        FROM auslan_population_state_years
+        WHERE `2021State` IS NOT NULL
+        AND `population_[0]` IS NOT NULL
+    ) AS cleaned
+    WHERE state_name != ''
+    AND state_name NOT IN :blacklist
+    AND population >= 1
+    ORDER BY population DESC
+""").bindparams(bindparam("blacklist", expanding=True))
+
+
+def load_state_population_rows(conn) -> list:
+    """(state_name, population) rows, largest first, on an open connection."""
+    return conn.execute(STATE_POP_SQL, {"blacklist": STATE_BLACKLIST}).all()
@@ -1,9 +1,10 @@
 import os
-from typing import List, Dict, Any
+import time
+from typing import List, Dict, Any, Optional, Tuple
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Path, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response
 from sqlalchemy import create_engine, text
 from sqlalchemy.engine import URL
 from sqlalchemy.exc import SQLAlchemyError
@@ -13,6 +14,15 @@ from slowapi.util import get_remote_address
 from slowapi.middleware import SlowAPIMiddleware
 from slowapi.errors import RateLimitExceeded
 
+from catalog_snapshot import snapshot_store
+from db_guard import DB_POOL_TIMEOUT_S, GuardedReader, install_query_timeout, mark_stale, timeout_connect_args
+from prefork import register_engine
+from single_flight import coalesce
+from state_geo import GEO_DETAIL_PATTERN, GEO_FORMAT_PATTERN, accepts_gzip, state_geo
+from state_population import load_state_population_rows
+from stream_export import EXPORT_FORMAT_PATTERN, stream_table_export
+from warm_cache import warm_cache
+
 # Load environment variables
 load_dotenv()
 
@@ -33,24 +43,33 @@ db_url = URL.create(
     database=DB_NAME,
 )
 
-# 初始化資料庫引擎
+# 初始化資料庫引擎 (連線是 lazy 的：啟動時 DB 掛掉，之後的請求仍會重連)
 engine = None
 try:
     engine = create_engine(
         db_url, 
         pool_pre_ping=True, 
         pool_recycle=3600,
-        pool_timeout=30,
+        pool_timeout=DB_POOL_TIMEOUT_S,
         pool_size=5,
-        max_overflow=10
+        max_overflow=10,
+        connect_args=timeout_connect_args(),
     )
-    # 測試連線
-    with engine.connect() as conn:
-        conn.execute(text("SELECT 1"))
-    print("Database connection successful")
+    register_engine(install_query_timeout(engine))
+except Exception as e:
+    print(f"Database engine error: {e}")
+
+# 測試連線 (失敗只記錄，不再把 engine 設成 None)
+try:
+    if engine is not None:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        print("Database connection successful")
 except Exception as e:
     print(f"Database connection error: {e}")
-    engine = None
+
+# 讀取端點的 circuit breaker + 最後一次成功的結果 (DB 出問題時回傳 stale 資料)
+state_db = GuardedReader(engine, "state")
 
 # 創建FastAPI應用
 app = FastAPI(title="Auslan State Map API")
@@ -79,14 +98,69 @@ def _rate_limit_handler(request, exc):  # type: ignore
 @app.get("/")
 @limiter.limit("5/10second")
 def map_root(request: Request):
-    return {"message": "Auslan State Map API", "endpoints": ["/state-pop-2021", "/test-db", "/debug-table"]}
+    return {"message": "Auslan State Map API", "endpoints": ["/state-pop-2021", "/state-share", "/states.topojson", "/states.geojson", "/test-db", "/debug-table", "/debug-table/export", "/raw-data/export"]}
+
+# 預先計算的結果 (含 share % 與 rank)，過期後才重新查詢
+STATE_POP_CACHE_TTL = int(os.getenv("STATE_POP_CACHE_TTL", "300"))
+_state_pop_cache: Dict[str, Any] = {"loaded_at": 0.0, "plain": None, "derived": None}
+
+
+def load_state_populations() -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Run the cleaning query once and precompute both response shapes.
+    `derived` adds share_pct (of the listed states) and rank (1 = largest).
+    """
+    with engine.connect() as conn:
+        rows = load_state_population_rows(conn)
+
+    total = sum(int(r.population) for r in rows)
+    plain: List[Dict[str, Any]] = []
+    derived: List[Dict[str, Any]] = []
+    rank, prev = 0, None
+    for i, r in enumerate(rows, start=1):
+        value = int(r.population)
+        if value != prev:
+            rank, prev = i, value
+        plain.append({"name": r.state_name, "value": value})
+        derived.append({
+            "name": r.state_name,
+            "value": value,
+            "share_pct": round(value * 100.0 / total, 2) if total else 0.0,
+            "rank": rank,
+        })
+    return {"plain": plain, "derived": derived}
+
+
+def refresh_state_populations() -> Tuple[Dict[str, List[Dict[str, Any]]], Optional[float]]:
+    """(州人口, stale 秒數)：DB 失敗時是上次的結果與它的年齡，否則 None"""
+    now = time.monotonic()
+    value, stale_age = state_db.fetch("state-pop", load_state_populations)
+    if stale_age is not None:
+        # DB 失敗：回傳上次的結果，快取時間不更新，下次請求再試 (breaker 會讓它很快失敗)
+        return value, stale_age
+    _state_pop_cache.update(value, loaded_at=now)
+    return _state_pop_cache, None
+
+
+def cached_state_populations() -> Tuple[Dict[str, List[Dict[str, Any]]], Optional[float]]:
+    if _state_pop_cache["plain"] is None or time.monotonic() - _state_pop_cache["loaded_at"] > STATE_POP_CACHE_TTL:
+        return refresh_state_populations()
+    return _state_pop_cache, None
+
+
+# 啟動時先查好，之後在 TTL 到期前於背景更新 (請求不會碰到過期的快取)
+warm_cache.register("map:state-pop", refresh_state_populations, interval_s=STATE_POP_CACHE_TTL * 0.8)
 
 @app.get("/state-pop-2021")
 @limiter.limit("5/10second")
-def state_pop_2021(request: Request) -> Dict[str, Any]:
+def state_pop_2021(
+    request: Request,
+    derived: bool = Query(False, description="Include share_pct and rank"),
+) -> Dict[str, Any]:
     """
     Query auslan_population_state_years.
     根據實際資料庫結構：只有 2021State 和 population_[0] 兩個欄位
+    清理、過濾與排序在 SQL 完成；結果快取 STATE_POP_CACHE_TTL 秒
     """
     if not engine:
         # raise HTTPException(status_code=500, detail="Database connection not available")
@@ -95,69 +169,117 @@ def state_pop_2021(request: Request) -> Dict[str, Any]:
             content={"Error": "Internal server error."}
         )
 
-    # 修正SQL查詢 - 使用正確的欄位名稱
-    sql = text("""
-        SELECT
-          `2021State` AS state_name,
-          `population_[0]` AS population
-        FROM auslan_population_state_years
-        WHERE `2021State` IS NOT NULL 
-        AND `2021State` != ''
-        AND `2021State` != 'Total'
-        AND `population_[0]` IS NOT NULL
-        AND `population_[0]` > 0
-    """)
-
     try:
-        with engine.connect() as conn:
-            rows = conn.execute(sql).mappings().all()
-            print(f"Found {len(rows)} rows from database")
+        # 同時進來的相同請求共用一次查詢 (快取過期時不會一起打 MySQL)
+        cached, stale_age = coalesce(request, cached_state_populations)
     except SQLAlchemyError as e:
         print(f"Database query error: {e}")
         raise HTTPException(status_code=500, detail=f"Database query failed: {str(e)}")
+    if stale_age is not None:
+        # 共用結果的每個請求都要標記 stale (不只跑查詢的那一個)
+        mark_stale(stale_age)
 
-    # 清理和過濾州名
-    blacklist = {
-        "Total", "Other Territories", "OT", "Other Territory", 
-        "Australia", "Total Australia", "", None
-    }
-    
-    states: List[Dict[str, Any]] = []
-    
-    for r in rows:
-        state_name = (r["state_name"] or "").strip()
-        
-        # 跳過黑名單中的項目
-        if not state_name or state_name in blacklist:
-            continue
-        
-        try:
-            # 處理人口數據
-            pop_value = r["population"]
-            if pop_value is None:
-                continue
-                
-            # 轉換為整數
-            if isinstance(pop_value, str):
-                # 移除逗號和其他非數字字符
-                pop_value = pop_value.replace(',', '').replace(' ', '')
-                value = int(float(pop_value))
-            else:
-                value = int(float(pop_value))
-                
-        except (ValueError, TypeError) as e:
-            print(f"Error converting population for {state_name}: {pop_value}, error: {e}")
-            continue
-            
-        if value > 0:
-            states.append({"name": state_name, "value": value})
-            print(f"Added state: {state_name} = {value}")
+    return {"states": cached["derived"] if derived else cached["plain"]}
 
-    # 按人口數量排序（從大到小）
-    states.sort(key=lambda x: x["value"], reverse=True)
-    
-    print(f"Returning {len(states)} states")
-    return {"states": states}
+def snapshot_state_rows() -> Optional[List[Dict[str, Any]]]:
+    """summary_state_population from the catalog snapshot (None when not published)"""
+    snap = snapshot_store.table("summary_state_population", ["state_name", "population", "share_pct", "state_rank"])
+    if snap is None:
+        return None
+    return [
+        {"name": r["state_name"], "value": r["population"], "share_pct": r["share_pct"], "rank": r["state_rank"]}
+        for r in snap.rows()
+    ]
+
+def state_rows_for_map() -> Tuple[List[Dict[str, Any]], Optional[float]]:
+    """(name / value / share_pct / rank, stale 秒數)：優先讀 snapshot，否則用快取的州人口 (DB)"""
+    rows = snapshot_state_rows()
+    if rows is not None:
+        return rows, None
+    cached, stale_age = cached_state_populations()
+    return cached["derived"], stale_age
+
+def render_state_boundaries(detail: str, fmt: str) -> Tuple[Dict[str, Any], Optional[float]]:
+    rows, stale_age = state_rows_for_map()
+    return state_geo.render(detail, fmt, rows), stale_age
+
+def warm_state_boundaries() -> Tuple[bool, Optional[float]]:
+    """建好 topology 與預設的 (medium, topojson) 輸出 (州界檔有問題時在 /health 顯示錯誤)"""
+    _, stale_age = render_state_boundaries("medium", "topojson")
+    return True, stale_age
+
+# 啟動時檢查州界檔 (STATE_GEOJSON_PATH，見 state_geo.py)：沒有檔案就不預熱，/states.* 回 404
+if state_geo.available():
+    warm_cache.register("map:states.topojson", warm_state_boundaries, interval_s=STATE_POP_CACHE_TTL * 0.8)
+else:
+    print(f"State boundaries file not found: {state_geo.path} (set STATE_GEOJSON_PATH); /map/states.* will return 404")
+
+@app.get("/states.{fmt}")
+@limiter.limit("5/10second")
+def state_boundaries(
+    request: Request,
+    fmt: str = Path(..., pattern=GEO_FORMAT_PATTERN),
+    detail: str = Query("medium", pattern=GEO_DETAIL_PATTERN, description="low | medium | high"),
+):
+    """
+    州界 (簡化 + 量化) 已併入人口、占比與排名，前端不用再另外下載完整 GeoJSON 再 join
+    /map/states.topojson?detail=low   手機用
+    /map/states.geojson?detail=high
+    """
+    if not state_geo.available():
+        raise HTTPException(status_code=404, detail="State boundaries are not configured (STATE_GEOJSON_PATH)")
+    try:
+        # 同時進來的相同請求共用一次建置 (第一次要建 topology)
+        out, stale_age = coalesce(request, lambda: render_state_boundaries(detail, fmt), fmt=fmt, detail=detail)
+    except SQLAlchemyError as e:
+        print(f"Database query error: {e}")
+        raise HTTPException(status_code=500, detail="Database query failed")
+    except ValueError as e:
+        print(f"State boundaries error: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"Error": "Internal server error."}
+        )
+    if stale_age is not None:
+        mark_stale(stale_age)
+
+    headers = {"ETag": out["etag"], "Cache-Control": "public, max-age=300", "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == out["etag"]:
+        return Response(status_code=304, headers=headers)
+    media_type = "application/geo+json" if fmt == "geojson" else "application/json"
+    if accepts_gzip(request.headers.get("accept-encoding")):
+        return Response(out["gzip"], media_type=media_type, headers={**headers, "Content-Encoding": "gzip"})
+    return Response(out["body"], media_type=media_type, headers=headers)
+
+@app.get("/state-share")
+@limiter.limit("5/10second")
+def state_share(request: Request) -> Dict[str, Any]:
+    """
+    預先計算的州人口占比與排名 (summary_state_population，由 census_summary.py 產生)
+    """
+    # 有已發布的 snapshot 時直接讀 mmap，不需要 MySQL
+    rows = snapshot_state_rows()
+    if rows is not None:
+        return {"states": rows}
+
+    if not engine:
+        raise HTTPException(status_code=500, detail="Database connection not available")
+
+    sql = text("""
+        SELECT state_name AS name, population AS value, share_pct, state_rank AS `rank`
+        FROM summary_state_population
+        ORDER BY state_rank, state_name
+    """)
+    def load():
+        with engine.connect() as conn:
+            return [dict(r) for r in conn.execute(sql).mappings()]
+
+    try:
+        rows = state_db.read("state-share", load)
+    except SQLAlchemyError as e:
+        print(f"Database query error: {e}")
+        raise HTTPException(status_code=500, detail="Database query failed")
+    return {"states": rows}
 
 @app.get("/test-db")
 @limiter.limit("5/10second")
@@ -226,4 +348,33 @@ def raw_data(request: Request):
                 "count": len(rows)
             }
     except Exception as e:
-        return {"error": "Raw data query failed: "}
\ No newline at end of file
+        return {"error": "Raw data query failed: "}
+
+@app.get("/debug-table/export")
+@limiter.limit("5/10second")
+def debug_table_export(
+    request: Request,
+    fmt: str = Query("ndjson", alias="format", pattern=EXPORT_FORMAT_PATTERN),
+    columns: Optional[str] = Query(None, description="Comma separated column names"),
+    limit: Optional[int] = Query(None, ge=1),
+):
+    """串流匯出整張表 (NDJSON / CSV)，記憶體用量與表大小無關"""
+    if not engine:
+        raise HTTPException(status_code=500, detail="Database connection not available")
+    return stream_table_export(engine, "auslan_population_state_years", fmt, columns, limit)
+
+@app.get("/raw-data/export")
+@limiter.limit("5/10second")
+def raw_data_export(
+    request: Request,
+    fmt: str = Query("ndjson", alias="format", pattern=EXPORT_FORMAT_PATTERN),
+    columns: Optional[str] = Query(None, description="Comma separated column names"),
+    limit: Optional[int] = Query(None, ge=1),
+):
+    """串流匯出原始數據 (預設只有 2021State, population_[0])"""
+    if not engine:
+        raise HTTPException(status_code=500, detail="Database connection not available")
+    return stream_table_export(
+        engine, "auslan_population_state_years", fmt, columns, limit,
+        default_columns=["2021State", "population_[0]"],
+    )
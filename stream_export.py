@@ -0,0 +1,140 @@
+# stream_export.py
+import csv
+import io
+import json
+import threading
+import weakref
+from typing import Iterator, List, Optional, Sequence
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import create_engine, text
+
+from db_guard import DB_CONNECT_TIMEOUT_S
+from prefork import register_engine
+
+# ---------- Settings ----------
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+EXPORT_FORMAT_PATTERN = "^(ndjson|csv)$"
+CHUNK_ROWS = 1000  # rows fetched from the server-side cursor per chunk
+
+# Exports stream for as long as the client keeps reading, so they cannot share the
+# dashboard pools: those cap every session at DB_QUERY_TIMEOUT_MS and time out idle
+# sockets, which would cut a large download off mid-body behind a 200.
+_export_engines: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_export_engines_lock = threading.Lock()
+
+
+# ---------- Helpers ----------
+def quote_ident(name: str) -> str:
+    """Backtick-quote a MySQL identifier (handles names like `population_[0]`)."""
+    return "`" + name.replace("`", "``") + "`"
+
+
+def table_columns(engine, table: str) -> List[str]:
+    """Column names of `table`, in table order."""
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"SHOW COLUMNS FROM {quote_ident(table)}")).all()
+    return [r[0] for r in rows]
+
+
+def resolve_columns(available: Sequence[str], requested: Optional[str],
+                    default: Optional[Sequence[str]] = None) -> List[str]:
+    """
+    Turn a comma separated `columns` query value into a validated projection.
+    Only names that exist in the table are accepted, so they are safe to quote into SQL.
+    """
+    if not requested:
+        return list(default or available)
+    cols = [c.strip() for c in requested.split(",") if c.strip()]
+    unknown = [c for c in cols if c not in available]
+    if unknown or not cols:
+        raise HTTPException(status_code=400, detail=f"Unknown column(s): {', '.join(unknown)}")
+    return cols
+
+
+def export_engine(engine):
+    """Sibling of `engine` (same URL) without the dashboard query cap and socket read timeout."""
+    with _export_engines_lock:
+        sibling = _export_engines.get(engine)
+        if sibling is None:
+            connect_args = {"connect_timeout": DB_CONNECT_TIMEOUT_S} if engine.dialect.name == "mysql" else {}
+            sibling = create_engine(
+                engine.url,
+                pool_pre_ping=True,
+                pool_recycle=3600,
+                pool_size=2,
+                max_overflow=3,
+                connect_args=connect_args,
+            )
+            _export_engines[engine] = register_engine(sibling)
+        return sibling
+
+
+def _iter_partitions(engine, sql, params: dict, chunk_rows: int) -> Iterator[list]:
+    # stream_results switches PyMySQL to an unbuffered (server-side) cursor,
+    # so only one partition is held in memory at a time.
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=chunk_rows).execute(sql, params)
+        for partition in result.partitions(chunk_rows):
+            yield partition
+
+
+def _ndjson_chunks(columns: List[str], partitions: Iterator[list]) -> Iterator[bytes]:
+    for partition in partitions:
+        lines = [
+            json.dumps(dict(zip(columns, row)), default=str, ensure_ascii=False)
+            for row in partition
+        ]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def _csv_chunks(columns: List[str], partitions: Iterator[list]) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    yield buf.getvalue().encode("utf-8")
+    for partition in partitions:
+        buf.seek(0)
+        buf.truncate(0)
+        writer.writerows(partition)
+        yield buf.getvalue().encode("utf-8")
+
+
+# ---------- Public API ----------
+def stream_table_export(
+    engine,
+    table: str,
+    fmt: str = "ndjson",
+    columns: Optional[str] = None,
+    limit: Optional[int] = None,
+    default_columns: Optional[Sequence[str]] = None,
+    chunk_rows: int = CHUNK_ROWS,
+) -> StreamingResponse:
+    """
+    Stream `table` as NDJSON or CSV with constant memory.
+    `columns` is an optional comma separated projection, `limit` an optional row cap.
+    Pass the dashboard engine; rows are read through its uncapped export_engine().
+    """
+    if fmt not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {fmt}")
+
+    # resolved before streaming starts so bad input still gets a proper 400
+    projection = resolve_columns(table_columns(engine, table), columns, default_columns)
+
+    sql = f"SELECT {', '.join(quote_ident(c) for c in projection)} FROM {quote_ident(table)}"
+    params = {}
+    if limit is not None:
+        sql += " LIMIT :limit"
+        params["limit"] = int(limit)
+
+    partitions = _iter_partitions(export_engine(engine), text(sql), params, chunk_rows)
+    body = _csv_chunks(projection, partitions) if fmt == "csv" else _ndjson_chunks(projection, partitions)
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{table}.{fmt}"'},
+    )
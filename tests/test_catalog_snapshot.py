@@ -0,0 +1,119 @@
+import os
+from decimal import Decimal
+
+import pytest
+
+import catalog_snapshot
+from catalog_snapshot import SNAPSHOT_KEEP, SnapshotStore, publish_snapshot
+
+COLUMNS = ["id", "filename", "duration_s", "width", "video_codec"]
+ROWS = [
+    {"id": 3, "filename": "3_thank_you.mp4", "duration_s": 2.5, "width": 1280, "video_codec": "h264"},
+    {"id": 1, "filename": "1_góod_mörning.mp4", "duration_s": None, "width": None, "video_codec": None},
+    {"id": None, "filename": "orphan.mp4", "duration_s": 1.25, "width": 640, "video_codec": ""},
+    {"id": 3, "filename": "3_thank_you_v2.mp4", "duration_s": 4.0, "width": 1920, "video_codec": "hevc"},
+]
+
+
+@pytest.fixture
+def publish(tmp_path, monkeypatch):
+    """publish(rows) writes a snapshot of one `videos` table under tmp_path, without MySQL."""
+    root = str(tmp_path / "snap")
+
+    def run(rows=ROWS, columns=COLUMNS):
+        sources = {"videos": {"columns": columns, "rows": rows, "stats": catalog_snapshot.catalog_stats(rows)}}
+        monkeypatch.setattr(catalog_snapshot, "_read_sources", lambda engine: sources)
+        return publish_snapshot(engine=object(), root=root)
+
+    run.root = root
+    return run
+
+
+def test_round_trip_keeps_values_and_nulls(publish):
+    publish()
+    table = SnapshotStore(publish.root).table("videos")
+    assert table.n == len(ROWS)
+    assert table.kinds == {"id": "int", "filename": "str", "duration_s": "float", "width": "int", "video_codec": "str"}
+    rows = table.rows()
+    assert rows[0] == ROWS[0]
+    assert rows[1] == ROWS[1]  # NULL int / float / str, non-ASCII text
+    assert rows[2] == ROWS[2]
+    assert rows[2]["video_codec"] == ""  # empty string is not NULL
+    assert rows[3] == ROWS[3]
+
+
+def test_decimal_columns_are_read_back_as_floats(publish):
+    publish(rows=[{"id": 1, "share_pct": Decimal("31.25")}, {"id": 2, "share_pct": None}], columns=["id", "share_pct"])
+    table = SnapshotStore(publish.root).table("videos")
+    assert table.kinds["share_pct"] == "float"
+    assert table.rows() == [{"id": 1, "share_pct": 31.25}, {"id": 2, "share_pct": None}]
+
+
+def test_column_selection_and_filters(publish):
+    publish()
+    table = SnapshotStore(publish.root).table("videos")
+    assert table.rows(["id", "filename"], where={"video_codec": "hevc"}) == [{"id": 3, "filename": "3_thank_you_v2.mp4"}]
+    assert table.rows(["filename"], where={"width": None}) == [{"filename": "1_góod_mörning.mp4"}]
+    assert table.has(["id", "width"]) and not table.has(["id", "hls_key"])
+
+
+def test_find_ids_returns_first_row_in_catalog_order(publish):
+    publish()
+    table = SnapshotStore(publish.root).table("videos")
+    found = table.find_ids([3, 1, 42], ["filename"])
+    assert found == {3: {"filename": "3_thank_you.mp4"}, 1: {"filename": "1_góod_mörning.mp4"}}
+
+
+def test_store_table_requires_the_requested_columns(publish):
+    publish()
+    store = SnapshotStore(publish.root)
+    assert store.table("videos", ["id", "filename"]) is not None
+    assert store.table("videos", ["id", "poster_key"]) is None
+    assert store.table("book1") is None
+
+
+def test_stats_are_stored_in_the_manifest(publish):
+    publish()
+    table = SnapshotStore(publish.root).table("videos")
+    assert table.stats["count"] == 4
+    assert table.stats["total_duration_s"] == 7.75
+    assert table.stats["video_codecs"] == {"h264": 1, "hevc": 1}
+
+
+def test_empty_table(publish):
+    publish(rows=[])
+    table = SnapshotStore(publish.root).table("videos")
+    assert table.n == 0 and table.rows() == [] and table.find_ids([1]) == {}
+
+
+def test_new_version_is_picked_up_and_old_ones_pruned(publish, monkeypatch):
+    monkeypatch.setattr(catalog_snapshot, "SNAPSHOT_CHECK_S", 0)
+    first = publish()["version"]
+    store = SnapshotStore(publish.root)
+    assert store.current().version == first
+
+    versions = [first]
+    for i in range(SNAPSHOT_KEEP + 1):
+        versions.append(publish(rows=ROWS[:1] + [{**ROWS[1], "id": 100 + i}])["version"])
+    assert store.current().version == versions[-1]
+    assert store.table("videos").find_ids([100 + SNAPSHOT_KEEP]) != {}
+    assert store.stats["swaps"] == 2
+    on_disk = sorted(d for d in os.listdir(publish.root) if d.startswith("v"))
+    assert on_disk == sorted(versions[-SNAPSHOT_KEEP:])
+
+
+def test_missing_snapshot_means_no_table(tmp_path):
+    store = SnapshotStore(str(tmp_path / "none"))
+    assert store.current() is None and store.table("videos") is None
+
+
+def test_find_ids_without_an_integer_id_column_defers_to_mysql(publish):
+    publish(rows=[{"id": "a1", "filename": "a.mp4"}, {"id": None, "filename": "b.mp4"}], columns=["id", "filename"])
+    table = SnapshotStore(publish.root).table("videos")
+    assert table.kinds["id"] == "str"
+    assert table.find_ids([1]) is None
+
+
+def test_find_ids_on_all_null_ids_is_authoritative(publish):
+    publish(rows=[{"id": None, "filename": "orphan.mp4"}], columns=["id", "filename"])
+    assert SnapshotStore(publish.root).table("videos").find_ids([1]) == {}
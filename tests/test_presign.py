@@ -0,0 +1,72 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from botocore.credentials import Credentials, RefreshableCredentials
+
+import video_backend
+
+
+@pytest.fixture
+def signer(monkeypatch):
+    signed = []
+
+    def generate_presigned_url(_op, Params, ExpiresIn):
+        signed.append(Params["Key"])
+        return f"https://s3.test/{Params['Key']}?n={len(signed)}"
+
+    monkeypatch.setattr(video_backend.s3, "generate_presigned_url", generate_presigned_url)
+    monkeypatch.setattr(video_backend, "_presign_cache", video_backend.OrderedDict())
+    yield signed
+
+
+def use_credentials(monkeypatch, creds):
+    monkeypatch.setattr(video_backend.s3._request_signer, "_credentials", creds)
+
+
+def role_credentials(lifetime_s):
+    expiry = (datetime.now(timezone.utc) + timedelta(seconds=lifetime_s)).isoformat()
+    return RefreshableCredentials.create_from_metadata(
+        {"access_key": "AK", "secret_key": "SK", "token": "T", "expiry_time": expiry},
+        refresh_using=lambda: pytest.fail("credentials should not need a refresh"),
+        method="test",
+    )
+
+
+def test_static_keys_reuse_for_days(monkeypatch, signer):
+    use_credentials(monkeypatch, Credentials("AK", "SK"))
+    url = video_backend.presigned_url("a.mp4")
+    assert video_backend.presigned_url("a.mp4") == url and signer == ["a.mp4"]
+    reuse_until = video_backend._presign_cache["a.mp4"][1]
+    assert reuse_until - time.time() > 5 * 86400
+
+
+def test_role_credentials_cap_reuse_at_their_expiry(monkeypatch, signer):
+    use_credentials(monkeypatch, role_credentials(3600))
+    video_backend.presigned_url("a.mp4")
+    remaining = video_backend._presign_cache["a.mp4"][1] - time.time()
+    assert 1700 < remaining <= 1800  # half of the credential lifetime is left for the client
+
+
+def test_session_token_without_expiry_uses_short_ttl(monkeypatch, signer):
+    use_credentials(monkeypatch, Credentials("AK", "SK", "TOKEN"))
+    video_backend.presigned_url("a.mp4")
+    remaining = video_backend._presign_cache["a.mp4"][1] - time.time()
+    assert remaining <= video_backend.PRESIGN_TOKEN_TTL / 2
+
+
+def test_expired_entry_is_resigned(monkeypatch, signer):
+    use_credentials(monkeypatch, Credentials("AK", "SK"))
+    first = video_backend.presigned_url("a.mp4")
+    video_backend._presign_cache["a.mp4"] = (first, time.time() - 1)
+    assert video_backend.presigned_url("a.mp4") != first and signer == ["a.mp4", "a.mp4"]
+
+
+def test_cache_is_bounded_lru(monkeypatch, signer):
+    use_credentials(monkeypatch, Credentials("AK", "SK"))
+    monkeypatch.setattr(video_backend, "PRESIGN_CACHE_MAX", 2)
+    video_backend.presigned_url("a")
+    video_backend.presigned_url("b")
+    video_backend.presigned_url("a")  # a is now most recently used
+    video_backend.presigned_url("c")
+    assert list(video_backend._presign_cache) == ["a", "c"]
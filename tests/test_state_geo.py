@@ -0,0 +1,126 @@
+import gzip
+import json
+
+import numpy as np
+import pytest
+
+from state_geo import StateGeoCache, StateTopology, accepts_gzip, douglas_peucker, normalize_state
+
+
+def square(x0, y0, x1, y1, extra=()):
+    """Closed counter-clockwise ring; `extra` points are inserted on the east edge."""
+    return [[x0, y0], [x1, y0], *extra, [x1, y1], [x0, y1], [x0, y0]]
+
+
+def feature(name, *polygons, key="STE_NAME21"):
+    return {"type": "Feature", "properties": {key: name},
+            "geometry": {"type": "MultiPolygon", "coordinates": [list(p) for p in polygons]}}
+
+
+# west and east share the border x=1 (with a wiggle point on it)
+WEST = square(0, 0, 1, 1, extra=([1.0, 0.5],))
+EAST = [[1, 0], [2, 0], [2, 1], [1, 1], [1.0, 0.5], [1, 0]]
+# "Australian Capital Territory" is an enclave: its ring is the hole of "New South Wales"
+OUTER = square(10, 10, 14, 14)
+ENCLAVE = square(11, 11, 12, 12)
+
+GEOJSON = {"type": "FeatureCollection", "features": [
+    feature("West", [WEST]),
+    feature("East", [EAST]),
+    feature("New South Wales", [OUTER, ENCLAVE[::-1]]),
+    feature("Australian Capital Territory", [ENCLAVE], key="STATE_NAME"),
+]}
+
+
+def arc_refs(topo, feature_index):
+    return [a for poly in topo.geometries[feature_index] for ring in poly for a in ring]
+
+
+def test_shared_border_is_stored_once():
+    topo = StateTopology(GEOJSON)
+    assert topo.names == ["West", "East", "New South Wales", "Australian Capital Territory"]
+    west, east = arc_refs(topo, 0), arc_refs(topo, 1)
+    shared = {a if a >= 0 else ~a for a in west} & {a if a >= 0 else ~a for a in east}
+    assert len(shared) == 1
+    (arc,) = shared
+    # traversed in opposite directions by the two states
+    assert (arc in west) != (arc in east)
+    assert len(topo.arcs[arc]) == 3  # (1,0) -> (1,0.5) -> (1,1)
+
+
+def test_enclave_ring_is_shared_with_the_hole_around_it():
+    topo = StateTopology(GEOJSON)
+    nsw_hole = topo.geometries[2][0][1]
+    act_ring = topo.geometries[3][0][0]
+    assert len(nsw_hole) == len(act_ring) == 1
+    assert (nsw_hole[0] if nsw_hole[0] >= 0 else ~nsw_hole[0]) == (act_ring[0] if act_ring[0] >= 0 else ~act_ring[0])
+    assert len(topo.arcs) == 3 + 2  # west/east: outer, outer, shared; NSW outer; enclave
+
+
+def test_geojson_neighbours_still_meet_after_simplification():
+    topo = StateTopology(GEOJSON)
+    doc = topo.geojson("low", [{"name": n} for n in topo.names])
+    west = doc["features"][0]["geometry"]["coordinates"][0][0]
+    east = doc["features"][1]["geometry"]["coordinates"][0][0]
+    assert west[0] == west[-1] and east[0] == east[-1]  # closed rings
+    border = {tuple(p) for p in west if p[0] == 1.0}
+    assert border == {tuple(p) for p in east if p[0] == 1.0}
+    assert (1.0, 0.5) not in border  # collinear point dropped at low detail
+    assert {(1.0, 0.0), (1.0, 1.0)} <= border
+
+
+def test_topojson_arcs_are_delta_encoded():
+    topo = StateTopology(GEOJSON)
+    doc = topo.topojson("high", [{"name": n} for n in topo.names])
+    assert doc["type"] == "Topology"
+    assert len(doc["objects"]["states"]["geometries"]) == 4
+    for encoded, arc in zip(doc["arcs"], topo.layout("high")[0]):
+        assert np.array_equal(np.cumsum(np.array(encoded), axis=0), arc)
+
+
+def test_no_features_is_an_error():
+    with pytest.raises(ValueError):
+        StateTopology({"type": "FeatureCollection", "features": []})
+
+
+def test_douglas_peucker_keeps_end_points():
+    coords = np.array([[0, 0], [1, 0.001], [2, 0], [3, 5], [4, 0]], dtype=float)
+    keep = douglas_peucker(coords, tolerance=0.01)
+    assert keep.tolist() == [True, False, True, True, True]
+    assert douglas_peucker(coords[:2], 0.01).tolist() == [True, True]
+
+
+def test_render_joins_population_by_normalized_name(tmp_path):
+    path = tmp_path / "states.geojson"
+    path.write_text(json.dumps(GEOJSON))
+    cache = StateGeoCache(str(path))
+    assert cache.available()
+    rows = [{"name": "ACT", "value": 10, "share_pct": 1.0, "rank": 2},
+            {"name": "west", "value": 99, "share_pct": 9.9, "rank": 1}]
+    out = cache.render("medium", "geojson", rows)
+    assert gzip.decompress(out["gzip"]) == out["body"]
+    props = {f["properties"]["name"]: f["properties"] for f in json.loads(out["body"])["features"]}
+    assert props["Australian Capital Territory"]["value"] == 10
+    assert props["West"]["rank"] == 1
+    assert props["East"]["value"] is None
+
+    assert cache.render("medium", "geojson", rows) is out  # cached per population version
+    changed = cache.render("medium", "geojson", [{**rows[0], "value": 11}])
+    assert changed["etag"] != out["etag"]
+    assert not StateGeoCache(str(tmp_path / "missing.geojson")).available()
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("NSW", "new south wales"), ("  The  Northern Territory ", "northern territory"), (None, ""),
+])
+def test_normalize_state(name, expected):
+    assert normalize_state(name) == expected
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False), ("gzip", True), ("gzip, deflate, br", True), ("gzip;q=0", False),
+    ("br, gzip;q=0.5", True), ("gzip; q=0.0, *", False), ("*", True), ("*;q=0", False),
+    ("identity", False), ("deflate, *;q=0.1", True),
+])
+def test_accepts_gzip(header, expected):
+    assert accepts_gzip(header) is expected
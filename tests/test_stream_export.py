@@ -0,0 +1,86 @@
+import asyncio
+import re
+import sqlite3
+import time
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+import stream_export
+from db_guard import install_query_timeout
+
+BUDGET_MS = 50
+ROWS = 30
+
+
+class CappedConnection(sqlite3.Connection):
+    """SQLite connection that honours `SET SESSION MAX_EXECUTION_TIME` like MySQL does."""
+
+    cap_ms = 0
+
+    def cursor(self, *args, **kwargs):
+        return super().cursor(CappedCursor)
+
+
+class CappedCursor(sqlite3.Cursor):
+    def execute(self, sql, params=()):
+        m = re.match(r"SET SESSION MAX_EXECUTION_TIME = (\d+)", sql)
+        if m:
+            self.connection.cap_ms = int(m.group(1))
+            return self
+        if self.connection.cap_ms:
+            deadline = time.monotonic() + self.connection.cap_ms / 1000
+            self.connection.set_progress_handler(lambda: int(time.monotonic() > deadline), 1)
+        return super().execute(sql, params)
+
+
+@pytest.fixture
+def dashboard_engine(tmp_path, monkeypatch):
+    connect = sqlite3.dbapi2.connect
+    monkeypatch.setattr(sqlite3.dbapi2, "connect",
+                        lambda *a, **kw: connect(*a, factory=CappedConnection, **kw))
+    engine = install_query_timeout(create_engine(f"sqlite:///{tmp_path / 'export.db'}"), BUDGET_MS)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE t (id INTEGER, name TEXT)"))
+        conn.execute(text("INSERT INTO t VALUES (:id, :name)"), [{"id": i, "name": f"n{i}"} for i in range(ROWS)])
+    monkeypatch.setattr(stream_export, "table_columns", lambda _engine, _table: ["id", "name"])
+    yield engine
+    stream_export.export_engine(engine).dispose()
+    engine.dispose()
+
+
+def slow_read(chunks):
+    out = []
+    for chunk in chunks:
+        out.append(chunk)
+        time.sleep(2 * BUDGET_MS / 1000)  # a slow client keeps the cursor open past the budget
+    return b"".join(out)
+
+
+async def slow_read_async(chunks):
+    out = []
+    async for chunk in chunks:
+        out.append(chunk)
+        await asyncio.sleep(2 * BUDGET_MS / 1000)
+    return b"".join(out)
+
+
+def test_capped_engine_cuts_a_slow_stream(dashboard_engine):
+    partitions = stream_export._iter_partitions(dashboard_engine, text("SELECT id, name FROM t"), {}, 5)
+    with pytest.raises(OperationalError):
+        slow_read(partitions)
+
+
+def test_export_outlives_the_dashboard_budget(dashboard_engine):
+    response = stream_export.stream_table_export(dashboard_engine, "t", "csv", chunk_rows=5)
+    body = asyncio.run(slow_read_async(response.body_iterator)).decode()
+    lines = body.splitlines()
+    assert lines[0] == "id,name"
+    assert len(lines) == ROWS + 1 and lines[-1] == f"{ROWS - 1},n{ROWS - 1}"
+
+
+def test_export_engine_is_shared_per_dashboard_engine(dashboard_engine):
+    sibling = stream_export.export_engine(dashboard_engine)
+    assert sibling is stream_export.export_engine(dashboard_engine)
+    assert sibling is not dashboard_engine and sibling.url == dashboard_engine.url
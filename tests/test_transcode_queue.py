@@ -0,0 +1,157 @@
+import json
+import socket
+import sqlite3
+
+import pytest
+
+import transcode_queue
+from transcode_queue import MAX_ATTEMPTS, TranscodeQueue
+
+PLAN = {"mp4": "encode", "hls": True, "thumbs": True, "info": None}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    q = TranscodeQueue(str(tmp_path / "queue.sqlite3"))
+    yield q
+    q.close()
+
+
+def state_of(queue, key):
+    return queue.conn.execute("SELECT state, attempts FROM jobs WHERE key = ?", (key,)).fetchone()
+
+
+def test_claim_walks_a_job_to_done(queue):
+    assert queue.enqueue("a.mp4", "e1", PLAN)
+    job = queue.claim("host:1")
+    assert job["key"] == "a.mp4" and job["plan"] == PLAN
+    assert tuple(state_of(queue, "a.mp4")) == ("downloading", 0)
+    for state in ("encoding", "uploading"):
+        queue.set_state("a.mp4", state)
+        assert state_of(queue, "a.mp4")["state"] == state
+    queue.complete("a.mp4")
+    assert tuple(state_of(queue, "a.mp4")) == ("done", 1)
+    assert queue.claim("host:1") is None
+
+
+def test_set_state_rejects_unknown_states(queue):
+    queue.enqueue("a.mp4", "e1", PLAN)
+    with pytest.raises(ValueError):
+        queue.set_state("a.mp4", "exploded")
+
+
+def test_claim_order_priority_then_age(queue):
+    queue.enqueue("old.mp4", "e", PLAN)
+    queue.enqueue("new.mp4", "e", PLAN, priority=10)
+    queue.enqueue("older.mp4", "e", PLAN)
+    assert [queue.claim("w")["key"] for _ in range(3)] == ["new.mp4", "old.mp4", "older.mp4"]
+
+
+def test_enqueue_requeues_finished_jobs_only_when_the_source_changed(queue):
+    queue.enqueue("a.mp4", "e1", PLAN)
+    queue.claim("w")
+    queue.complete("a.mp4")
+    assert not queue.enqueue("a.mp4", "e1", PLAN)
+    assert queue.enqueue("a.mp4", "e2", PLAN)
+    assert tuple(state_of(queue, "a.mp4")) == ("pending", 0)
+    queue.claim("w")
+    queue.complete("a.mp4")
+    assert queue.enqueue("a.mp4", "e2", PLAN, force=True)
+
+
+def test_enqueue_bumps_priority_of_a_queued_job(queue):
+    queue.enqueue("a.mp4", "e1", PLAN, priority=0)
+    assert queue.enqueue("a.mp4", "e1", PLAN, priority=5)
+    assert queue.conn.execute("SELECT priority FROM jobs").fetchone()[0] == 5
+    assert queue.enqueue("a.mp4", "e1", PLAN, priority=1)
+    assert queue.conn.execute("SELECT priority FROM jobs").fetchone()[0] == 5
+
+
+def test_enqueue_on_an_active_job_waits_for_the_run_to_end(queue):
+    queue.enqueue("a.mp4", "e1", PLAN)
+    queue.claim("w")
+    new_plan = dict(PLAN, mp4="remux")
+    assert not queue.enqueue("a.mp4", "e2", new_plan)
+    row = queue.conn.execute("SELECT state, etag, plan FROM jobs").fetchone()
+    assert (row["state"], row["etag"], json.loads(row["plan"])) == ("downloading", "e1", PLAN)
+
+    queue.complete("a.mp4")  # finished the old source: not done for e2
+    job = queue.claim("w")
+    assert (job["etag"], job["plan"], job["attempts"]) == ("e2", new_plan, 0)
+    queue.complete("a.mp4")
+    row = queue.conn.execute("SELECT state, etag, pending_plan FROM jobs").fetchone()
+    assert tuple(row) == ("done", "e2", None)
+
+
+def test_enqueue_of_the_running_etag_does_not_requeue(queue):
+    queue.enqueue("a.mp4", "e1", PLAN)
+    queue.claim("w")
+    assert not queue.enqueue("a.mp4", "e1", PLAN, priority=3)
+    queue.complete("a.mp4")
+    assert tuple(queue.conn.execute("SELECT state, priority FROM jobs").fetchone()) == ("done", 3)
+
+
+def test_failed_run_of_a_superseded_source_starts_the_new_one_fresh(queue):
+    queue.enqueue("a.mp4", "e1", PLAN)
+    queue.claim("w")
+    queue.enqueue("a.mp4", "e2", PLAN)
+    assert queue.fail("a.mp4", "boom") == "pending"
+    row = queue.conn.execute("SELECT etag, attempts, next_attempt_at, last_error FROM jobs").fetchone()
+    assert tuple(row) == ("e2", 0, 0, None)
+
+
+def test_old_queue_files_get_the_new_columns(tmp_path):
+    path = str(tmp_path / "old.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.executescript(transcode_queue.SCHEMA.replace(",\n  pending_etag TEXT,\n  pending_plan TEXT", ""))
+    conn.close()
+    q = TranscodeQueue(path)
+    try:
+        columns = {r["name"] for r in q.conn.execute("PRAGMA table_info(jobs)")}
+        assert {"pending_etag", "pending_plan"} <= columns
+    finally:
+        q.close()
+
+
+def test_fail_backs_off_then_gives_up(queue):
+    queue.enqueue("a.mp4", "e1", PLAN)
+    for attempt in range(1, MAX_ATTEMPTS):
+        queue.conn.execute("UPDATE jobs SET next_attempt_at = 0")  # skip the backoff wait
+        assert queue.claim("w")["key"] == "a.mp4"
+        assert queue.fail("a.mp4", "boom") == "pending"
+        assert tuple(state_of(queue, "a.mp4")) == ("pending", attempt)
+        assert queue.claim("w") is None  # backing off
+        assert queue.next_wakeup() > 0
+    queue.conn.execute("UPDATE jobs SET next_attempt_at = 0")
+    queue.claim("w")
+    assert queue.fail("a.mp4", "boom") == "failed"
+    assert queue.next_wakeup() is None
+    assert queue.retry_failed() == 1
+    assert tuple(state_of(queue, "a.mp4")) == ("pending", 0)
+
+
+def test_resume_counts_the_interrupted_run_as_an_attempt(queue, monkeypatch):
+    host = socket.gethostname()
+    queue.enqueue("a.mp4", "e", PLAN)
+    queue.enqueue("b.mp4", "e", PLAN)
+    dead = queue.claim(f"{host}:111")["key"]
+    alive = queue.claim(f"{host}:222")["key"]
+    queue.set_state(dead, "encoding")
+    monkeypatch.setattr(transcode_queue, "_worker_alive", lambda worker: worker == f"{host}:222")
+
+    assert queue.resume() == 1
+    row = queue.conn.execute("SELECT state, attempts, last_error, worker FROM jobs WHERE key = ?", (dead,)).fetchone()
+    assert (row["state"], row["attempts"], row["worker"]) == ("pending", 1, None)
+    assert row["last_error"].startswith("Interrupted")
+    assert state_of(queue, alive)["state"] == "downloading"  # the live worker's job is left alone
+    assert queue.resume() == 0
+
+
+def test_stats_counts_states(queue):
+    queue.enqueue("a.mp4", "e", PLAN)
+    queue.enqueue("b.mp4", "e", PLAN)
+    queue.claim("w")
+    queue.complete(queue.jobs("downloading")[0]["key"])
+    stats = queue.stats()
+    assert stats["counts"]["done"] == 1 and stats["counts"]["pending"] == 1
+    assert stats["progress_pct"] == 50.0
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from video_cache import FileRangeResponse, if_range_matches, parse_range
+
+
+# ---------- parse_range ----------
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),          # suffix longer than the file: whole file
+    ("bytes=900-5000", (900, 999)),     # end clamped to the last byte
+    (" bytes=1-1 ", (1, 1)),
+    ("bytes=0-1,5-9", None),            # multi-range: full body
+    ("items=0-1", None),
+    ("bytes=-", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=1000-2000", "bytes=50-10", "bytes=-0"])
+def test_parse_range_unsatisfiable(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 1000)
+
+
+def test_if_range_needs_a_strong_match():
+    assert if_range_matches(None, '"abc"')
+    assert if_range_matches('"abc"', '"abc"')
+    assert not if_range_matches('"other"', '"abc"')
+    assert not if_range_matches('W/"abc"', 'W/"abc"')
+    assert not if_range_matches("Wed, 21 Oct 2015 07:28:00 GMT", '"abc"')
+
+
+# ---------- FileRangeResponse ----------
+def run_response(response, method="GET", extensions=None):
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": method, "extensions": extensions or {}}
+    asyncio.run(response(scope, None, send))
+    return messages
+
+
+def body_of(messages):
+    return b"".join(m.get("body", b"") for m in messages if m["type"] == "http.response.body")
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / "clip.mp4"
+    path.write_bytes(bytes(range(256)) * 2048)  # 512 KiB: more than one chunk
+    return path
+
+
+def test_full_body_in_chunks(video):
+    f = open(video, "rb")
+    sent = []
+    messages = run_response(FileRangeResponse(f, 0, video.stat().st_size - 1, 200, {}, "video/mp4", sent.append))
+    start = messages[0]
+    assert start["type"] == "http.response.start" and start["status"] == 200
+    assert (b"content-length", str(video.stat().st_size).encode()) in start["headers"]
+    assert body_of(messages) == video.read_bytes()
+    assert messages[-1]["more_body"] is False
+    assert all(m["more_body"] for m in messages[1:-1])
+    assert sent == [video.stat().st_size]
+    assert f.closed
+
+
+def test_partial_range(video):
+    messages = run_response(FileRangeResponse(open(video, "rb"), 10, 19, 206, {}, "video/mp4"))
+    assert messages[0]["status"] == 206
+    assert body_of(messages) == video.read_bytes()[10:20]
+    assert messages[-1]["more_body"] is False
+
+
+def test_empty_file_still_ends_the_body(tmp_path):
+    path = tmp_path / "empty.mp4"
+    path.write_bytes(b"")
+    messages = run_response(FileRangeResponse(open(path, "rb"), 0, -1, 200, {}, "video/mp4"))
+    assert [m["type"] for m in messages] == ["http.response.start", "http.response.body"]
+    assert messages[-1] == {"type": "http.response.body", "body": b"", "more_body": False}
+
+
+def test_head_sends_no_body(video):
+    f = open(video, "rb")
+    messages = run_response(FileRangeResponse(f, 0, 99, 206, {}, "video/mp4"), method="HEAD")
+    assert body_of(messages) == b""
+    assert messages[-1]["more_body"] is False
+    assert f.closed
+
+
+def test_zero_copy_send_when_offered(video):
+    messages = run_response(FileRangeResponse(open(video, "rb"), 100, 199, 206, {}, "video/mp4"),
+                            extensions={"http.response.zerocopysend": {}})
+    zerocopy = messages[-1]
+    assert zerocopy["type"] == "http.response.zerocopysend"
+    assert (zerocopy["offset"], zerocopy["count"], zerocopy["more_body"]) == (100, 100, False)
@@ -0,0 +1,102 @@
+from collections import namedtuple
+from datetime import datetime
+
+import pytest
+
+from video_search import SignIndex
+
+Row = namedtuple("Row", "id filename s3_key updated_at")
+
+T0 = datetime(2025, 1, 1, 12, 0, 0)
+T1 = datetime(2025, 1, 2, 12, 0, 0)
+
+
+@pytest.fixture
+def rows(monkeypatch):
+    """Catalog rows per collection, served to SignIndex in place of MySQL."""
+    data = {
+        "videos": [
+            Row(1, "Good Morning", "converted/1_good_morning.mp4", T0),
+            Row(2, "Good Night", "converted/2_good_night.mp4", T0),
+            Row(3, "Thank You", "converted/3_thank_you.mp4", T0),
+        ],
+        "book1": [
+            Row(7, "Morning Tea", "book_1/7_morning_tea.mp4", T0),
+        ],
+    }
+
+    def fetch(self, engine, collection, since):
+        # honours the incremental watermark like the real query (updated_at >= since)
+        return [r for r in data.get(collection, []) if since is None or r.updated_at >= since]
+
+    monkeypatch.setattr(SignIndex, "_fetch", fetch)
+    return data
+
+
+@pytest.fixture
+def index(rows):
+    index = SignIndex()
+    index.refresh(engine=None)
+    return index
+
+
+def test_autocomplete_matches_any_word_start(index):
+    results = index.autocomplete("morn")
+    assert sorted(r["filename"] for r in results) == ["good morning", "morning tea"]
+    assert all(r["score"] == 1.0 for r in results)
+
+
+def test_autocomplete_filters_by_collection_and_limit(index):
+    assert [r["id"] for r in index.autocomplete("morn", collection="book1")] == [7]
+    assert len(index.autocomplete("good", limit=1)) == 1
+
+
+def test_search_falls_back_to_fuzzy_matches(index):
+    results = index.search("thank yu")
+    assert results[0]["filename"] == "thank you"
+    assert 0.3 <= results[0]["score"] < 1.0
+    assert index.search("thank yu", fuzzy=False) == []
+    assert index.search("   ") == []
+
+
+def test_search_lists_prefix_hits_first_without_repeats(index):
+    results = index.search("good")
+    assert [r["filename"] for r in results[:2]] == ["good morning", "good night"]
+    assert len({(r["collection"], r["s3_key"]) for r in results}) == len(results)
+
+
+def test_incremental_refresh_replaces_changed_rows(rows, index):
+    rows["videos"][0] = Row(1, "Hello", "converted/1_good_morning.mp4", T1)
+    index.refresh(engine=None, collections=["videos"])
+    assert [r["filename"] for r in index.autocomplete("hel")] == ["hello"]
+    assert [r["filename"] for r in index.autocomplete("morn")] == ["morning tea"]
+    assert index.stats["docs"] == 4
+
+
+def test_full_refresh_drops_deleted_rows(rows, index):
+    del rows["videos"][2]
+    index.refresh(engine=None, full=True)
+    assert index.autocomplete("thank") == []
+    assert index.stats["docs"] == 3
+
+
+def test_bulk_load_sorts_once_across_collections(rows, monkeypatch):
+    import video_search
+
+    def no_insort(*_args, **_kwargs):
+        raise AssertionError("bulk load must not insort")
+
+    monkeypatch.setattr(video_search.bisect, "insort", no_insort)
+    index = SignIndex()
+    index.refresh(engine=None)
+    assert index._suffixes == sorted(index._suffixes)
+    assert [r["id"] for r in index.autocomplete("morn", collection="book1")] == [7]
+
+
+def test_bulk_load_keeps_last_duplicate_row(rows):
+    rows["videos"].append(Row(1, "Hello", "converted/1_good_morning.mp4", T1))
+    index = SignIndex()
+    index.refresh(engine=None)
+    assert [r["filename"] for r in index.autocomplete("morn")] == ["morning tea"]
+    assert all(index._docs[doc] is not None for _, doc in index._suffixes)
+    assert index.stats["docs"] == 4
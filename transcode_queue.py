@@ -0,0 +1,324 @@
+# transcode_queue.py
+# Durable local job queue for s3_batch_transcode (SQLite, one row per source key).
+#
+#   pending -> downloading -> encoding -> uploading -> done
+#                    \______________\___________\--> pending (retry with backoff) / failed
+#
+# A killed run leaves its in-flight jobs in an active state; the next run puts jobs whose
+# worker process is gone back to pending, so work resumes where it stopped. The interrupted
+# run counts as an attempt, so a clip that keeps crashing the worker ends up failed.
+# A job re-enqueued while a worker holds it keeps running with its original ETag/plan; the
+# new ones wait in pending_etag/pending_plan and the job goes back to pending when it ends.
+#
+#   python transcode_queue.py status
+#   python transcode_queue.py list --state failed
+#   python transcode_queue.py retry-failed
+import argparse
+import json
+import os
+import random
+import socket
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+# ---------- Settings ----------
+QUEUE_PATH = os.getenv("TRANSCODE_QUEUE_DB", "./transcode_queue.sqlite3")
+MAX_ATTEMPTS = int(os.getenv("TRANSCODE_MAX_ATTEMPTS", "5"))
+BACKOFF_BASE_S = float(os.getenv("TRANSCODE_BACKOFF_BASE_S", "30"))
+BACKOFF_MAX_S = float(os.getenv("TRANSCODE_BACKOFF_MAX_S", "3600"))
+
+STATES = ("pending", "downloading", "encoding", "uploading", "done", "failed")
+ACTIVE_STATES = ("downloading", "encoding", "uploading")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+  key TEXT PRIMARY KEY,
+  etag TEXT,
+  priority INTEGER NOT NULL DEFAULT 0,
+  state TEXT NOT NULL DEFAULT 'pending',
+  plan TEXT NOT NULL DEFAULT '{}',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_attempt_at REAL NOT NULL DEFAULT 0,
+  last_error TEXT,
+  worker TEXT,
+  enqueued_at REAL NOT NULL,
+  started_at REAL,
+  finished_at REAL,
+  updated_at REAL NOT NULL,
+  pending_etag TEXT,
+  pending_plan TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (state, priority DESC, enqueued_at);
+"""
+# columns added after the first release; queue files created before get them on open
+EXTRA_COLUMNS = {"pending_etag": "TEXT", "pending_plan": "TEXT"}
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _worker_alive(worker: Optional[str]) -> bool:
+    """Only processes on this host can be checked; remote workers are assumed alive."""
+    if not worker:
+        return False
+    host, _, pid = worker.rpartition(":")
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Exponential backoff with +-20% jitter: 30s, 60s, 120s, ... capped at BACKOFF_MAX_S."""
+    delay = min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class TranscodeQueue:
+    def __init__(self, path: str = QUEUE_PATH):
+        self.path = path
+        # autocommit; multi-statement changes take an explicit BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        existing = {r["name"] for r in self.conn.execute("PRAGMA table_info(jobs)")}
+        for column, ddl in EXTRA_COLUMNS.items():
+            if column not in existing:
+                self.conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {ddl}")
+
+    def close(self) -> None:
+        self.conn.close()
+
+    # ----- producers -----
+    def enqueue(self, key: str, etag: Optional[str], plan: Dict, priority: int = 0, force: bool = False) -> bool:
+        """
+        Add or refresh a job. A finished job is only re-queued when the source ETag changed
+        (or `force`); queued jobs keep their place but can be bumped to a higher priority.
+        A changed job that is being worked on is re-queued once the current run ends.
+        Returns True when the job is (now) pending.
+        """
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute("SELECT state, etag, plan FROM jobs WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.conn.execute(
+                    "INSERT INTO jobs (key, etag, priority, plan, enqueued_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, etag, priority, json.dumps(plan), now, now),
+                )
+                queued = True
+            elif row["state"] in ("done", "failed") and row["etag"] == etag and not force:
+                queued = False
+            elif row["state"] in ("done", "failed"):
+                self.conn.execute(
+                    """UPDATE jobs SET etag = ?, priority = ?, plan = ?, state = 'pending', attempts = 0,
+                       next_attempt_at = 0, last_error = NULL, pending_etag = NULL, pending_plan = NULL,
+                       enqueued_at = ?, updated_at = ? WHERE key = ?""",
+                    (etag, priority, json.dumps(plan), now, now, key),
+                )
+                queued = True
+            elif row["state"] == "pending":
+                self.conn.execute(
+                    "UPDATE jobs SET etag = ?, priority = MAX(priority, ?), plan = ?, updated_at = ? WHERE key = ?",
+                    (etag, priority, json.dumps(plan), now, key),
+                )
+                queued = True
+            elif row["etag"] == etag and row["plan"] == json.dumps(plan) and not force:
+                # the running job already produces exactly this; nothing to redo
+                self.conn.execute(
+                    "UPDATE jobs SET priority = MAX(priority, ?), updated_at = ? WHERE key = ?",
+                    (priority, now, key),
+                )
+                queued = False
+            else:
+                # active: the worker keeps its ETag/plan, the change runs after it finishes
+                self.conn.execute(
+                    """UPDATE jobs SET pending_etag = ?, pending_plan = ?, priority = MAX(priority, ?),
+                       updated_at = ? WHERE key = ?""",
+                    (etag, json.dumps(plan), priority, now, key),
+                )
+                queued = False
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return queued
+
+    # ----- workers -----
+    def resume(self) -> int:
+        """
+        Put jobs left active by a dead worker back to pending (with backoff), counting the
+        interrupted run as a failed attempt. Returns how many.
+        """
+        rows = self.conn.execute(
+            f"SELECT key, state, worker FROM jobs WHERE state IN ({','.join('?' * len(ACTIVE_STATES))})",
+            ACTIVE_STATES,
+        ).fetchall()
+        stale = [r for r in rows if not _worker_alive(r["worker"])]
+        for r in stale:
+            self.fail(r["key"], f"Interrupted: worker {r['worker']} exited while {r['state']}")
+        return len(stale)
+
+    def claim(self, worker: Optional[str] = None) -> Optional[Dict]:
+        """Highest priority runnable job (oldest first), moved to 'downloading'; None when idle."""
+        worker = worker or worker_id()
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                """SELECT * FROM jobs WHERE state = 'pending' AND next_attempt_at <= ?
+                   ORDER BY priority DESC, enqueued_at LIMIT 1""",
+                (now,),
+            ).fetchone()
+            if row is not None:
+                self.conn.execute(
+                    """UPDATE jobs SET state = 'downloading', worker = ?, started_at = ?, updated_at = ?
+                       WHERE key = ?""",
+                    (worker, now, now, row["key"]),
+                )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        job = dict(row)
+        job["plan"] = json.loads(job["plan"])
+        return job
+
+    def next_wakeup(self) -> Optional[float]:
+        """Seconds until the earliest backed-off job becomes runnable (None if nothing is pending)."""
+        row = self.conn.execute("SELECT MIN(next_attempt_at) FROM jobs WHERE state = 'pending'").fetchone()
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    def set_state(self, key: str, state: str) -> None:
+        if state not in STATES:
+            raise ValueError(f"Unknown state {state!r}")
+        self.conn.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE key = ?", (state, time.time(), key))
+
+    def _requeue_pending(self, key: str, now: float) -> bool:
+        """Start over with the ETag/plan enqueued while the job ran. False when there is none."""
+        cur = self.conn.execute(
+            """UPDATE jobs SET state = 'pending', etag = pending_etag, plan = pending_plan,
+               pending_etag = NULL, pending_plan = NULL, attempts = 0, next_attempt_at = 0,
+               last_error = NULL, worker = NULL, finished_at = ?, updated_at = ?
+               WHERE key = ? AND pending_plan IS NOT NULL""",
+            (now, now, key),
+        )
+        return cur.rowcount > 0
+
+    def complete(self, key: str) -> None:
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not self._requeue_pending(key, now):
+                self.conn.execute(
+                    """UPDATE jobs SET state = 'done', attempts = attempts + 1, last_error = NULL, worker = NULL,
+                       finished_at = ?, updated_at = ? WHERE key = ?""",
+                    (now, now, key),
+                )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def fail(self, key: str, error: str) -> str:
+        """Record a failed attempt; retried with backoff until MAX_ATTEMPTS. Returns the new state."""
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self._requeue_pending(key, now):
+                # the failure belongs to the superseded source; the new one starts fresh
+                state = "pending"
+            else:
+                row = self.conn.execute("SELECT attempts FROM jobs WHERE key = ?", (key,)).fetchone()
+                attempts = (row["attempts"] if row else 0) + 1
+                state = "failed" if attempts >= MAX_ATTEMPTS else "pending"
+                self.conn.execute(
+                    """UPDATE jobs SET state = ?, attempts = ?, last_error = ?, worker = NULL,
+                       next_attempt_at = ?, finished_at = ?, updated_at = ? WHERE key = ?""",
+                    (state, attempts, error[:2000], now + backoff_seconds(attempts),
+                     now if state == "failed" else None, now, key),
+                )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return state
+
+    def retry_failed(self) -> int:
+        cur = self.conn.execute(
+            """UPDATE jobs SET state = 'pending', attempts = 0, next_attempt_at = 0, updated_at = ?
+               WHERE state = 'failed'""",
+            (time.time(),),
+        )
+        return cur.rowcount
+
+    # ----- inspection -----
+    def stats(self, window_s: int = 3600) -> Dict:
+        counts = {s: 0 for s in STATES}
+        for row in self.conn.execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state"):
+            counts[row["state"]] = row["n"]
+        since = time.time() - window_s
+        recent = self.conn.execute(
+            """SELECT COUNT(*) AS n, AVG(finished_at - started_at) AS avg_s
+               FROM jobs WHERE state = 'done' AND finished_at >= ?""",
+            (since,),
+        ).fetchone()
+        total = sum(counts.values())
+        return {
+            "counts": counts,
+            "total": total,
+            "progress_pct": round(counts["done"] * 100.0 / total, 1) if total else None,
+            f"done_last_{window_s}s": recent["n"],
+            "throughput_per_min": round(recent["n"] * 60.0 / window_s, 2),
+            "avg_job_s": round(recent["avg_s"], 1) if recent["avg_s"] is not None else None,
+        }
+
+    def jobs(self, state: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        sql = "SELECT key, state, priority, attempts, last_error, updated_at FROM jobs"
+        params: tuple = ()
+        if state:
+            sql += " WHERE state = ?"
+            params = (state,)
+        sql += " ORDER BY updated_at DESC LIMIT ?"
+        return [dict(r) for r in self.conn.execute(sql, params + (limit,))]
+
+
+# ---------- CLI ----------
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect the transcode job queue.")
+    parser.add_argument("--db", default=QUEUE_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    status = sub.add_parser("status", help="Counts per state, progress and throughput")
+    status.add_argument("--window", type=int, default=3600, help="Throughput window in seconds")
+    listing = sub.add_parser("list", help="Most recently updated jobs")
+    listing.add_argument("--state", choices=STATES)
+    listing.add_argument("--limit", type=int, default=50)
+    sub.add_parser("retry-failed", help="Move failed jobs back to pending")
+    args = parser.parse_args()
+
+    queue = TranscodeQueue(args.db)
+    try:
+        if args.command == "status":
+            print(json.dumps(queue.stats(args.window), indent=2))
+        elif args.command == "list":
+            for job in queue.jobs(args.state, args.limit):
+                err = f"  {job['last_error'].splitlines()[0][:100]}" if job["last_error"] else ""
+                print(f"{job['state']:<12} p={job['priority']:<3} tries={job['attempts']:<2} {job['key']}{err}")
+        elif args.command == "retry-failed":
+            print(f"Re-queued {queue.retry_failed()} failed job(s)")
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,24 @@
-from fastapi import APIRouter
-from sqlalchemy import create_engine, text
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
+from sqlalchemy import bindparam, create_engine, text
+import functools
 import os
+import posixpath
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote
 import boto3
 from botocore.client import Config
+from botocore.exceptions import ClientError
+
+from catalog_snapshot import catalog_stats, snapshot_store
+from db_guard import DB_POOL_TIMEOUT_S, GuardedReader, install_query_timeout, timeout_connect_args
+from prefork import after_fork, register_engine
+from s3_toSQL import COLLECTION_KEY_PREFIX, COLLECTIONS, HLS_PREFIX, SPRITE_COLUMNS, SPRITE_INTERVAL_S
+from wire_format import WIRE_FORMAT_PATTERN, render_rows
+from video_cache import CACHE_MAX_OBJECT_BYTES, DiskLRUCache, FileRangeResponse, if_range_matches, parse_range
+from warm_cache import warm_cache
 
 router = APIRouter(prefix="/videos", tags=["videos"])
 
@@ -14,7 +30,11 @@ DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
 
 DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-engine = create_engine(DATABASE_URL)
+engine = register_engine(install_query_timeout(create_engine(
+    DATABASE_URL, pool_pre_ping=True, pool_timeout=DB_POOL_TIMEOUT_S, connect_args=timeout_connect_args(),
+)))
+# circuit breaker + last good listing per collection
+catalog_db = GuardedReader(engine, "videos")
 
 # ---------- AWS S3 Settings ----------
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
@@ -22,25 +42,428 @@ S3_BUCKET = os.getenv("S3_BUCKET", "demo2109bhargav")
 
 s3 = boto3.client("s3", region_name=AWS_REGION, config=Config(signature_version="s3v4"))
 
+
+@after_fork
+def _new_s3_client() -> None:
+    # boto3 clients hold urllib3 connection pools: never share them across processes
+    global s3
+    s3 = boto3.client("s3", region_name=AWS_REGION, config=Config(signature_version="s3v4"))
+
+# ---------- Pre-signed URL cache ----------
+PRESIGN_EXPIRES = 604800         # 7 days (SigV4 maximum)
+PRESIGN_MIN_REMAINING = 86400    # re-sign once less than a day is left
+PRESIGN_TOKEN_TTL = 900          # reuse limit for session-token credentials without a known expiry
+PRESIGN_CACHE_MAX = int(os.getenv("PRESIGN_CACHE_MAX", "20000"))
+MAX_BATCH_IDS = 200
+
+# key -> (url, reuse_until), least recently used first
+_presign_cache: "OrderedDict[str, tuple[str, float]]" = OrderedDict()
+_presign_lock = threading.Lock()
+
+
+def _credential_expiry(now: float) -> float | None:
+    """Epoch second at which URLs signed now stop working because the signing credentials expire."""
+    creds = getattr(s3._request_signer, "_credentials", None)
+    if creds is None:
+        return None
+    frozen = creds.get_frozen_credentials()  # refreshes role / STS credentials close to expiry
+    expiry = getattr(creds, "_expiry_time", None)
+    if expiry is not None:
+        return expiry.timestamp()
+    return now + PRESIGN_TOKEN_TTL if frozen.token else None
+
+
+def presigned_url(key: str) -> str:
+    """Pre-signed GET URL for `key`, reused until it gets close to its (or its credentials') expiry."""
+    now = time.time()
+    with _presign_lock:
+        hit = _presign_cache.get(key)
+        if hit and hit[1] > now:
+            _presign_cache.move_to_end(key)
+            return hit[0]
+    url = s3.generate_presigned_url(
+        "get_object",
+        Params={"Bucket": S3_BUCKET, "Key": key},
+        ExpiresIn=PRESIGN_EXPIRES,
+    )
+    expires_at = now + PRESIGN_EXPIRES
+    cred_expiry = _credential_expiry(now)
+    if cred_expiry is not None:
+        expires_at = min(expires_at, cred_expiry)
+    # keep at least half of a short lifetime for the client that receives the URL
+    reuse_until = expires_at - min(PRESIGN_MIN_REMAINING, (expires_at - now) / 2)
+    with _presign_lock:
+        _presign_cache[key] = (url, reuse_until)
+        _presign_cache.move_to_end(key)
+        while len(_presign_cache) > PRESIGN_CACHE_MAX:
+            _presign_cache.popitem(last=False)
+    return url
+
+
+# ---------- Optional catalog columns ----------
+# Columns added by later ingest versions are only selected once the table has them,
+# so the API keeps working against tables that have not been re-ingested yet.
+OPTIONAL_COLUMNS = ["hls_key", "poster_key", "sprite_key", "duration_s", "width", "height", "video_codec", "audio_codec", "bitrate"]
+COLUMNS_TTL = 300
+_table_columns: dict[str, tuple[float, set]] = {}
+
+
+def table_columns(table: str) -> set:
+    hit = _table_columns.get(table)
+    if hit and time.monotonic() - hit[0] < COLUMNS_TTL:
+        return hit[1]
+    with engine.connect() as conn:
+        cols = {r[0] for r in conn.execute(text("""
+            SELECT COLUMN_NAME FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :t
+        """), {"t": table})}
+    _table_columns[table] = (time.monotonic(), cols)
+    return cols
+
+
+def listing_columns(table: str, base: str = "id, filename, s3_key") -> str:
+    present = table_columns(table)
+    return ", ".join([base] + [c for c in OPTIONAL_COLUMNS if c in present])
+
+
+def hls_url(hls_key: str | None) -> str | None:
+    """API path of the clip's master playlist (served by hls_playlist below)."""
+    if not hls_key or not hls_key.startswith(HLS_PREFIX):
+        return None
+    return "/videos/hls/" + quote(hls_key[len(HLS_PREFIX):])
+
+
+def with_urls(video: dict) -> dict:
+    video["url"] = presigned_url(video["s3_key"])
+    if "hls_key" in video:
+        video["hls_url"] = hls_url(video.pop("hls_key"))
+    # poster (a few KB) lets pages render sign grids without loading any <video>
+    if "poster_key" in video:
+        poster = video.pop("poster_key")
+        video["poster_url"] = presigned_url(poster) if poster else None
+    if "sprite_key" in video:
+        sprite = video.pop("sprite_key")
+        video["sprite"] = {
+            "url": presigned_url(sprite),
+            "columns": SPRITE_COLUMNS,
+            "interval_s": SPRITE_INTERVAL_S,
+        } if sprite else None
+    return video
+
+
+def collection_query(collection: str, where: str, columns: str = "id, filename, s3_key") -> str:
+    """SELECT for one catalog collection, restricted to the rows that collection exposes."""
+    if collection not in COLLECTIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown collection: {collection}")
+    sql = f"SELECT {columns} FROM {COLLECTIONS[collection]} WHERE {where}"
+    if collection in COLLECTION_KEY_PREFIX:
+        sql += f" AND s3_key LIKE '{COLLECTION_KEY_PREFIX[collection]}%'"
+    return sql + " ORDER BY id, s3_key"
+
+
+def parse_ids(ids: str) -> list[int]:
+    try:
+        parsed = list(dict.fromkeys(int(i) for i in ids.split(",") if i.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma separated list of integers")
+    if not parsed:
+        raise HTTPException(status_code=400, detail="ids is required")
+    if len(parsed) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_IDS} ids per request")
+    return parsed
+
+
+def snapshot_columns(table) -> list[str]:
+    """Listing columns of a snapshot table (same set listing_columns() selects from MySQL)."""
+    return ["id", "filename", "s3_key"] + [c for c in OPTIONAL_COLUMNS if c in table.kinds]
+
+
+def fetch_videos_by_ids(collection: str, ids: list[int], columns: str | None = None) -> dict[int, dict]:
+    """
+    Binary search in the memory-mapped catalog snapshot when one is published (and its id
+    column is indexed), otherwise one indexed (idx_id) query for many ids; first row per id wins.
+    """
+    if collection not in COLLECTIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown collection: {collection}")
+    wanted = [c.strip() for c in columns.split(",")] if columns else ["id", "filename", "s3_key"]
+    table = snapshot_store.table(collection, wanted)
+    if table is not None:
+        found = table.find_ids(ids, wanted if columns else snapshot_columns(table))
+        if found is not None:
+            return found
+    columns = columns or listing_columns(COLLECTIONS[collection])
+    sql = text(collection_query(collection, "id IN :ids", columns)).bindparams(bindparam("ids", expanding=True))
+    found: dict[int, dict] = {}
+    with engine.connect() as conn:
+        for row in conn.execute(sql, {"ids": ids}):
+            found.setdefault(row.id, dict(row._mapping))
+    return found
+
+
+# columns that share long prefixes (bucket host, converted/ paths) - front-coded in compact formats
+PREFIX_COLUMNS = ("s3_key", "url", "hls_url", "poster_url")
+
+
+def load_collection_rows(collection: str) -> tuple[list[dict], float | None]:
+    """
+    (listing rows without URLs, stale age in seconds or None): the mmapped snapshot when
+    published, else MySQL behind the breaker.
+    """
+    table = snapshot_store.table(collection)
+    if table is not None:
+        return table.rows(snapshot_columns(table)), None
+
+    def load() -> list[dict]:
+        sql = collection_query(collection, "1=1", listing_columns(COLLECTIONS[collection]))
+        with engine.connect() as conn:
+            return [dict(row._mapping) for row in conn.execute(text(sql))]
+
+    # rows come from the guarded cache on DB errors
+    return catalog_db.fetch(("listing", collection), load)
+
+
+def warm_collection(collection: str) -> tuple[list[dict], float | None]:
+    rows, stale_age = load_collection_rows(collection)
+    for row in rows:
+        with_urls(dict(row))  # pre-sign now, so the first listing request only hits the URL cache
+    return rows, stale_age
+
+
+# precomputed at startup, refreshed in the background and when a new snapshot is published
+for _collection in COLLECTIONS:
+    warm_cache.register(f"catalog:{_collection}", functools.partial(warm_collection, _collection))
+
+
+def list_collection(collection: str) -> list[dict]:
+    """Every clip of a collection with its media metadata and (cached) pre-signed URLs."""
+    if collection not in COLLECTIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown collection: {collection}")
+    # warm rows are shared: copy before adding the per-response URLs
+    return [with_urls(dict(row)) for row in warm_cache.get_or_compute(f"catalog:{collection}")]
+
+
 # ---------- API: Get all videos with pre-signed URL ----------
 @router.get("/")
-def get_videos():
-    with engine.connect() as conn:
-        result = conn.execute(text(
-            "SELECT id, filename, s3_key FROM videos WHERE s3_key LIKE 'converted/%' "
-        ))
-        videos = []
-        for row in result:
-            video = dict(row._mapping)
-            print("DEBUG s3_key:", video["s3_key"])
-
-
-            #  pre-signed URL
-            url = s3.generate_presigned_url(
-                "get_object",
-                Params={"Bucket": S3_BUCKET, "Key": video["s3_key"]},
-                ExpiresIn=604800  # API URL valid for 1 year
-            )
-            video["url"] = url
-            videos.append(video)
-    return videos
\ No newline at end of file
+def get_videos(
+    request: Request,
+    fmt: str | None = Query(None, alias="format", pattern=WIRE_FORMAT_PATTERN),
+):
+    """
+    All converted videos. JSON by default; `?format=columnar|msgpack` (or the matching
+    Accept header) returns parallel arrays with front-coded URL/key columns.
+    """
+    #  pre-signed URL (cached, API URL valid for 7 days) + HLS playlist when available
+    return render_rows(request, list_collection("videos"), fmt=fmt, prefix_columns=PREFIX_COLUMNS)
+
+
+# ---------- Streaming proxy (optional, VIDEO_PROXY_ENABLED=1) ----------
+VIDEO_PROXY_ENABLED = os.getenv("VIDEO_PROXY_ENABLED", "0") == "1"
+video_cache = DiskLRUCache() if VIDEO_PROXY_ENABLED else None
+
+
+def _s3_error_response(e: ClientError, headers: dict, size: int | None) -> Response:
+    """Unsatisfiable range -> 416, missing object -> 404 (as on the cached path); anything else re-raises."""
+    code = e.response.get("Error", {}).get("Code")
+    if code == "InvalidRange":
+        extra = {"Content-Range": f"bytes */{size}"} if size is not None else {}
+        return Response(status_code=416, headers={**headers, **extra})
+    if code in ("NoSuchKey", "404"):
+        raise HTTPException(status_code=404, detail="Video not found in storage")
+    raise e
+
+
+def _stream_from_s3(key: str, range_header: str | None, headers: dict, size: int | None = None) -> Response:
+    """Pass-through for objects too large to cache; S3 handles the Range itself."""
+    kwargs = {"Bucket": S3_BUCKET, "Key": key}
+    if range_header:
+        kwargs["Range"] = range_header
+    try:
+        obj = s3.get_object(**kwargs)
+    except ClientError as e:
+        return _s3_error_response(e, headers, size)
+    headers = dict(headers, **{"Content-Length": str(obj["ContentLength"])})
+    if "ContentRange" in obj:
+        headers["Content-Range"] = obj["ContentRange"]
+    video_cache.stats["bypass"] += 1
+    return StreamingResponse(
+        obj["Body"].iter_chunks(256 * 1024),
+        status_code=206 if "ContentRange" in obj else 200,
+        media_type="video/mp4",
+        headers=headers,
+    )
+
+
+@router.get("/cache/stats")
+def stream_cache_stats():
+    if video_cache is None:
+        raise HTTPException(status_code=404, detail="Streaming proxy is disabled")
+    return video_cache.snapshot()
+
+
+@router.get("/catalog/stats")
+def get_catalog_stats(collection: str = Query("videos", description="One of: " + ", ".join(COLLECTIONS))):
+    """Clip count, total / average duration, bytes and codec mix (precomputed in the snapshot)."""
+    if collection not in COLLECTIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown collection: {collection}")
+    snap = snapshot_store.current()
+    table = snap.table(collection) if snap else None
+    if table is not None and table.stats is not None:
+        return {"collection": collection, "version": snap.version, **table.stats}
+
+    def load() -> list[dict]:
+        columns = listing_columns(COLLECTIONS[collection], "id, filename, s3_key, size_bytes")
+        with engine.connect() as conn:
+            return [dict(row._mapping) for row in conn.execute(text(collection_query(collection, "1=1", columns)))]
+
+    return {"collection": collection, "version": None, **catalog_stats(catalog_db.read(("stats", collection), load))}
+
+
+# ---------- HLS playlists ----------
+PLAYLIST_TTL = 300
+_playlist_cache: dict[str, tuple[float, str]] = {}
+
+
+def read_playlist(key: str) -> str:
+    hit = _playlist_cache.get(key)
+    if hit and time.monotonic() - hit[0] < PLAYLIST_TTL:
+        return hit[1]
+    body = s3.get_object(Bucket=S3_BUCKET, Key=key)["Body"].read().decode("utf-8")
+    _playlist_cache[key] = (time.monotonic(), body)
+    return body
+
+
+def sign_playlist(key: str, body: str) -> str:
+    """
+    Point media segments at pre-signed S3 URLs. Nested playlists stay relative,
+    so players come back through this endpoint for them.
+    """
+    base = posixpath.dirname(key)
+    lines = []
+    for line in body.splitlines():
+        uri = line.strip()
+        if uri and not uri.startswith("#") and not uri.endswith(".m3u8"):
+            line = presigned_url(posixpath.normpath(posixpath.join(base, uri)))
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+@router.get("/hls/{path:path}")
+def hls_playlist(path: str):
+    """
+    Adaptive stream for a clip, e.g. GET /videos/hls/12%20hello/master.m3u8
+    Playlists come from converted/hls/ in S3 with their segments pre-signed.
+    """
+    if not path.endswith(".m3u8") or ".." in path.split("/"):
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    key = HLS_PREFIX + path
+    try:
+        body = read_playlist(key)
+    except ClientError:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    return Response(
+        sign_playlist(key, body),
+        media_type="application/vnd.apple.mpegurl",
+        headers={"Cache-Control": "private, max-age=300"},
+    )
+
+
+# ---------- API: Lookup by id ----------
+@router.get(":batch")
+def get_videos_batch(
+    ids: str = Query(..., description="Comma separated video ids, e.g. 12,15,40"),
+    collection: str = Query("videos", description="One of: " + ", ".join(COLLECTIONS)),
+):
+    """
+    Fetch many videos in one query. Results keep the requested order; unknown ids are listed in `missing`.
+    Example:
+        GET /videos:batch?ids=12,15,40&collection=book1
+    """
+    wanted = parse_ids(ids)
+    found = fetch_videos_by_ids(collection, wanted)
+    videos = []
+    for vid in wanted:
+        if vid in found:
+            videos.append(with_urls(found[vid]))
+    return {"videos": videos, "missing": [vid for vid in wanted if vid not in found]}
+
+
+@router.get("/{video_id}")
+def get_video(video_id: int, collection: str = Query("videos")):
+    video = fetch_videos_by_ids(collection, [video_id]).get(video_id)
+    if video is None:
+        raise HTTPException(status_code=404, detail="Video not found")
+    return with_urls(video)
+
+
+@router.get("/{video_id}/play")
+def play_video(video_id: int, collection: str = Query("videos")):
+    """302 to a (reused) pre-signed S3 URL, so a <video src> can point straight at the API."""
+    video = fetch_videos_by_ids(collection, [video_id], "id, s3_key").get(video_id)
+    if video is None:
+        raise HTTPException(status_code=404, detail="Video not found")
+    return RedirectResponse(
+        presigned_url(video["s3_key"]),
+        status_code=302,
+        headers={"Cache-Control": "private, max-age=300"},
+    )
+
+
+
+@router.api_route("/{video_id}/stream", methods=["GET", "HEAD"])
+def stream_video(video_id: int, request: Request, collection: str = Query("videos")):
+    """
+    Proxy the clip through a local disk LRU cache with HTTP Range / If-Range support,
+    for clients that cannot reach S3 directly.
+    """
+    if video_cache is None:
+        raise HTTPException(status_code=404, detail="Streaming proxy is disabled")
+    video = fetch_videos_by_ids(collection, [video_id], "id, s3_key, etag, size_bytes").get(video_id)
+    if video is None:
+        raise HTTPException(status_code=404, detail="Video not found")
+
+    key, version = video["s3_key"], video["etag"] or ""
+    etag = f'"{version}"' if version else None
+    headers = {"Accept-Ranges": "bytes", "Cache-Control": "private, max-age=3600"}
+    if etag:
+        headers["ETag"] = etag
+
+    range_header = request.headers.get("range")
+    if range_header and etag and not if_range_matches(request.headers.get("if-range"), etag):
+        range_header = None  # representation changed: send the whole file
+
+    size = video["size_bytes"]
+    if size is None or size > CACHE_MAX_OBJECT_BYTES:
+        return _stream_from_s3(key, range_header, headers, size)
+
+    def fill(tmp: str) -> None:
+        s3.download_file(S3_BUCKET, key, tmp)
+
+    try:
+        try:
+            f = open(video_cache.get_or_fill(key, version, fill), "rb")
+        except FileNotFoundError:
+            # evicted by another worker between fill and open; fetch once more
+            f = open(video_cache.get_or_fill(key, version, fill), "rb")
+    except ClientError as e:
+        return _s3_error_response(e, headers, size)
+    size = os.fstat(f.fileno()).st_size
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        f.close()
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    start, end = byte_range or (0, size - 1)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    def count_sent(n: int) -> None:
+        video_cache.stats["bytes_served"] += n
+
+    return FileRangeResponse(
+        f, start, end,
+        status_code=206 if byte_range else 200,
+        headers=headers,
+        media_type="video/mp4",
+        on_sent=count_sent,
+    )
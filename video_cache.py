@@ -0,0 +1,192 @@
+# video_cache.py
+# Size-bounded local disk LRU cache for S3 video objects, plus a Range-aware file response.
+# LRU order lives on disk (file mtime is bumped on every hit), so several workers can
+# share one cache directory without coordinating.
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+import anyio
+from starlette.responses import Response
+
+# ---------- Settings ----------
+CACHE_DIR = os.getenv("VIDEO_CACHE_DIR", "./video_cache")
+CACHE_MAX_BYTES = int(os.getenv("VIDEO_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+CACHE_MAX_OBJECT_BYTES = int(os.getenv("VIDEO_CACHE_MAX_OBJECT_BYTES", str(200 * 1024 ** 2)))
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class DiskLRUCache:
+    def __init__(self, root: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self._fill_locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "bypass": 0, "evictions": 0,
+                      "bytes_served": 0, "bytes_fetched": 0}
+
+    def path_for(self, key: str, version: str = "") -> str:
+        digest = hashlib.sha1(f"{key}\0{version}".encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest)
+
+    def get(self, key: str, version: str = "") -> Optional[str]:
+        """Path of the cached object (marked most recently used), or None."""
+        path = self.path_for(key, version)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get_or_fill(self, key: str, version: str, fill: Callable[[str], None]) -> str:
+        """
+        Cached path for (key, version); on a miss `fill(tmp_path)` downloads the object.
+        Concurrent misses for the same key in this worker share one download.
+        """
+        path = self.get(key, version)
+        if path:
+            self.stats["hits"] += 1
+            return path
+
+        with self._locks_guard:
+            lock = self._fill_locks.setdefault(self.path_for(key, version), threading.Lock())
+        with lock:
+            path = self.get(key, version)
+            if path:
+                self.stats["hits"] += 1
+                return path
+            self.stats["misses"] += 1
+            path = self.path_for(key, version)
+            fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".fill-")
+            os.close(fd)
+            try:
+                fill(tmp)
+                self.stats["bytes_fetched"] += os.path.getsize(tmp)
+                os.replace(tmp, path)  # atomic: readers never see a partial file
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+            finally:
+                with self._locks_guard:
+                    self._fill_locks.pop(path, None)
+        self.evict()
+        return path
+
+    def evict(self) -> None:
+        """Delete least recently used files until the directory fits in max_bytes."""
+        entries = []
+        total = 0
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.startswith(".fill-"):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.stats["evictions"] += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def snapshot(self) -> Dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else None,
+            "max_bytes": self.max_bytes,
+        }
+
+
+# ---------- Range handling ----------
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    (start, end) inclusive for a single `bytes=` range, None to serve the whole file.
+    Raises ValueError when the range cannot be satisfied. Multi-range requests get the full body.
+    """
+    if not header:
+        return None
+    m = RANGE_RE.match(header.strip())
+    if not m:
+        return None
+    first, last = m.groups()
+    if first == "" and last == "":
+        return None
+    if first == "":
+        length = int(last)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+def if_range_matches(if_range: Optional[str], etag: str) -> bool:
+    """If-Range only honours a strong ETag match; dates or mismatches mean 'send everything'."""
+    if if_range is None:
+        return True
+    return if_range.strip() == etag and not if_range.startswith("W/")
+
+
+class FileRangeResponse(Response):
+    """
+    Serve bytes [start, end] of an open local file (closed when done). Holding the file
+    open means a concurrent eviction cannot pull it out from under the response.
+    Uses the ASGI zero-copy send extension (sendfile) when the server offers it,
+    otherwise streams fixed-size chunks off a thread.
+    """
+    chunk_size = 256 * 1024
+
+    def __init__(self, file, start: int, end: int, status_code: int,
+                 headers: Dict[str, str], media_type: str, on_sent: Optional[Callable[[int], None]] = None):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.file = file
+        self.start = start
+        self.length = end - start + 1
+        self.headers["content-length"] = str(self.length)
+        self.on_sent = on_sent
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if scope.get("method") == "HEAD":
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": self.file.fileno(),
+                    "offset": self.start,
+                    "count": self.length,
+                    "more_body": False,
+                })
+            else:
+                f = anyio.wrap_file(self.file)
+                await f.seek(self.start)
+                remaining = self.length
+                while remaining > 0:
+                    chunk = await f.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                # always end the body, also for an empty file or one truncated under us
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            if self.on_sent:
+                self.on_sent(self.length)
+        finally:
+            self.file.close()
@@ -0,0 +1,309 @@
+# video_search.py
+# In-process search over sign video filenames from every catalog collection.
+# Prefix autocomplete uses a sorted array of word suffixes (bisect); fuzzy matching
+# uses a trigram index. Lookups never touch MySQL: the index is loaded once and then
+# refreshed incrementally (rows with a newer updated_at) in a background thread.
+import bisect
+import math
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from fastapi import APIRouter, HTTPException, Query
+from sqlalchemy import text
+
+from prefork import after_fork
+from s3_toSQL import COLLECTION_KEY_PREFIX, COLLECTIONS, collection_for_table
+
+router = APIRouter(prefix="/search", tags=["search"])
+
+# ---------- Settings ----------
+REFRESH_INTERVAL_S = int(os.getenv("SEARCH_REFRESH_INTERVAL", "60"))
+FULL_REBUILD_S = int(os.getenv("SEARCH_FULL_REBUILD_INTERVAL", "3600"))  # picks up deleted rows
+FUZZY_MIN_SCORE = 0.3
+
+WORD_START = re.compile(r"(?:^|[^0-9a-z])([0-9a-z])")
+
+
+def normalize(s: str) -> str:
+    return re.sub(r"\s+", " ", (s or "").strip().lower())
+
+
+def trigrams(s: str) -> Set[str]:
+    padded = f"  {s} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# ---------- Index ----------
+class SignIndex:
+    """
+    Documents are (collection, s3_key) pairs. Three structures are kept in sync:
+      _suffixes  sorted [(word suffix, doc)] for prefix lookups, e.g. "12 good morning",
+                 "good morning", "morning" all point at the same doc
+      _grams     trigram -> {doc} for fuzzy candidates
+      _docs      doc -> record
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._docs: List[Optional[Dict]] = []
+        self._doc_by_key: Dict[Tuple[str, str], int] = {}
+        self._suffixes: List[Tuple[str, int]] = []
+        self._grams: Dict[str, Set[int]] = {}
+        self._watermarks: Dict[str, datetime] = {}
+        self._loaded_at = 0.0
+        self._refresher: Optional[threading.Thread] = None
+        self.stats = {"docs": 0, "refreshes": 0, "full_rebuilds": 0, "last_refresh_ms": 0.0}
+
+    # ----- mutation (callers hold the lock) -----
+    def _suffix_keys(self, name: str) -> List[str]:
+        return list(dict.fromkeys(name[m.start(1):] for m in WORD_START.finditer(name)))
+
+    def _remove(self, doc: int) -> None:
+        record = self._docs[doc]
+        if record is None:
+            return
+        for suffix in self._suffix_keys(record["filename"]):
+            i = bisect.bisect_left(self._suffixes, (suffix, doc))
+            if i < len(self._suffixes) and self._suffixes[i] == (suffix, doc):
+                del self._suffixes[i]
+        for g in trigrams(record["filename"]):
+            self._grams.get(g, set()).discard(doc)
+        self._docs[doc] = None
+
+    def _upsert(self, collection: str, row, keep_sorted: bool = True) -> None:
+        key = (collection, row.s3_key)
+        record = {
+            "collection": collection,
+            "id": row.id,
+            "filename": normalize(row.filename or ""),
+            "s3_key": row.s3_key,
+        }
+        doc = self._doc_by_key.get(key)
+        if doc is None:
+            doc = len(self._docs)
+            self._docs.append(None)
+            self._doc_by_key[key] = doc
+        else:
+            self._remove(doc)
+        self._docs[doc] = record
+        for suffix in self._suffix_keys(record["filename"]):
+            if keep_sorted:
+                bisect.insort(self._suffixes, (suffix, doc))
+            else:
+                self._suffixes.append((suffix, doc))
+        grams = trigrams(record["filename"])
+        record["_ngrams"] = len(grams)
+        for g in grams:
+            self._grams.setdefault(g, set()).add(doc)
+
+    def _apply(self, collection: str, rows, keep_sorted: bool) -> None:
+        # unsorted (bulk) loads keep only the last row per key, so _remove never
+        # has to bisect the suffix list before it is sorted
+        for row in rows if keep_sorted else {row.s3_key: row for row in rows}.values():
+            self._upsert(collection, row, keep_sorted)
+        for row in rows:
+            if row.updated_at and (collection not in self._watermarks
+                                   or row.updated_at > self._watermarks[collection]):
+                self._watermarks[collection] = row.updated_at
+
+    # ----- loading -----
+    def _fetch(self, engine, collection: str, since: Optional[datetime]):
+        sql = f"SELECT id, filename, s3_key, updated_at FROM {COLLECTIONS[collection]} WHERE 1=1"
+        params: Dict = {}
+        if collection in COLLECTION_KEY_PREFIX:
+            sql += " AND s3_key LIKE :key_prefix"
+            params["key_prefix"] = COLLECTION_KEY_PREFIX[collection] + "%"
+        if since is not None:
+            # >= so rows sharing the watermark second are not missed; upserts are idempotent
+            sql += " AND updated_at >= :since"
+            params["since"] = since
+        with engine.connect() as conn:
+            return conn.execute(text(sql), params).all()
+
+    def refresh(self, engine, collections: Optional[List[str]] = None, full: bool = False) -> int:
+        """
+        Pull new/changed rows for `collections` (default: all). A full refresh rebuilds
+        from scratch so deleted rows disappear. Returns the number of rows applied.
+        """
+        started = time.perf_counter()
+        if full:
+            fresh = SignIndex()
+            applied = fresh.refresh(engine)
+            with self._lock:
+                self._docs, self._doc_by_key = fresh._docs, fresh._doc_by_key
+                self._suffixes, self._grams = fresh._suffixes, fresh._grams
+                self._watermarks = fresh._watermarks
+                self._loaded_at = time.monotonic()
+                self.stats["full_rebuilds"] += 1
+                self.stats["docs"] = len(self._doc_by_key)
+            return applied
+
+        # decided once per call: an empty index is loaded by appending every collection
+        # and sorting the suffix array a single time at the end
+        bulk = not self._doc_by_key
+        pending = []
+        applied = 0
+        for collection in collections or list(COLLECTIONS):
+            try:
+                rows = self._fetch(engine, collection, self._watermarks.get(collection))
+            except Exception as e:
+                print(f"Search index refresh failed for {collection}: {e}")
+                continue
+            if bulk:
+                pending.append((collection, rows))
+            else:
+                with self._lock:
+                    self._apply(collection, rows, keep_sorted=True)
+            applied += len(rows)
+
+        if pending:
+            with self._lock:
+                keep_sorted = bool(self._doc_by_key)  # someone else loaded it meanwhile
+                for collection, rows in pending:
+                    self._apply(collection, rows, keep_sorted)
+                if not keep_sorted:
+                    self._suffixes.sort()
+
+        with self._lock:
+            self.stats["refreshes"] += 1
+            self.stats["docs"] = len(self._doc_by_key)
+            self.stats["last_refresh_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return applied
+
+    def ensure_loaded(self, engine) -> None:
+        """Build on first use, then keep fresh from a daemon thread."""
+        if self._refresher is not None:
+            return
+        with self._lock:
+            if self._refresher is not None:
+                return
+            self.refresh(engine, full=True)
+            self._refresher = threading.Thread(target=self._refresh_loop, args=(engine,), daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self, engine) -> None:
+        while True:
+            time.sleep(REFRESH_INTERVAL_S)
+            try:
+                full = time.monotonic() - self._loaded_at > FULL_REBUILD_S
+                self.refresh(engine, full=full)
+            except Exception as e:
+                print(f"Search index refresh failed: {e}")
+
+    # ----- queries -----
+    def autocomplete(self, prefix: str, collection: Optional[str] = None, limit: int = 10) -> List[Dict]:
+        prefix = normalize(prefix)
+        out: List[Dict] = []
+        seen: Set[int] = set()
+        with self._lock:
+            i = bisect.bisect_left(self._suffixes, (prefix, -1))
+            while i < len(self._suffixes) and len(out) < limit:
+                suffix, doc = self._suffixes[i]
+                if not suffix.startswith(prefix):
+                    break
+                i += 1
+                record = self._docs[doc]
+                if doc in seen or record is None or (collection and record["collection"] != collection):
+                    continue
+                seen.add(doc)
+                out.append(self._public(record, 1.0))
+        return out
+
+    def search(self, q: str, collection: Optional[str] = None, limit: int = 20, fuzzy: bool = True) -> List[Dict]:
+        q = normalize(q)
+        if not q:
+            return []
+        results = self.autocomplete(q, collection, limit)
+        if len(results) >= limit or not fuzzy:
+            return results
+
+        seen = {(r["collection"], r["s3_key"]) for r in results}
+        grams = trigrams(q)
+        with self._lock:
+            # prefix filtering: a doc sharing >= `need` grams must contain one of the
+            # (n - need + 1) rarest grams, so only those postings produce candidates
+            postings = sorted((self._grams.get(g, set()) for g in grams), key=len)
+            need = max(1, math.ceil(FUZZY_MIN_SCORE * len(grams)))
+            candidates: Set[int] = set()
+            for posting in postings[:len(postings) - need + 1]:
+                candidates |= posting
+            hits = {doc: sum(doc in p for p in postings) for doc in candidates}
+            scored = []
+            for doc, common in hits.items():
+                record = self._docs[doc]
+                if record is None or (collection and record["collection"] != collection):
+                    continue
+                score = common / (len(grams) + record["_ngrams"] - common)
+                if q in record["filename"]:
+                    score = max(score, 0.9)
+                if score >= FUZZY_MIN_SCORE and (record["collection"], record["s3_key"]) not in seen:
+                    scored.append((score, record["filename"], record))
+        scored.sort(key=lambda t: (-t[0], t[1]))
+        results.extend(self._public(r, round(s, 3)) for s, _, r in scored[:limit - len(results)])
+        return results
+
+    @staticmethod
+    def _public(record: Dict, score: float) -> Dict:
+        return {k: record[k] for k in ("collection", "id", "filename", "s3_key")} | {"score": score}
+
+
+sign_index = SignIndex()
+
+
+@after_fork
+def _reset_index() -> None:
+    # the refresher thread does not survive fork; start a fresh index in each worker
+    global sign_index
+    sign_index = SignIndex()
+
+
+def _engine():
+    from video_backend import engine
+    return engine
+
+
+def refresh_after_ingest(table: str) -> None:
+    """Incrementally pull rows for the collection backed by `table` (no-op for other tables)."""
+    collection = collection_for_table(table)
+    if collection and sign_index._refresher is not None:
+        sign_index.refresh(_engine(), [collection])
+
+
+# ---------- API ----------
+def _check_collection(collection: Optional[str]) -> None:
+    if collection and collection not in COLLECTIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown collection: {collection}")
+
+
+@router.get("/")
+def search_signs(
+    q: str = Query(..., min_length=1, description="Search text"),
+    collection: Optional[str] = Query(None, description="One of: " + ", ".join(COLLECTIONS)),
+    limit: int = Query(20, ge=1, le=100),
+    fuzzy: bool = Query(True),
+):
+    _check_collection(collection)
+    sign_index.ensure_loaded(_engine())
+    started = time.perf_counter()
+    results = sign_index.search(q, collection, limit, fuzzy)
+    return {"query": q, "results": results, "took_ms": round((time.perf_counter() - started) * 1000, 3)}
+
+
+@router.get("/autocomplete")
+def autocomplete_signs(
+    prefix: str = Query(..., min_length=1),
+    collection: Optional[str] = Query(None, description="One of: " + ", ".join(COLLECTIONS)),
+    limit: int = Query(10, ge=1, le=50),
+):
+    _check_collection(collection)
+    sign_index.ensure_loaded(_engine())
+    return {"prefix": prefix, "suggestions": sign_index.autocomplete(prefix, collection, limit)}
+
+
+@router.get("/stats")
+def search_stats():
+    return sign_index.stats
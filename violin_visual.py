@@ -1,7 +1,7 @@
 # app.py
 import os
-import re
 import json
+from typing import Optional
 import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
@@ -21,6 +21,13 @@ from slowapi.errors import RateLimitExceeded
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import Response
 
+from age_tables import AGE_COL, align_age_bands, band_label_mask, load_age_frames
+from catalog_snapshot import snapshot_store
+from db_guard import DB_POOL_TIMEOUT_S, GuardedReader, install_query_timeout, timeout_connect_args
+from prefork import register_engine
+from warm_cache import warm_cache
+from wire_format import WIRE_FORMAT_PATTERN, render_rows
+
 # -------------------------
 # Config / DB engine
 # -------------------------
@@ -40,10 +47,15 @@ engine = create_engine(
     poolclass=QueuePool,
     pool_size=5,
     max_overflow=10,
+    pool_timeout=DB_POOL_TIMEOUT_S,
     pool_pre_ping=True,
     pool_recycle=280,
     future=True,
+    connect_args=timeout_connect_args(),
 )
+register_engine(install_query_timeout(engine))
+# circuit breaker + last good frames per table set (served stale while MySQL is failing)
+age_db = GuardedReader(engine, "violin")
 
 # -------------------------
 # FastAPI app
@@ -90,52 +102,82 @@ def _rate_limit_handler(request, exc):  # type: ignore
 # -------------------------
 # Helpers
 # -------------------------
-def fetch_age_df(table: str = "auslan_age_2021") -> tuple[pd.DataFrame, str]:
+MAX_COMPARE_TABLES = 10
+
+
+def fetch_age_frames(tables: list[str]) -> tuple[pd.DataFrame, dict[str, str]]:
     """
-    Read an age table and return (DataFrame, value_col).
-    Assumes columns like: Age_years | <year> Auslan (e.g., '2021 Auslan')
+    load_age_frames behind the circuit breaker: while MySQL is failing, the last good
+    frames for the same tables are returned (shared, read-only) and the response is marked stale.
     """
-    query = text(f"SELECT * FROM {table}")
-    with engine.connect() as conn:
-        df = pd.read_sql_query(query, conn)
-
-    df = df.rename(columns=lambda c: c.strip())
-    # find numeric column that contains '2021' by default
-    value_cols = [c for c in df.columns if "2021" in c]
-    if not value_cols:
-        raise ValueError("No column containing '2021' found.")
-    value_col = value_cols[0]
+    return fetch_age_frames_aged(tables)[0]
 
-    df[value_col] = pd.to_numeric(df[value_col], errors="coerce").fillna(0).astype(int)
 
-    # extract start age for sorting
-    def age_start(a: str) -> int:
-        a = (a or "").lower()
-        if "100" in a:
-            return 100
-        m = re.match(r"(\d+)", a)
-        return int(m.group(1)) if m else -1
+def fetch_age_frames_aged(tables: list[str]) -> tuple[tuple[pd.DataFrame, dict[str, str]], Optional[float]]:
+    """fetch_age_frames plus the age in seconds of a stale result (None when fresh), for background callers."""
+    return age_db.fetch(("age_frames", *tables), lambda: load_age_frames(engine, tables))
 
-    if "Age_years" not in df.columns:
-        raise ValueError("Column 'Age_years' not found in table.")
 
-    df["age_start"] = df["Age_years"].map(age_start)
+def fetch_age_df(table: str = "auslan_age_2021") -> tuple[pd.DataFrame, str]:
+    """
+    Read an age table and return (DataFrame, value_col).
+    Assumes columns like: Age_years | <year> Auslan (e.g., '2021 Auslan')
+    Only the two needed columns are read; labels are categorical and counts int32.
+    """
+    df, value_col, _ = fetch_age_df_aged(table)
     return df, value_col
 
 
+def fetch_age_df_aged(table: str = "auslan_age_2021") -> tuple[pd.DataFrame, str, Optional[float]]:
+    """fetch_age_df plus the age in seconds of a stale result (None when fresh)."""
+    (frames, value_cols), stale_age = fetch_age_frames_aged([table])
+    value_col = value_cols[table]
+    df = pd.DataFrame({
+        AGE_COL: frames[AGE_COL],
+        value_col: frames["value"],
+        "age_start": frames["age_start"],
+    }, copy=False)
+    return df, value_col, stale_age
+
+
 def build_pyramid_df(df: pd.DataFrame, value_col: str, male_ratio: float = 0.51) -> pd.DataFrame:
     """
     Clean the data for pyramid and create Male/Female columns by ratio split.
+    Filters and sorts with one index array, so the result is the only copy made.
     """
-    df_plot = df.copy()
-    df_plot = df_plot[df_plot["Age_years"].notna() & df_plot[value_col].notna()]
-    df_plot = df_plot[df_plot["Age_years"].str.lower() != "age_years"]
-    df_plot = df_plot[df_plot["Age_years"].str.lower().str.contains("total") == False]
-    df_plot = df_plot.sort_values("age_start", ascending=False)
+    ages = df[AGE_COL]
+    if not isinstance(ages.dtype, pd.CategoricalDtype):
+        ages = ages.astype("category")
+
+    values = df[value_col].to_numpy()
+    age_start = df["age_start"].to_numpy()
+
+    keep = np.flatnonzero(band_label_mask(ages) & pd.notna(values))
+    idx = keep[np.argsort(-age_start[keep], kind="stable")]
 
-    df_plot["Male"] = np.floor(df_plot[value_col] * male_ratio).astype(int)
-    df_plot["Female"] = df_plot[value_col] - df_plot["Male"]
-    return df_plot
+    kept_values = values[idx].astype(np.int32)
+    male = np.floor(kept_values * male_ratio).astype(np.int32)
+    return pd.DataFrame({
+        AGE_COL: pd.Categorical.from_codes(ages.cat.codes.to_numpy()[idx], dtype=ages.dtype),
+        value_col: kept_values,
+        "age_start": age_start[idx],
+        "Male": male,
+        "Female": kept_values - male,
+    })
+
+
+def parse_compare_tables(tables: str | None, years: str | None) -> list[str]:
+    """
+    Turn ?tables=a,b or ?years=2016,2021 into a de-duplicated table list.
+    """
+    names = [t.strip() for t in (tables or "").split(",") if t.strip()]
+    names += [f"auslan_age_{y.strip()}" for y in (years or "").split(",") if y.strip()]
+    names = list(dict.fromkeys(names))
+    if not names:
+        raise HTTPException(status_code=400, detail="Provide 'tables' or 'years'.")
+    if len(names) > MAX_COMPARE_TABLES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_COMPARE_TABLES} tables per request.")
+    return names
 
 
 def make_pyramid_figure(df_plot: pd.DataFrame, title_suffix: str) -> go.Figure:
@@ -180,15 +222,62 @@ def make_pyramid_figure(df_plot: pd.DataFrame, title_suffix: str) -> go.Figure:
     )
 
     max_side = int(max(df_plot["Male"].max(), df_plot["Female"].max()) * 1.1)
+    set_symmetric_xaxis(fig, max_side)
+    fig.update_yaxes(
+        title_text=None,
+        autorange="reversed",
+    )
+    return fig
+
+
+def set_symmetric_xaxis(fig: go.Figure, max_side: int) -> None:
     fig.update_xaxes(
         range=[-max_side, max_side],
         tickvals=[-max_side, -int(max_side*0.5), 0, int(max_side*0.5), max_side],
         ticktext=[f"{max_side}", f"{int(max_side*0.5)}", "0", f"{int(max_side*0.5)}", f"{max_side}"],
         title_text="Number of people"
     )
-    fig.update_yaxes(
-        title_text=None,
-        autorange="reversed",
+
+
+def make_compare_figure(aligned: dict, tables: list[str]) -> go.Figure:
+    """
+    Animated pyramid with one frame per table, on a shared band axis and x range.
+    """
+    bands = aligned["age_bands"]
+    frames_df = [
+        pd.DataFrame({
+            AGE_COL: bands,
+            "Male": [v or 0 for v in aligned["Male"][i]],
+            "Female": [v or 0 for v in aligned["Female"][i]],
+        })
+        for i in range(len(tables))
+    ]
+
+    fig = make_pyramid_figure(frames_df[0], tables[0])
+    fig.frames = [
+        go.Frame(
+            name=table,
+            data=[
+                go.Bar(x=-d["Male"], y=d[AGE_COL], customdata=d["Male"]),
+                go.Bar(x=d["Female"], y=d[AGE_COL], customdata=d["Female"]),
+            ],
+        )
+        for table, d in zip(tables, frames_df)
+    ]
+
+    max_side = int(max(max(d["Male"].max(), d["Female"].max()) for d in frames_df) * 1.1) or 1
+    set_symmetric_xaxis(fig, max_side)
+    step_args = dict(mode="immediate", frame=dict(duration=600, redraw=True), transition=dict(duration=300))
+    fig.update_layout(
+        updatemenus=[dict(
+            type="buttons",
+            showactive=False,
+            buttons=[dict(label="Play", method="animate", args=[None, step_args])],
+        )],
+        sliders=[dict(
+            active=0,
+            steps=[dict(label=t, method="animate", args=[[t], step_args]) for t in tables],
+        )],
     )
     return fig
 
@@ -226,19 +315,38 @@ def get_age_data(request: Request):
     #     content={"Error": "Internal server error."}
     # )
 
+def age_pyramid_figure() -> tuple[go.Figure, Optional[float]]:
+    """The 2021 pyramid and the age in seconds of its data when MySQL was failing (None when fresh)."""
+    df, value_col, stale_age = fetch_age_df_aged()
+    df_plot = build_pyramid_df(df, value_col)
+    return make_pyramid_figure(df_plot, "Auslan Community Age Distribution (2021)"), stale_age
+
+
+def age_pyramid_html_page() -> tuple[str, Optional[float]]:
+    fig, stale_age = age_pyramid_figure()
+    return fig.to_html(
+        include_plotlyjs="cdn", full_html=True,
+        config={"displaylogo": False, "displayModeBar": False, "responsive": True}), stale_age
+
+
+def age_pyramid_json_body() -> tuple[str, Optional[float]]:
+    fig, stale_age = age_pyramid_figure()
+    return pio.to_json(fig, validate=True), stale_age
+
+
+# precomputed at startup and refreshed in the background (the cold query + render takes seconds)
+warm_cache.register("violin:age-pyramid", age_pyramid_html_page)
+warm_cache.register("violin:age-pyramid.json", age_pyramid_json_body)
+
+
 @app.get("/age-pyramid", response_class=HTMLResponse)
 @limiter.limit("5/10second")
 def age_pyramid_html(request:Request):
     """
-    Standalone Plotly HTML (generic)  can be embedded with <iframe>.
+    Standalone Plotly HTML (generic)  can be embedded with <iframe>. Rendered in the background (warm_cache).
     """
     try:
-        df, value_col = fetch_age_df()
-        df_plot = build_pyramid_df(df, value_col)
-        fig = make_pyramid_figure(df_plot, "Auslan Community Age Distribution (2021)")
-        html = fig.to_html(include_plotlyjs="cdn", full_html=True,
-                           config={"displaylogo": False,"displayModeBar": False, "responsive": True})
-        return HTMLResponse(content=html)
+        return HTMLResponse(content=warm_cache.get_or_compute("violin:age-pyramid"))
     except Exception as e:
         # raise HTTPException(status_code=500, detail=str(e))
         return JSONResponse(
@@ -250,13 +358,11 @@ def age_pyramid_html(request:Request):
 @limiter.limit("5/10second")
 def age_pyramid_json(request: Request):
     """
-    Plotly figure JSON (generic).
+    Plotly figure JSON (generic). Serialized in the background (warm_cache); a cold entry is
+    rendered once for all concurrent requests.
     """
     try:
-        df, value_col = fetch_age_df()
-        df_plot = build_pyramid_df(df, value_col)
-        fig = make_pyramid_figure(df_plot, "Auslan Community Age Distribution (2021)")
-        return JSONResponse(content=json.loads(pio.to_json(fig, validate=True)))
+        return Response(content=warm_cache.get_or_compute("violin:age-pyramid.json"), media_type="application/json")
     except Exception as e:
         # raise HTTPException(status_code=500, detail=str(e))
         return JSONResponse(
@@ -273,16 +379,21 @@ def age_pyramid_json(request: Request):
 def trends_age_data(
     request: Request,
     table: str = Query("auslan_age_2021", description="MySQL table name"),
-    male_ratio: float = Query(0.51, ge=0.0, le=1.0)
+    male_ratio: float = Query(0.51, ge=0.0, le=1.0),
+    fmt: Optional[str] = Query(None, alias="format", pattern=WIRE_FORMAT_PATTERN),
 ):
     """
     (Trends) Cleaned age data JSON with inferred Male/Female.
+    `?format=columnar|msgpack` (or Accept) returns the rows as parallel arrays.
     """
     try:
         df, value_col = fetch_age_df(table=table)
         df_plot = build_pyramid_df(df, value_col, male_ratio=male_ratio)
         rows = df_plot[["Age_years", value_col, "age_start", "Male", "Female"]].to_dict(orient="records")
-        return {"scope": "trends", "table": table, "value_column": value_col, "rows": rows}
+        payload = {"scope": "trends", "table": table, "value_column": value_col, "rows": rows}
+        return render_rows(request, payload, rows_key="rows", fmt=fmt)
+    except HTTPException:
+        raise
     except Exception as e:
         # raise HTTPException(status_code=500, detail=str(e))
         return JSONResponse(
@@ -336,4 +447,98 @@ def trends_age_pyramid_json(
         return JSONResponse(
             status_code=500,
             content={"Error": "Internal server error."}
-        )
\ No newline at end of file
+        )
+
+def compare_age_bands(names: list[str], male_ratio: float) -> tuple[dict, dict[str, str]]:
+    """
+    Aligned age bands of several tables, plus {table: value_col}.
+    400 for an unknown / invalid table, 404 when none of the tables has age bands.
+    """
+    try:
+        df, value_cols = fetch_age_frames(names)
+    except ValueError as e:  # raised while resolving the tables' columns
+        raise HTTPException(status_code=400, detail=str(e))
+    aligned = align_age_bands(df, names, male_ratio=male_ratio)
+    if not aligned["age_bands"]:
+        raise HTTPException(status_code=404, detail=f"No age bands found in: {', '.join(names)}")
+    return aligned, value_cols
+
+@app.get("/trends/age-compare", response_class=JSONResponse)
+@limiter.limit("5/10second")
+def trends_age_compare(
+    request: Request,
+    tables: str | None = Query(None, description="Comma separated table names"),
+    years: str | None = Query(None, description="Comma separated census years, e.g. 2016,2021"),
+    male_ratio: float = Query(0.51, ge=0.0, le=1.0)
+):
+    """
+    (Trends) Several age tables in one query, aligned on a shared list of age bands.
+    """
+    names = parse_compare_tables(tables, years)
+    try:
+        aligned, value_cols = compare_age_bands(names, male_ratio)
+        return {"scope": "trends", "tables": names, "value_columns": value_cols, **aligned}
+    except HTTPException:
+        raise
+    except Exception as e:
+        # raise HTTPException(status_code=500, detail=str(e))
+        return JSONResponse(
+            status_code=500,
+            content={"Error": "Internal server error."}
+        )
+
+@app.get("/trends/age-compare.json", response_class=JSONResponse)
+@limiter.limit("5/10second")
+def trends_age_compare_json(
+    request: Request,
+    tables: str | None = Query(None, description="Comma separated table names"),
+    years: str | None = Query(None, description="Comma separated census years, e.g. 2016,2021"),
+    male_ratio: float = Query(0.51, ge=0.0, le=1.0)
+):
+    """
+    (Trends) Animated Plotly figure JSON, one frame per table.
+    """
+    names = parse_compare_tables(tables, years)
+    try:
+        aligned, _ = compare_age_bands(names, male_ratio)
+        fig = make_compare_figure(aligned, names)
+        return JSONResponse(content=json.loads(pio.to_json(fig, validate=True)))
+    except HTTPException:
+        raise
+    except Exception as e:
+        # raise HTTPException(status_code=500, detail=str(e))
+        return JSONResponse(
+            status_code=500,
+            content={"Error": "Internal server error."}
+        )
+
+
+@app.get("/trends/age-bands", response_class=JSONResponse)
+@limiter.limit("5/10second")
+def trends_age_bands(
+    request: Request,
+    table: str = Query("auslan_age_2021", description="Source age table")
+):
+    """
+    (Trends) Precomputed age-band percentages from summary_age_band (see census_summary.py).
+    """
+    columns = ["age_band", "age_start", "population", "pct_of_total", "cumulative_pct"]
+    snap = snapshot_store.table("summary_age_band", columns + ["source_table"])
+    if snap is not None:
+        return {"scope": "trends", "table": table, "rows": snap.rows(columns, where={"source_table": table})}
+
+    sql = text("""
+        SELECT age_band, age_start, population, pct_of_total, cumulative_pct
+        FROM summary_age_band
+        WHERE source_table = :table
+        ORDER BY age_start DESC
+    """)
+    try:
+        with engine.connect() as conn:
+            rows = conn.execute(sql, {"table": table}).mappings().all()
+        return {"scope": "trends", "table": table, "rows": [dict(r) for r in rows]}
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={"Error": "Internal server error."}
+        )
@@ -0,0 +1,203 @@
+# warm_cache.py
+# Precomputed responses for the expensive dashboard endpoints, warmed at worker startup and
+# refreshed in the background so no user request pays for a cold query + figure render.
+#
+#   warm_cache.register("year:population-by-year", lambda: year_db.fetch(key, load), interval_s=300)
+#   value = warm_cache.get_or_compute("year:population-by-year")
+#
+# Loaders return (value, stale_age) like GuardedReader.fetch: stale_age is None for fresh data,
+# else the age in seconds of the last good result served while MySQL is failing. Loaders run in
+# the background, outside any request, so the entry keeps that age and every request served from
+# it is marked stale (db_guard.mark_stale).
+#
+# The scheduler runs in main.app's lifespan (one per worker):
+#   - startup: every entry is computed once, after a random 0..WARM_STARTUP_JITTER_S delay so
+#     freshly forked workers do not hit MySQL at the same instant
+#   - refresh: each entry again every interval_s (+-WARM_JITTER_PCT, random first phase)
+#   - data changes: all entries refresh when the catalog snapshot version changes (any worker
+#     published) or request_refresh() was called (ingest / summary rebuild in this worker)
+# A failed or stale refresh counts as a failure and keeps serving the previous value. /health
+# reports ready once every entry has been computed (or WARM_READY_TIMEOUT_S passed, then with
+# the failing entries listed) and lists entries serving stale data.
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import anyio
+
+from db_guard import mark_stale
+from single_flight import flight
+
+# ---------- Settings ----------
+WARM_ENABLED = os.getenv("WARM_ENABLED", "1") == "1"
+WARM_REFRESH_S = float(os.getenv("WARM_REFRESH_S", "300"))
+WARM_STARTUP_JITTER_S = float(os.getenv("WARM_STARTUP_JITTER_S", "2"))
+WARM_JITTER_PCT = float(os.getenv("WARM_JITTER_PCT", "10"))
+WARM_POLL_S = float(os.getenv("WARM_POLL_S", "5"))
+WARM_READY_TIMEOUT_S = float(os.getenv("WARM_READY_TIMEOUT_S", "60"))
+WARM_MAX_AGE_FACTOR = 3  # older than 3 missed refreshes: compute inline instead of serving
+
+
+class WarmEntry:
+    __slots__ = ("name", "fn", "interval_s", "value", "value_at", "stale", "computed_at", "last_error", "stats")
+
+    def __init__(self, name: str, fn: Callable[[], Tuple[Any, Optional[float]]], interval_s: float):
+        self.name = name
+        self.fn = fn
+        self.interval_s = interval_s
+        self.value: Any = None
+        self.value_at: Optional[float] = None  # when the value's data was last read fresh
+        self.stale = False
+        self.computed_at: Optional[float] = None  # last fresh compute; not advanced by stale results
+        self.last_error: Optional[str] = None
+        self.stats = {"refreshes": 0, "failures": 0, "inline": 0}
+
+    def fresh(self) -> bool:
+        return self.computed_at is not None and \
+            time.monotonic() - self.computed_at <= self.interval_s * WARM_MAX_AGE_FACTOR
+
+    def stale_age(self) -> Optional[float]:
+        return time.monotonic() - self.value_at if self.stale else None
+
+
+class WarmCache:
+    def __init__(self):
+        self._entries: Dict[str, WarmEntry] = {}
+        self._dirty = threading.Event()
+        self._tasks: list = []
+        self._started_at: Optional[float] = None
+
+    def register(self, name: str, fn: Callable[[], Tuple[Any, Optional[float]]],
+                 interval_s: float = WARM_REFRESH_S) -> None:
+        """Register a zero-argument (sync) function returning (value, stale_age), kept warm under `name`."""
+        self._entries[name] = WarmEntry(name, fn, interval_s)
+
+    # ---------- Reads ----------
+    def _compute(self, entry: WarmEntry) -> Tuple[Any, Optional[float]]:
+        # requests arriving during a refresh share it instead of running their own
+        value, stale_age = flight.do("warm:" + entry.name, entry.fn)
+        now = time.monotonic()
+        entry.value = value
+        if stale_age is None:
+            entry.value_at, entry.computed_at, entry.stale, entry.last_error = now, now, False, None
+        else:
+            # MySQL failing: serve the last good data marked stale, keep computed_at so the
+            # entry is retried and does not look freshly computed
+            entry.value_at, entry.stale = now - stale_age, True
+            entry.last_error = f"stale: database unavailable, serving data {stale_age:.0f}s old"
+        return value, stale_age
+
+    def get_or_compute(self, name: str) -> Any:
+        """
+        The warm value; computed inline (and stored) when missing or far past its refresh.
+        A value from a failing database marks the current request stale.
+        """
+        entry = self._entries[name]
+        if entry.fresh():
+            value, stale_age = entry.value, entry.stale_age()
+        else:
+            entry.stats["inline"] += 1
+            value, stale_age = self._compute(entry)
+        if stale_age is not None:
+            mark_stale(stale_age)
+        return value
+
+    def refresh(self, name: str) -> bool:
+        entry = self._entries[name]
+        try:
+            _, stale_age = self._compute(entry)
+        except Exception as e:
+            entry.stats["failures"] += 1
+            entry.last_error = f"{type(e).__name__}: {e}"
+            print(f"Cache warm {name} failed: {entry.last_error}")
+            return False
+        if stale_age is not None:
+            entry.stats["failures"] += 1
+            print(f"Cache warm {name} failed: {entry.last_error}")
+            return False
+        entry.stats["refreshes"] += 1
+        return True
+
+    def request_refresh(self) -> None:
+        """Data changed (ingest / summary rebuild): refresh everything at the next poll."""
+        self._dirty.set()
+
+    # ---------- Scheduler ----------
+    async def _refresh(self, name: str) -> bool:
+        return await anyio.to_thread.run_sync(self.refresh, name)
+
+    async def _entry_loop(self, entry: WarmEntry) -> None:
+        await asyncio.sleep(random.uniform(0, WARM_STARTUP_JITTER_S))
+        retry_s = 1.0
+        while not await self._refresh(entry.name) and entry.computed_at is None:
+            # not warm yet (e.g. MySQL still starting): retry with backoff up to the interval
+            await asyncio.sleep(retry_s)
+            retry_s = min(retry_s * 2, entry.interval_s)
+        # random first phase, then interval +- jitter, so workers drift apart
+        await asyncio.sleep(random.uniform(0, entry.interval_s))
+        while True:
+            await self._refresh(entry.name)
+            spread = entry.interval_s * WARM_JITTER_PCT / 100
+            await asyncio.sleep(entry.interval_s + random.uniform(-spread, spread))
+
+    async def _change_loop(self, version: Callable[[], Optional[str]]) -> None:
+        seen = version()
+        while True:
+            await asyncio.sleep(WARM_POLL_S)
+            current = version()
+            if current != seen or self._dirty.is_set():
+                seen = current
+                self._dirty.clear()
+                await asyncio.sleep(random.uniform(0, WARM_STARTUP_JITTER_S))
+                for name in list(self._entries):
+                    await self._refresh(name)
+
+    def start(self, version: Callable[[], Optional[str]] = lambda: None) -> None:
+        """Start the per-entry and data-change loops on the running event loop."""
+        self._started_at = time.monotonic()
+        if not WARM_ENABLED:
+            return
+        self._tasks = [asyncio.create_task(self._entry_loop(e)) for e in self._entries.values()]
+        self._tasks.append(asyncio.create_task(self._change_loop(version)))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # ---------- Readiness ----------
+    def ready(self) -> bool:
+        if not WARM_ENABLED:
+            return True
+        if all(e.computed_at is not None for e in self._entries.values()):
+            return True
+        return self._started_at is not None and time.monotonic() - self._started_at >= WARM_READY_TIMEOUT_S
+
+    def stale_entries(self) -> List[str]:
+        """Entries currently serving data from a failing database."""
+        return [e.name for e in self._entries.values() if e.stale]
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "ready": self.ready(),
+            "stale": self.stale_entries(),
+            "entries": {
+                e.name: {
+                    "warm": e.computed_at is not None,
+                    "stale": e.stale,
+                    "age_s": round(now - e.value_at, 1) if e.value_at is not None else None,
+                    "interval_s": e.interval_s,
+                    "last_error": e.last_error,
+                    **e.stats,
+                }
+                for e in self._entries.values()
+            },
+        }
+
+
+warm_cache = WarmCache()
@@ -0,0 +1,206 @@
+# wire_format.py
+# Compact encodings for large row listings, picked by content negotiation.
+#
+#   json      (default) the endpoint's usual payload, unchanged
+#   columnar  parallel arrays: {"columns": [...], "data": [[col0...], [col1...]], "count": n}
+#   msgpack   the columnar payload as MessagePack
+#
+# Selected with ?format= or the Accept header. In the compact forms, key/URL columns
+# use a shared-prefix (front) encoding: one common prefix plus, per row,
+# [chars shared with the previous value, remaining suffix]. URLs additionally split off
+# their query string, whose parameters are dictionary-coded when values repeat
+# (pre-signed URLs share algorithm, credential, date and expiry; only the signature differs).
+import json
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import msgpack
+except ImportError:  # optional: msgpack responses are simply not offered
+    msgpack = None
+
+# ---------- Settings ----------
+WIRE_MEDIA_TYPES = {
+    "json": "application/json",
+    "columnar": "application/vnd.auslan.columnar+json",
+    "msgpack": "application/msgpack",
+}
+ACCEPT_ALIASES = {
+    "application/x-msgpack": "msgpack",
+    "application/vnd.msgpack": "msgpack",
+}
+WIRE_FORMAT_PATTERN = "^(json|columnar|msgpack)$"
+
+
+# ---------- Negotiation ----------
+def negotiate(request: Request, fmt: Optional[str] = None) -> str:
+    """Explicit ?format= wins; otherwise the first Accept entry we can produce; else json."""
+    if fmt:
+        if fmt == "msgpack" and msgpack is None:
+            raise HTTPException(status_code=406, detail="MessagePack is not available on this server")
+        return fmt
+    for part in request.headers.get("accept", "").split(","):
+        media_type = part.split(";", 1)[0].strip().lower()
+        if media_type in ("application/json", "*/*"):
+            return "json"
+        name = ACCEPT_ALIASES.get(media_type) or next(
+            (k for k, v in WIRE_MEDIA_TYPES.items() if v == media_type), None)
+        if name and (name != "msgpack" or msgpack is not None):
+            return name
+    return "json"
+
+
+# ---------- Encoders ----------
+def _common_prefix(values: List[str]) -> str:
+    if not values:
+        return ""
+    lo, hi = min(values), max(values)  # the sorted extremes bound every shared prefix
+    n = 0
+    while n < len(lo) and n < len(hi) and lo[n] == hi[n]:
+        n += 1
+    return lo[:n]
+
+
+def front_encode(values: Sequence[Optional[str]]) -> Dict:
+    """
+    {"encoding": "front", "prefix": p, "values": [[shared, suffix] | None, ...]}
+    where value = prefix + previous_value[:shared] + suffix (previous = last non-null, minus prefix).
+    """
+    present = [v for v in values if v is not None]
+    prefix = _common_prefix(present)
+    out: List[Optional[list]] = []
+    prev = ""
+    for v in values:
+        if v is None:
+            out.append(None)
+            continue
+        rest = v[len(prefix):]
+        shared = 0
+        limit = min(len(prev), len(rest))
+        while shared < limit and prev[shared] == rest[shared]:
+            shared += 1
+        out.append([shared, rest[shared:]])
+        prev = rest
+    return {"encoding": "front", "prefix": prefix, "values": out}
+
+
+def front_decode(block: Dict) -> List[Optional[str]]:
+    """Inverse of front_encode (reference for clients)."""
+    prefix, prev, out = block["prefix"], "", []
+    for item in block["values"]:
+        if item is None:
+            out.append(None)
+            continue
+        prev = prev[:item[0]] + item[1]
+        out.append(prefix + prev)
+    return out
+
+
+def _param_block(values: List[Optional[str]]):
+    distinct = list(dict.fromkeys(v for v in values if v is not None))
+    if len(distinct) > len(values) // 2:
+        return values  # mostly unique (e.g. signatures): a dictionary would only add indices
+    index = {v: i for i, v in enumerate(distinct)}
+    return {"dict": distinct, "index": [None if v is None else index[v] for v in values]}
+
+
+def url_encode(values: Sequence[Optional[str]]) -> Dict:
+    """
+    {"encoding": "url", "path": <front block>, "params": [[name, values | {"dict", "index"}], ...]}
+    Falls back to a plain front block when URLs do not share one query-parameter layout.
+    """
+    paths: List[Optional[str]] = []
+    split_params: List[Optional[List[Tuple[str, str]]]] = []
+    for v in values:
+        if v is None:
+            paths.append(None)
+            split_params.append(None)
+            continue
+        path, _, query = v.partition("?")
+        paths.append(path)
+        split_params.append([tuple(p.partition("=")[::2]) for p in query.split("&")] if query else [])
+    layouts = {tuple(name for name, _ in ps) for ps in split_params if ps is not None}
+    if len(layouts) != 1 or not next(iter(layouts)) or any("?" not in v for v in values if v is not None):
+        return front_encode(values)
+
+    names = next(iter(layouts))
+    params = [
+        [name, _param_block([None if ps is None else ps[i][1] for ps in split_params])]
+        for i, name in enumerate(names)
+    ]
+    return {"encoding": "url", "path": front_encode(paths), "params": params}
+
+
+def url_decode(block: Dict) -> List[Optional[str]]:
+    """Inverse of url_encode (reference for clients)."""
+    if block["encoding"] == "front":
+        return front_decode(block)
+    paths = front_decode(block["path"])
+    columns = []
+    for name, values in block["params"]:
+        if isinstance(values, dict):
+            values = [None if i is None else values["dict"][i] for i in values["index"]]
+        columns.append((name, values))
+    return [
+        None if path is None else path + "?" + "&".join(f"{name}={vals[r]}" for name, vals in columns)
+        for r, path in enumerate(paths)
+    ]
+
+
+def columnar(rows: Sequence[Dict], prefix_columns: Sequence[str] = ()) -> Dict:
+    """
+    Rows of dicts -> parallel arrays; columns in first-seen order, missing values -> None.
+    `prefix_columns` holding strings are front-coded (URLs via url_encode).
+    """
+    columns: List[str] = []
+    seen = set()
+    for row in rows:
+        for k in row:
+            if k not in seen:
+                seen.add(k)
+                columns.append(k)
+    data = []
+    for c in columns:
+        values = [row.get(c) for row in rows]
+        if c in prefix_columns and all(v is None or isinstance(v, str) for v in values):
+            is_url = any(v and "://" in v for v in values)
+            data.append(url_encode(values) if is_url else front_encode(values))
+        else:
+            data.append(values)
+    return {"columns": columns, "data": data, "count": len(rows)}
+
+
+def _msgpack_default(obj):
+    if hasattr(obj, "item"):  # numpy scalars
+        return obj.item()
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    return str(obj)
+
+
+# ---------- Response ----------
+def render_rows(request: Request, payload, rows_key: Optional[str] = None,
+                fmt: Optional[str] = None, prefix_columns: Sequence[str] = ()) -> Response:
+    """
+    `payload` is what the endpoint returns today (a list of rows, or a dict holding
+    them under `rows_key`). JSON clients get it as-is; compact formats swap the rows
+    for their columnar form and keep the other keys.
+    """
+    chosen = negotiate(request, fmt)
+    headers = {"Vary": "Accept"}
+    if chosen == "json":
+        return JSONResponse(content=jsonable_encoder(payload), headers=headers)
+
+    rows = payload if rows_key is None else payload[rows_key]
+    body = columnar(rows, prefix_columns)
+    if rows_key is not None:
+        body = {**payload, rows_key: body}
+
+    if chosen == "msgpack":
+        content = msgpack.packb(body, default=_msgpack_default, use_bin_type=True)
+    else:
+        content = json.dumps(body, default=str, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return Response(content=content, media_type=WIRE_MEDIA_TYPES[chosen], headers=headers)
@@ -1,8 +1,8 @@
 # year_visual.py
 
 import os
-from typing import List, Dict, Any
-from fastapi import FastAPI, HTTPException, Request
+from typing import List, Dict, Any, Optional
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from sqlalchemy import create_engine, text
@@ -14,6 +14,12 @@ from slowapi.util import get_remote_address
 from slowapi.middleware import SlowAPIMiddleware
 from slowapi.errors import RateLimitExceeded
 
+from catalog_snapshot import snapshot_store
+from db_guard import DB_POOL_TIMEOUT_S, GuardedReader, install_query_timeout, timeout_connect_args
+from prefork import register_engine
+from warm_cache import warm_cache
+from stream_export import EXPORT_FORMAT_PATTERN, stream_table_export
+
 # Load environment variables from .env
 load_dotenv()
 
@@ -36,23 +42,32 @@ db_url = URL.create(
     database=DB_NAME,
 )
 
-# Create DB engine
+# Create DB engine (connections are lazy: a DB that is down at boot is retried per request)
 engine = None
 try:
     engine = create_engine(
         db_url,
         pool_pre_ping=True,
         pool_recycle=3600,
-        pool_timeout=30,
+        pool_timeout=DB_POOL_TIMEOUT_S,
         pool_size=5,
         max_overflow=10,
+        connect_args=timeout_connect_args(),
     )
-    with engine.connect() as conn:
-        conn.execute(text("SELECT 1"))
-    print(" Database connection successful")
+    register_engine(install_query_timeout(engine))
+except Exception as e:
+    print(" Database engine could not be created:", e)
+
+try:
+    if engine is not None:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        print(" Database connection successful")
 except Exception as e:
-    print(" Database connection failed:")
-    engine = None
+    print(" Database connection failed (will retry on demand):", e)
+
+# circuit breaker + last good result for the read endpoints
+year_db = GuardedReader(engine, "year")
 
 # Create FastAPI app
 app = FastAPI(title="Auslan Population By Year API")
@@ -83,9 +98,36 @@ def _rate_limit_handler(request, exc):  # type: ignore
 def root(request: Request):
     return {
         "message": "Welcome to Auslan Population By Year API",
-        "endpoints": ["/population-by-year", "/debug-population-year"]
+        "endpoints": ["/population-by-year", "/population-growth", "/debug-population-year", "/debug-population-year/export"]
     }
 
+def load_population_by_year():
+    """Query + clean population_diffyear (kept warm by warm_cache for /population-by-year)."""
+    sql = text("""
+        SELECT Year, population
+        FROM population_diffyear
+        WHERE Year IS NOT NULL AND population IS NOT NULL
+        ORDER BY Year
+    """)
+
+    with engine.connect() as conn:
+        rows = conn.execute(sql).mappings().all()
+        print(f"Retrieved {len(rows)} rows from population_diffyear")
+
+    # a bad row raises (TypeError / ValueError) and fails the whole response, as before
+    result: List[Dict[str, Any]] = []
+    for row in rows:
+        year = str(row["Year"]).strip()
+        population = int(float(row["population"]))
+        result.append({"year": year, "population": population})
+
+    return {"yearly_population": result}
+
+warm_cache.register(
+    "year:population-by-year",
+    lambda: year_db.fetch("population-by-year", load_population_by_year),
+)
+
 @app.get("/population-by-year")
 @limiter.limit("5/10second")
 def get_population_by_year(request: Request) -> Dict[str, Any]:
@@ -96,40 +138,51 @@ def get_population_by_year(request: Request) -> Dict[str, Any]:
     if not engine:
         raise HTTPException(status_code=500, detail="Database engine not available")
 
-    sql = text("""
-        SELECT Year, population
-        FROM population_diffyear
-        WHERE Year IS NOT NULL AND population IS NOT NULL
-        ORDER BY Year
-    """)
-
+    # precomputed at startup and refreshed in the background (warm_cache); a cold or expired
+    # entry is computed once for all concurrent requests, and while MySQL is failing the
+    # last good result is served (marked stale)
     try:
-        with engine.connect() as conn:
-            rows = conn.execute(sql).mappings().all()
-            print(f"Retrieved {len(rows)} rows from population_diffyear")
-    except SQLAlchemyError as e:
+        return warm_cache.get_or_compute("year:population-by-year")
+    except (SQLAlchemyError, TypeError, ValueError) as e:
         # print(f"Error executing query: {e}")
-        # raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
         return JSONResponse(
             status_code=500,
             content={"Error": "Internal server error."}
         )
 
-    result: List[Dict[str, Any]] = []
-    for row in rows:
-        try:
-            year = str(row["Year"]).strip()
-            population = int(float(row["population"]))
-            result.append({"year": year, "population": population})
-        except Exception as e:
-            #print(f"Skipping row due to error: {e}")
-            return JSONResponse(
+@app.get("/population-growth")
+@limiter.limit("5/10second")
+def get_population_growth(request: Request) -> Dict[str, Any]:
+    """
+    Precomputed growth rates and cumulative totals from summary_population_year
+    (built by census_summary.py after each data load; served from the catalog snapshot when published).
+    """
+    columns = ["year", "population", "change_abs", "yoy_growth_pct", "cumulative_population", "growth_since_first_pct"]
+    snap = snapshot_store.table("summary_population_year", columns)
+    if snap is not None:
+        return {"yearly_growth": snap.rows(columns)}
+
+    if not engine:
+        raise HTTPException(status_code=500, detail="Database engine not available")
+
+    sql = text("""
+        SELECT year, population, change_abs, yoy_growth_pct,
+               cumulative_population, growth_since_first_pct
+        FROM summary_population_year
+        ORDER BY year_order
+    """)
+    def load():
+        with engine.connect() as conn:
+            return [dict(r) for r in conn.execute(sql).mappings()]
+
+    try:
+        rows = year_db.read("population-growth", load)
+    except SQLAlchemyError as e:
+        return JSONResponse(
             status_code=500,
             content={"Error": "Internal server error."}
         )
-            continue
-
-    return {"yearly_population": result}
+    return {"yearly_growth": rows}
 
 @app.get("/debug-population-year")
 @limiter.limit("5/10second")
@@ -148,4 +201,19 @@ def debug_population_year(request: Request):
         return JSONResponse(
             status_code=500,
             content={"Error": "Internal server error."}
-        )
\ No newline at end of file
+        )
+
+@app.get("/debug-population-year/export")
+@limiter.limit("5/10second")
+def debug_population_year_export(
+    request: Request,
+    fmt: str = Query("ndjson", alias="format", pattern=EXPORT_FORMAT_PATTERN),
+    columns: Optional[str] = Query(None, description="Comma separated column names"),
+    limit: Optional[int] = Query(None, ge=1),
+):
+    """
+    Debug: Streams population_diffyear as NDJSON or CSV using a server-side cursor
+    """
+    if not engine:
+        raise HTTPException(status_code=500, detail="Database engine not available")
+    return stream_table_export(engine, "population_diffyear", fmt, columns, limit)